@@ -1,13 +1,27 @@
 import sys
-from fastapi import FastAPI, Request, Depends, HTTPException, WebSocket, \
-    WebSocketDisconnect, Body
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, Depends, HTTPException, WebSocket, Header, \
+    WebSocketDisconnect, Body, UploadFile, File
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 import database
 import models
-from ssh_manager import ssh_manager
+from ssh_manager import ssh_manager, new_run_log_path, parse_launch_output, PROCESS_FIELDS
+from ws_manager import manager
+from cluster import cluster, connection_key
+from job_queue import job_queue, JobContext, JobQueueFull
+from reconciler import reconciler
+from warmup import warmer
+from sidecar import sidecar_client
+from offload import offloader
+from response_cache import response_cache, conditional_response
+from timeseries import process_metrics, host_metrics
+from telemetry import registry, HTTPMetricsMiddleware, LIVE_FANOUT_SECONDS
+from tracing import TracedJSONResponse, TracingMiddleware, instrument_engine, profiler, render_json, span
+from distribution import ArtifactDistributor, file_sha256
+from transport import PROFILES as TRANSPORT_PROFILES, normalize_profile
+import config
 import crud
 from typing import List, Dict, Any
 import datetime
@@ -15,43 +29,60 @@ import json
 import asyncio
 import socket
 import logging
+import os
+import time
 import re
+import hmac
 
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="SSH Manager")
+app = FastAPI(title="SSH Manager", default_response_class=TracedJSONResponse)
+app.add_middleware(HTTPMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+instrument_engine(database.engine)
+
+registry.gauge_func("sshm_ssh_connections_open", "Open pooled SSH connections",
+                    lambda: len(ssh_manager.connections))
+registry.gauge_func("sshm_ssh_breakers_open", "Hosts with an open SSH circuit breaker",
+                    lambda: len(ssh_manager.breakers.open_keys()))
+registry.gauge_func("sshm_ws_clients", "Connected WebSocket clients",
+                    lambda: len(manager.clients))
+registry.gauge_func("sshm_ws_queue_depth", "Messages waiting in WebSocket client queues",
+                    lambda: sum(len(c.queue) for c in manager.clients.values()))
+
+# Любое изменение сущности (в том числе в другом воркере) сбрасывает её кэш ответов
+manager.listeners.append(response_cache.invalidate)
 
 # Монтируем статические файлы и шаблоны
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
-def substitute_script_params(script_content: str, params: list) -> str:
-    """Подставляет параметры вида $NAME или ${NAME} в скрипт."""
-    result = script_content
-    for p in params:
-        name = str(p.get('name', '')).strip()
-        value = str(p.get('value', ''))
-        if not name:
-            continue
-        # Экранируем одинарные кавычки для shell
-        safe_value = value.replace("'", "'\"'\"'")
-        # Шаблон: совпадает $NAME и ${NAME}
-        pattern = r'\$(?:' + re.escape(name) + r'\b|\{' + re.escape(name) + r'\})'
-        # Заменяем на значение в одинарных кавычках
-        result = re.sub(pattern, f"'{safe_value}'", result)
-    return result
+def script_params(params: list) -> List[Dict]:
+    """Параметры запуска для задания: только имя и значение (подставляются при запуске,
+    см. ssh_manager.substitute_script_params)."""
+    return [{"name": p.get('name'), "value": p.get('value')} for p in params]
+
+# Фоновые циклы сервера, отменяются при остановке
+background_tasks: List[asyncio.Task] = []
+
 
 # Создаем таблицы при старте
 @app.on_event("startup")
 async def startup():
     try:
         models.Base.metadata.create_all(bind=database.engine)
+        database.add_missing_columns()
         logger.info("Database tables created")
 
+        # Процесс-хранитель SSH-подключений (SSHM_SIDECAR_SOCKET): рестарт приложения
+        # не рвёт установленные сессии. Подключаем до настройки машин — их лимиты уходят ему
+        if config.SIDECAR_SOCKET:
+            await sidecar_client.start(ssh_manager)
+
         # Определяем текущую машину
         current_address = ssh_manager.get_current_machine_address()
         db = database.SessionLocal()
@@ -76,59 +107,167 @@ async def startup():
                             logger.warning(f"Failed to normalize username for machine {m.id}: {e}")
             except Exception as e:
                 logger.warning(f"Error while normalizing machine usernames: {e}")
+
+            for m in crud.get_machines(db, limit=None):
+                apply_machine_settings(m, db)
         finally:
             db.close()
+
+        # Шина событий и распределение SSH-подключений между воркерами
+        await cluster.start(ssh_manager, manager)
+
+        # Очередь заданий: незавершённые до рестарта задания продолжаются
+        job_queue.on_progress = lambda job_id: manager.notify(f"run:{job_id}")
+        await job_queue.start(cluster.worker_id, cluster.ring.nodes)
+
+        reconciler.on_change = lambda machine_id: manager.notify(f"processes:machine:{machine_id}")
+        await reconciler.start(ssh_manager)
+
+        # Прогрев подключений (SSHM_WARMUP=1): первый опрос процессов не ждёт рукопожатий.
+        # С хранителем подключения прогревает он сам
+        if not config.SIDECAR_SOCKET:
+            await warmer.start(ssh_manager)
+
+        # Автомат отключения хоста переключает is_active машины; пробы возвращают её в работу
+        ssh_manager.breakers.on_change = on_breaker_change
+        if config.BREAKER_PROBE_INTERVAL > 0 and ssh_manager.breakers.enabled:
+            background_tasks.append(asyncio.create_task(breaker_probe_loop()))
+
+        if config.SCRIPT_CACHE_GC_INTERVAL > 0:
+            background_tasks.append(asyncio.create_task(script_cache_gc_loop()))
     except Exception as e:
         logger.error(f"Startup error: {e}")
 
 
-# Dependency для получения БД
-def get_db():
+def on_breaker_change(key: str, state: str):
+    """Автомат отключения разомкнулся (машина оффлайн) или замкнулся (снова онлайн)."""
+    active = state == "closed"
+    changed = False
     db = database.SessionLocal()
     try:
-        yield db
+        for machine in crud.get_machines(db, limit=None):
+            if (connection_key(machine.address, machine.ssh_port, machine.username) == key
+                    and machine.is_active != active):
+                crud.update_machine_status(db, machine.id, active)
+                changed = True
+    except Exception as e:
+        logger.error(f"Error updating machine status for breaker {key}: {e}")
     finally:
         db.close()
+    if changed:
+        logger.info(f"Machine {key} is {'online' if active else 'offline'} (circuit breaker {state})")
+        manager.notify("machines")
 
 
-# WebSocket для обновлений
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(
-            f"WebSocket connected. Total connections: {len(self.active_connections)}")
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logger.info(
-            f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
+async def breaker_probe_loop():
+    """Пробные подключения к хостам, у которых истекло окно автомата.
 
-    async def broadcast(self, message: str):
-        for connection in list(self.active_connections):
+    Неактивные машины никто не опрашивает, поэтому без пробы автомат (а с ним
+    is_active) сам бы не замкнулся.
+    """
+    while True:
+        await asyncio.sleep(config.BREAKER_PROBE_INTERVAL)
+        try:
+            due = set(await ssh_manager.breaker_due_keys())
+            if not due:
+                continue
+            db = database.SessionLocal()
             try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"WebSocket broadcast error: {e}")
-                # Удаляем нерабочие соединения из списка
-                try:
-                    self.active_connections.remove(connection)
-                except ValueError:
-                    pass
+                targets = {}
+                for m in crud.get_machines(db, limit=None):
+                    key = connection_key(m.address, m.ssh_port, m.username)
+                    if key in due:
+                        targets[key] = (m.address, m.ssh_port, m.username, m.password)
+            finally:
+                db.close()
+            await asyncio.gather(*(ssh_manager.test_connection(*target) for target in targets.values()))
+        except Exception as e:
+            logger.error(f"Circuit breaker probe error: {e}")
+
+
+def relay_target(machine: models.Machine) -> Dict:
+    """Данные подключения машины для SSHManager (ретранслятор, цель relay_run)."""
+    return {"host": machine.address, "port": machine.ssh_port,
+            "username": machine.username, "password": machine.password}
+
+
+def validate_relay(db: Session, machine_data: dict, machine_id: int = None):
+    """Проверяет relay_id из запроса: ретранслятор существует, это не сама машина и он
+    подключается напрямую (ретрансляторы одного уровня). Возвращает машину-ретранслятор."""
+    if "relay_id" not in machine_data:
+        return None
+    if not machine_data["relay_id"]:
+        machine_data["relay_id"] = None
+        return None
+    try:
+        machine_data["relay_id"] = int(machine_data["relay_id"])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid relay_id")
+    relay = crud.get_machine(db, machine_data["relay_id"])
+    if not relay:
+        raise HTTPException(status_code=400, detail="Relay machine not found")
+    if relay.id == machine_id or relay.relay_id:
+        raise HTTPException(status_code=400, detail="Relay must be connected directly")
+    if machine_id is not None and crud.get_relay_members(db, machine_id):
+        raise HTTPException(status_code=400, detail="Machine is a relay for other machines")
+    return relay
+
+
+def validate_transport(machine_data: dict):
+    """Проверяет профиль транспорта из запроса и заменяет его хранимым JSON.
+    Возвращает профиль (None — настройки по умолчанию)."""
+    if "transport" not in machine_data:
+        return None
+    try:
+        profile = normalize_profile(machine_data["transport"])
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid transport profile: {e}")
+    machine_data["transport"] = json.dumps(profile) if profile else None
+    return profile
+
+
+def parse_priority(request: dict) -> int:
+    """Приоритет задания из тела запроса (по умолчанию 0); не целое число — 400."""
+    value = request.get("priority") if isinstance(request, dict) else None
+    if value is None or value == "":
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid priority: {value!r}")
+
+
+def apply_machine_settings(machine: models.Machine, db: Session):
+    """Передаёт в SSHManager настройки подключения, заданные для машины,
+    и обновляет их у машин, которые подключаются через неё."""
+    relay = crud.get_machine(db, machine.relay_id) if machine.relay_id else None
+    ssh_manager.configure_machine(
+        machine.address, machine.ssh_port, machine.username,
+        max_sessions=machine.max_sessions,
+        rate_limit=machine.rate_limit,
+        rate_burst=machine.rate_burst,
+        relay=relay_target(relay) if relay else None,
+        transport=machine.get_transport()
+    )
+    for member in crud.get_relay_members(db, machine.id):
+        apply_machine_settings(member, db)
 
 
-manager = ConnectionManager()
+# Dependency для получения БД
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 
 # API endpoints
 @app.get("/api/machines")
-async def get_machines_api(db: Session = Depends(get_db)):
+async def get_machines_api(request: Request, db: Session = Depends(get_db)):
     try:
-        machines = crud.get_machines(db)
-        return machines
+        return await response_cache.respond(request, "machines", ("machines",),
+                                            lambda: crud.get_machines(db))
     except Exception as e:
         logger.error(f"Error getting machines: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -148,13 +287,21 @@ async def create_machine_api(machine: dict, db: Session = Depends(get_db)):
         ssh_port = machine.get("ssh_port", 22)
         username = str(machine.get("username")) if machine.get("username") is not None else None
         password = machine.get("password")
-        success, message = await ssh_manager.test_connection(address, ssh_port, username, password)
+        relay = validate_relay(db, machine)
+        transport = validate_transport(machine)
+        if relay or transport:
+            # Машина площадки проверяется через ретранслятор и с заданным профилем транспорта
+            ssh_manager.configure_machine(address, ssh_port, username,
+                                          relay=relay_target(relay) if relay else None,
+                                          transport=transport)
+        success, message = await ssh_manager.test_connection(address, ssh_port, username, password,
+                                                             force=True)
         if not success:
             raise HTTPException(status_code=400, detail=f"SSH connection failed: {message}")
 
         db_machine = crud.create_machine(db, machine)
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "machines"}))
+        apply_machine_settings(db_machine, db)
+        manager.notify("machines")
         return db_machine
     except HTTPException:
         raise
@@ -165,7 +312,7 @@ async def create_machine_api(machine: dict, db: Session = Depends(get_db)):
 
 # Test SSH connection for new machine (без сохранения в БД)
 @app.post("/api/machines/test")
-async def test_ssh_connection(machine_data: dict):
+async def test_ssh_connection(machine_data: dict, db: Session = Depends(get_db)):
     """
     Тестирование SSH подключения к новой машине (без сохранения в БД)
     """
@@ -183,9 +330,16 @@ async def test_ssh_connection(machine_data: dict):
                 detail="Missing required fields: address, username, password"
             )
 
+        relay = validate_relay(db, machine_data)
+        transport = validate_transport(machine_data)
+        if relay or transport:
+            ssh_manager.configure_machine(address, ssh_port, username,
+                                          relay=relay_target(relay) if relay else None,
+                                          transport=transport)
+
         # Тестируем подключение
         success, message = await ssh_manager.test_connection(
-            address, ssh_port, username, password
+            address, ssh_port, username, password, force=True
         )
 
         return {
@@ -206,6 +360,32 @@ async def test_ssh_connection(machine_data: dict):
                             detail=f"Internal server error: {str(e)}")
 
 
+@app.get("/api/machines/readiness")
+async def get_machines_readiness_api(db: Session = Depends(get_db)):
+    """Готовность SSH-подключений по машинам: hot | connecting | backoff | cold | open | offline.
+
+    open — автомат отключения разомкнут: подключения отклоняются до пробы через retry_in сек.
+    """
+    try:
+        machines = crud.get_machines(db, limit=None)
+
+        async def readiness(machine):
+            try:
+                state = await ssh_manager.connection_readiness(machine.address, machine.ssh_port,
+                                                               machine.username)
+            except Exception as e:
+                state = {"state": "cold", "error": str(e)}
+            if not machine.is_active and state["state"] != "open":
+                return {"state": "offline"}
+            return state
+
+        states = await asyncio.gather(*(readiness(m) for m in machines))
+        return {str(m.id): state for m, state in zip(machines, states)}
+    except Exception as e:
+        logger.error(f"Error getting machines readiness: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @app.get("/api/machines/{machine_id}")
 async def get_machine_api(machine_id: int, db: Session = Depends(get_db)):
     try:
@@ -224,16 +404,20 @@ async def get_machine_api(machine_id: int, db: Session = Depends(get_db)):
 async def update_machine_api(machine_id: int, machine_data: dict,
                              db: Session = Depends(get_db)):
     try:
-        db_machine = crud.update_machine(db, machine_id, machine_data)
-        if not db_machine:
+        if not crud.get_machine(db, machine_id):
             raise HTTPException(status_code=404, detail="Machine not found")
+        validate_relay(db, machine_data, machine_id)
+        validate_transport(machine_data)
+        db_machine = crud.update_machine(db, machine_id, machine_data)
+        apply_machine_settings(db_machine, db)
 
         # Проверяем подключение после обновления
         address = db_machine.address
         ssh_port = db_machine.ssh_port
         username = str(db_machine.username) if db_machine.username is not None else None
         password = db_machine.password
-        success, message = await ssh_manager.test_connection(address, ssh_port, username, password)
+        success, message = await ssh_manager.test_connection(address, ssh_port, username, password,
+                                                             force=True)
         if not success:
             # Помечаем машину как неактивную и удаляем мёртвое соединение
             crud.update_machine_status(db, machine_id, False)
@@ -241,11 +425,10 @@ async def update_machine_api(machine_id: int, machine_data: dict,
                 await ssh_manager.remove_connection(address, ssh_port, username)
             except Exception as e:
                 logger.warning(f"Error removing connection cache: {e}")
-            await manager.broadcast(json.dumps({"type": "update", "entity": "machines"}))
+            manager.notify("machines")
             return JSONResponse(status_code=400, content={"success": False, "message": f"SSH connection failed: {message}. Machine marked inactive.", "deactivated": True})
 
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "machines"}))
+        manager.notify("machines")
         return db_machine
     except HTTPException:
         raise
@@ -257,11 +440,14 @@ async def update_machine_api(machine_id: int, machine_data: dict,
 @app.delete("/api/machines/{machine_id}")
 async def delete_machine_api(machine_id: int, db: Session = Depends(get_db)):
     try:
+        if crud.get_relay_members(db, machine_id):
+            raise HTTPException(status_code=400,
+                                detail="Machine is a relay for other machines")
         result = crud.delete_machine(db, machine_id)
         if not result:
             raise HTTPException(status_code=404, detail="Machine not found")
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "machines"}))
+        host_metrics.forget(machine_id)
+        manager.notify("machines")
         return {"message": "Machine deleted"}
     except HTTPException:
         raise
@@ -270,6 +456,96 @@ async def delete_machine_api(machine_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/api/transport/profiles")
+async def get_transport_profiles_api():
+    """Встроенные профили транспорта SSH, которые сравнивает замер."""
+    return TRANSPORT_PROFILES
+
+
+@app.post("/api/machines/{machine_id}/transport/calibrate")
+async def calibrate_transport_api(machine_id: int, request: dict = Body(default={}),
+                                  db: Session = Depends(get_db)):
+    """Замеряет профили транспорта на машине.
+
+    Тело (всё необязательно): {"profiles": ["lan", "wan"] — имена встроенных профилей,
+    "sample_bytes": объём выборки, "rounds": повторов, "apply": true — сохранить лучший
+    профиль для машины (по умолчанию только замер)}.
+    """
+    try:
+        machine = crud.get_machine(db, machine_id)
+        if not machine:
+            raise HTTPException(status_code=404, detail="Machine not found")
+        names = request.get("profiles") or list(TRANSPORT_PROFILES)
+        unknown = [name for name in names if name not in TRANSPORT_PROFILES]
+        if unknown:
+            raise HTTPException(status_code=400,
+                                detail=f"Unknown transport profiles: {', '.join(unknown)}")
+
+        calibration = await ssh_manager.calibrate_transport(
+            machine.address, machine.ssh_port, machine.username, machine.password,
+            profiles={name: TRANSPORT_PROFILES[name] for name in names},
+            sample_bytes=request.get("sample_bytes"), rounds=request.get("rounds"))
+        best = calibration["best"]
+        if best is None:
+            raise HTTPException(status_code=502, detail="No transport profile could be measured")
+
+        calibration["applied"] = False
+        if request.get("apply", False):
+            profile = normalize_profile({**TRANSPORT_PROFILES[best], "name": best})
+            machine.set_transport(profile)
+            db.commit()
+            apply_machine_settings(machine, db)
+            manager.notify("machines")
+            calibration["applied"] = True
+        return calibration
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error calibrating transport for machine {machine_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/api/relays/{relay_id}/execute")
+async def relay_execute_api(relay_id: int, request: dict = Body(...), db: Session = Depends(get_db)):
+    """Выполняет команду на машинах площадки одним запросом к ретранслятору.
+
+    request: {"command": "...", "machine_ids": [...]} — по умолчанию все активные машины площадки.
+    """
+    try:
+        command = request.get("command")
+        if not command:
+            raise HTTPException(status_code=400, detail="Missing command")
+        relay = crud.get_machine(db, relay_id)
+        if not relay:
+            raise HTTPException(status_code=404, detail="Relay machine not found")
+        members = [m for m in crud.get_relay_members(db, relay_id) if m.is_active]
+        if request.get("machine_ids"):
+            wanted = {int(i) for i in request["machine_ids"]}
+            members = [m for m in members if m.id in wanted]
+
+        results = await ssh_manager.relay_run(
+            relay.address, relay.ssh_port, relay.username, relay.password,
+            targets=[{**relay_target(m), "command": command} for m in members])
+        response = []
+        for m in members:
+            result = results.get(connection_key(m.address, m.ssh_port, m.username), {})
+            response.append({
+                "machine_id": m.id,
+                "name": m.name,
+                "success": result.get("exit_status") == 0,
+                "exit_status": result.get("exit_status"),
+                "stdout": result.get("stdout", ""),
+                "stderr": result.get("stderr", ""),
+                "error": result.get("error"),
+            })
+        return {"relay_id": relay_id, "results": response}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error executing command via relay {relay_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @app.post("/api/machines/{machine_id}/test")
 async def test_machine_connection(machine_id: int,
                                   db: Session = Depends(get_db)):
@@ -280,13 +556,13 @@ async def test_machine_connection(machine_id: int,
 
         success, message = await ssh_manager.test_connection(
             machine.address, machine.ssh_port, machine.username,
-            machine.password
+            machine.password, force=True
         )
 
         if success:
             # Обновляем статус
             crud.update_machine_status(db, machine_id, True)
-            await manager.broadcast(json.dumps({"type": "update", "entity": "machines"}))
+            manager.notify("machines")
             return {"success": True, "message": message}
         else:
             # Помечаем машину как неактивную и удаляем мёртвое соединение
@@ -295,7 +571,7 @@ async def test_machine_connection(machine_id: int,
                 await ssh_manager.remove_connection(machine.address, machine.ssh_port, machine.username)
             except Exception as e:
                 logger.warning(f"Error removing connection cache: {e}")
-            await manager.broadcast(json.dumps({"type": "update", "entity": "machines"}))
+            manager.notify("machines")
             return {"success": False, "message": message, "deactivated": True} 
 
     except HTTPException:
@@ -340,8 +616,7 @@ async def batch_test_machines(db: Session = Depends(get_db)):
                     "deactivated": True
                 })
 
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "machines"}))
+        manager.notify("machines")
         return results
     except Exception as e:
         logger.error(f"Error batch testing machines: {e}")
@@ -390,25 +665,27 @@ async def get_script_api(script_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/api/scripts")
-async def get_scripts_api(db: Session = Depends(get_db)):
+async def get_scripts_api(request: Request, db: Session = Depends(get_db)):
     try:
-        scripts = crud.get_scripts(db)
-        result = []
-        for s in scripts:
-            # Парсим параметры из JSON-поля
-            try:
-                params = json.loads(s.parameters) if s.parameters else []
-            except:
-                params = []
-            result.append({
-                'id': s.id,
-                'name': s.name,
-                'content': s.content,
-                'created_at': s.created_at.isoformat() if s.created_at else None,
-                'updated_at': s.updated_at.isoformat() if s.updated_at else None,
-                'parameters': params
-            })
-        return result
+        def build():
+            result = []
+            for s in crud.get_scripts(db):
+                # Парсим параметры из JSON-поля
+                try:
+                    params = json.loads(s.parameters) if s.parameters else []
+                except:
+                    params = []
+                result.append({
+                    'id': s.id,
+                    'name': s.name,
+                    'content': s.content,
+                    'created_at': s.created_at.isoformat() if s.created_at else None,
+                    'updated_at': s.updated_at.isoformat() if s.updated_at else None,
+                    'parameters': params
+                })
+            return result
+
+        return await response_cache.respond(request, "scripts", ("scripts",), build)
     except Exception as e:
         logger.error(f"Error getting scripts: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -420,6 +697,7 @@ async def create_script_api(script: dict=Body(...), db: Session = Depends(get_db
         params = script.pop('params', [])
         script['parameters'] = json.dumps(params)  # ← сериализация
         db_script = crud.create_script(db, script)
+        manager.notify("scripts")
         return db_script
     except Exception as e:
         logger.error(f"Error creating script: {e}")
@@ -466,6 +744,7 @@ async def update_script_api(script_id: int, script_dict=Body(...),
         updated_script = crud.update_script(db, script_id, script_dict)
         if not updated_script:
             raise HTTPException(status_code=404, detail="Script not found")
+        manager.notify("scripts")
 
         return {
             "id": updated_script.id,
@@ -488,8 +767,7 @@ async def delete_script_api(script_id: int, db: Session = Depends(get_db)):
         result = crud.delete_script(db, script_id)
         if not result:
             raise HTTPException(status_code=404, detail="Script not found")
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "scripts"}))
+        manager.notify("scripts")
         return {"message": "Script deleted"}
     except HTTPException:
         raise
@@ -529,18 +807,27 @@ async def execute_script_api(script_id: int, request: dict, db: Session = Depend
                         db.commit()
                     else:
                         crud.create_parameter(db, {"name": name, "value": value, "description": description})
-                    await manager.broadcast(json.dumps({"type": "update", "entity": "parameters"}))
+                    manager.notify("parameters")
 
-        # Подстановка параметров в скрипт (единожды)
-        final_script_content = substitute_script_params(script.content, params)
-
-        # Запуск в фоне
-        asyncio.create_task(execute_script_background_content(final_script_content, machine_ids, script_id))
+        # Ставим запуск в очередь заданий: скрипт как есть, параметры — окружением
+        try:
+            job = job_queue.submit(db, "script", {
+                "steps": [{
+                    "script_id": script_id,
+                    "content": script.content,
+                    "params": script_params(params),
+                    "machine_ids": machine_ids,
+                    "command": f"exec_script_{script_id or 'custom'}"
+                }]
+            }, priority=parse_priority(request), progress_total=len(machine_ids))
+        except JobQueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
 
         return {
-            "message": f"Script execution started on {len(machine_ids)} machines",
+            "message": f"Script execution queued for {len(machine_ids)} machines",
             "script_id": script_id,
-            "machine_count": len(machine_ids)
+            "machine_count": len(machine_ids),
+            "job_id": job.id
         }
 
     except HTTPException:
@@ -550,42 +837,232 @@ async def execute_script_api(script_id: int, request: dict, db: Session = Depend
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-async def execute_script_background_content(script_content: str, machine_ids: List[int], originating_script_id: int = None):
-    """Фоновая задача выполнения скрипта по переданному контенту"""
-    db = database.SessionLocal()
-    try:
-        for machine_id in machine_ids:
-            machine = crud.get_machine(db, machine_id)
-            if machine and machine.is_active:
-                success, stdout, stderr = await ssh_manager.execute_script(
-                    machine.address, machine.ssh_port, machine.username,
-                    machine.password,
-                    script_content
-                )
+@job_queue.handler("script")
+@job_queue.handler("profile")
+async def run_script_steps_job(ctx: JobContext):
+    """Задание запуска: шаги выполняются по порядку, машины шага — параллельно."""
+    for step_index, step in enumerate(ctx.payload.get("steps", [])):
+        if ctx.is_cancelled():
+            return
+        pending = [mid for mid in step.get("machine_ids", []) if not ctx.is_done(step_index, mid)]
+        await asyncio.gather(*(
+            run_script_step_on_machine(ctx, step_index, step, machine_id)
+            for machine_id in pending
+        ))
+
+
+async def run_script_step_on_machine(ctx: JobContext, step_index: int, step: dict, machine_id: int):
+    async with ctx.machine_semaphore:
+        if ctx.is_cancelled():
+            return
+        machine = crud.get_machine(ctx.db, machine_id)
+        if not machine or not machine.is_active:
+            ctx.record(step_index, machine_id, False, "Machine not found or inactive", attempts=0)
+            return
+
+        address, port, username, password = machine.address, machine.ssh_port, machine.username, machine.password
+        machine_name = machine.name
+
+        log_path = new_run_log_path()
+        launched = {}
+
+        async def launch():
+            success, stdout, stderr = await ssh_manager.execute_script(
+                address, port, username, password, step["content"], params=step.get("params"),
+                log_path=log_path
+            )
+            if success:
+                launched["pid"], launched["pid_start"] = parse_launch_output(stdout)
+            return success, stderr
+
+        success, message, attempts = await ctx.retry(launch)
+
+        process_data = {
+            "machine_id": machine_id,
+            "script_id": step.get("script_id"),
+            "command": step.get("command") or f"exec_script_{step.get('script_id') or 'custom'}",
+            "status": "running" if success else "error",
+            "pid": launched.get("pid"),
+            "pid_start": launched.get("pid_start"),
+            "log_path": log_path
+        }
+        crud.create_process(ctx.db, process_data)
+        ctx.record(step_index, machine_id, success, message or None, attempts)
+        manager.notify(f"processes:machine:{machine_id}")
+        logger.info(f"Executed script on {machine_name}: {'success' if success else 'failed'}")
 
-                process_data = {
-                    "machine_id": machine_id,
-                    "script_id": originating_script_id,
-                    "command": f"exec_script_{originating_script_id or 'custom'}",
-                    "status": "running" if success else "error",
-                    "pid": None
-                }
-                crud.create_process(db, process_data)
-                logger.info(f"Executed script on {machine.name}: {'success' if success else 'failed'}")
 
+# Job endpoints
+@app.get("/api/jobs")
+async def get_jobs_api(db: Session = Depends(get_db)):
+    try:
+        return [j.to_dict() for j in crud.get_jobs(db)]
     except Exception as e:
-        logger.error(f"Error in background script execution: {e}")
+        logger.error(f"Error getting jobs: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_api(job_id: int, db: Session = Depends(get_db)):
+    job = crud.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = job.to_dict()
+    result["results"] = [r.to_dict() for r in crud.get_job_results(db, job_id)]
+    return result
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job_api(job_id: int, db: Session = Depends(get_db)):
+    job = crud.cancel_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    manager.notify(f"run:{job_id}")
+    return job.to_dict()
+
+
+async def gc_script_caches(max_age_days: int) -> List[Dict[str, Any]]:
+    """Чистит кэш скриптов на всех активных машинах параллельно."""
+    db = database.SessionLocal()
+    try:
+        machines = [m for m in crud.get_machines(db, limit=None) if m.is_active]
     finally:
         db.close()
 
+    async def gc_one(machine):
+        success, removed = await ssh_manager.gc_script_cache(
+            machine.address, machine.ssh_port, machine.username, machine.password, max_age_days
+        )
+        return {"machine_id": machine.id, "name": machine.name, "success": success, "removed": removed}
+
+    return await asyncio.gather(*(gc_one(m) for m in machines))
+
+
+async def script_cache_gc_loop():
+    while True:
+        await asyncio.sleep(config.SCRIPT_CACHE_GC_INTERVAL)
+        try:
+            results = await gc_script_caches(config.SCRIPT_CACHE_MAX_AGE_DAYS)
+            logger.info(f"Script cache GC removed {sum(r['removed'] for r in results)} files")
+        except Exception as e:
+            logger.error(f"Script cache GC error: {e}")
+
+
+@app.post("/api/script-cache/gc")
+async def gc_script_cache_api(request: dict = Body(default={})):
+    try:
+        max_age_days = int(request.get("max_age_days", config.SCRIPT_CACHE_MAX_AGE_DAYS))
+        return await gc_script_caches(max_age_days)
+    except Exception as e:
+        logger.error(f"Error running script cache GC: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+# Artifact endpoints
+def artifact_path(name: str) -> str:
+    safe_name = os.path.basename(name or "")
+    if not safe_name or safe_name.startswith("."):
+        raise HTTPException(status_code=400, detail="Invalid artifact name")
+    return os.path.join(config.ARTIFACTS_DIR, safe_name)
+
+
+@app.get("/api/artifacts")
+async def get_artifacts_api():
+    if not os.path.isdir(config.ARTIFACTS_DIR):
+        return []
+    result = []
+    for name in sorted(os.listdir(config.ARTIFACTS_DIR)):
+        path = os.path.join(config.ARTIFACTS_DIR, name)
+        if os.path.isfile(path) and not name.startswith("."):
+            result.append({"name": name, "size": os.path.getsize(path)})
+    return result
+
+
+@app.post("/api/artifacts")
+async def upload_artifact_api(file: UploadFile = File(...)):
+    try:
+        os.makedirs(config.ARTIFACTS_DIR, exist_ok=True)
+        path = artifact_path(file.filename)
+        tmp_path = path + ".upload"
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await file.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        checksum = await asyncio.get_running_loop().run_in_executor(None, file_sha256, path)
+        return {"name": os.path.basename(path), "size": os.path.getsize(path), "sha256": checksum}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error uploading artifact: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/api/artifacts/distribute")
+async def distribute_artifact_api(request: dict, db: Session = Depends(get_db)):
+    """Раздача артефакта на машины (в очереди заданий)"""
+    name = request.get("name")
+    remote_path = request.get("remote_path")
+    machine_ids = request.get("machine_ids", [])
+    if not name or not remote_path or not machine_ids:
+        raise HTTPException(status_code=400, detail="name, remote_path and machine_ids are required")
+    if not os.path.isfile(artifact_path(name)):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+
+    try:
+        job = job_queue.submit(db, "distribute", {
+            "name": os.path.basename(name),
+            "remote_path": remote_path,
+            "machine_ids": machine_ids,
+            "seeds": request.get("seeds"),
+            "fanout": request.get("fanout")
+        }, priority=parse_priority(request), progress_total=len(machine_ids))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"message": f"Distribution queued for {len(machine_ids)} machines", "job_id": job.id}
+
+
+@job_queue.handler("distribute")
+async def distribute_artifact_job(ctx: JobContext):
+    payload = ctx.payload
+    targets = []
+    for machine_id in payload.get("machine_ids", []):
+        if ctx.is_done(0, machine_id):
+            continue
+        machine = crud.get_machine(ctx.db, machine_id)
+        if not machine or not machine.is_active:
+            ctx.record(0, machine_id, False, "Machine not found or inactive", attempts=0)
+            continue
+        targets.append({
+            "machine_id": machine.id,
+            "name": machine.name,
+            "host": machine.address,
+            "port": machine.ssh_port,
+            "username": machine.username,
+            "password": machine.password
+        })
+    if not targets:
+        return
+
+    def on_result(result: dict):
+        ctx.record(0, result["machine_id"], result["success"], json.dumps(result))
+
+    distributor = ArtifactDistributor(ssh_manager)
+    await distributor.distribute(
+        artifact_path(payload["name"]), payload["remote_path"], targets,
+        seeds=payload.get("seeds"), fanout=payload.get("fanout"), on_result=on_result
+    )
+
 
 # Parameter endpoints
 @app.get('/api/parameters')
-async def get_parameters_api(db: Session = Depends(get_db)):
+async def get_parameters_api(request: Request, db: Session = Depends(get_db)):
     try:
-        params = crud.get_parameters(db)
         # return simplified dicts
-        return [p.to_dict() for p in params]
+        return await response_cache.respond(request, "parameters", ("parameters",),
+                                            lambda: [p.to_dict() for p in crud.get_parameters(db)])
     except Exception as e:
         logger.error(f"Error getting parameters: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -603,7 +1080,7 @@ async def create_parameter_api(parameter_data: dict, db: Session = Depends(get_d
         if existing:
             raise HTTPException(status_code=400, detail='Parameter with this name already exists')
         p = crud.create_parameter(db, { 'name': name, 'value': value, 'description': description })
-        await manager.broadcast(json.dumps({"type": "update", "entity": "parameters"}))
+        manager.notify("parameters")
         return p.to_dict()
     except HTTPException:
         raise
@@ -614,10 +1091,10 @@ async def create_parameter_api(parameter_data: dict, db: Session = Depends(get_d
 
 # Profile endpoints
 @app.get("/api/profiles")
-async def get_profiles_api(db: Session = Depends(get_db)):
+async def get_profiles_api(request: Request, db: Session = Depends(get_db)):
     try:
-        profiles = crud.get_profiles(db)
-        return profiles
+        return await response_cache.respond(request, "profiles", ("profiles",),
+                                            lambda: crud.get_profiles(db))
     except Exception as e:
         logger.error(f"Error getting profiles: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -648,6 +1125,7 @@ async def create_profile_api(request: dict, db: Session = Depends(get_db)):
         }
 
         profile = crud.create_profile(db, profile_data)
+        manager.notify("profiles")
         return {"id": profile.id, "name": profile.name}
 
     except HTTPException:
@@ -683,6 +1161,7 @@ async def update_profile_api(profile_id: int, request: dict, db: Session = Depen
         }
 
         profile = crud.update_profile(db, profile_id, profile_data)
+        manager.notify("profiles")
         return {"id": profile.id, "name": profile.name}
 
     except HTTPException:
@@ -706,8 +1185,7 @@ async def delete_profile_api(profile_id: int, db: Session = Depends(get_db)):
         result = crud.delete_profile(db, profile_id)
         if not result:
             raise HTTPException(status_code=404, detail="Profile not found")
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "profiles"}))
+        manager.notify("profiles")
         return {"message": "Profile deleted"}
     except HTTPException:
         raise
@@ -722,6 +1200,13 @@ async def execute_profile_api(
     request: Request,
     db: Session = Depends(get_db)
 ):
+    """Ставит выполнение профиля в очередь заданий (тело необязательно: {"priority": 0}).
+
+    Ответ: {"message", "job_id", "results"}. Раньше профиль выполнялся прямо в запросе
+    и results содержал исход каждого запуска ({"script", "machine", "success"}); теперь
+    в results — поставленные в очередь запуски ({"script", "machine", "machine_id",
+    "status": "queued"}), а их исход — в GET /api/jobs/{job_id}.
+    """
     try:
         # Получаем профиль как модель (не dict!)
         profile = crud.get_profile(db, profile_id)
@@ -737,7 +1222,9 @@ async def execute_profile_api(
         # Фильтруем только включенные шаги
         profile_scripts = [ps for ps in profile_scripts if getattr(ps, 'enabled', True)]
 
-        results = []
+        steps = []
+        progress_total = 0
+        queued = []
 
         for ps in profile_scripts:
             script = crud.get_script(db, ps.script_id)
@@ -767,42 +1254,36 @@ async def execute_profile_api(
 
             combined_params = [{"name": k, "value": v} for k, v in param_dict.items()]
 
-            # Подставляем в скрипт
-            final_script_content = substitute_script_params(script.content, combined_params)
-
-            # Запуск на машинах
+            steps.append({
+                "script_id": script.id,
+                "content": script.content,
+                "params": combined_params,
+                "machine_ids": machine_ids,
+                "command": f"Profile: {profile.name} - {script.name}"
+            })
+            progress_total += len(machine_ids)
             for machine_id in machine_ids:
                 machine = crud.get_machine(db, machine_id)
-                if not machine or not machine.is_active:
-                    continue
-
-                success, stdout, stderr = await ssh_manager.execute_script(
-                    machine.address,
-                    machine.ssh_port,
-                    machine.username,
-                    machine.password,
-                    final_script_content
-                )
+                queued.append({"script": script.name, "machine": machine.name if machine else None,
+                               "machine_id": machine_id, "status": "queued"})
 
-                # Сохраняем процесс (опционально)
-                process_data = {
-                    "machine_id": machine_id,
-                    "script_id": script.id,
-                    "command": f"Profile: {profile.name} - {script.name}",
-                    "status": "running" if success else "error",
-                    "pid": None
-                }
-                crud.create_process(db, process_data)
+        try:
+            body = await request.json()
+        except Exception:
+            body = {}
+        priority = parse_priority(body)
 
-                results.append({
-                    "script": script.name,
-                    "machine": machine.name,
-                    "success": success
-                })
+        # Шаги выполняются очередью заданий по порядку
+        try:
+            job = job_queue.submit(db, "profile", {"profile_id": profile.id, "steps": steps},
+                                   priority=priority, progress_total=progress_total)
+        except JobQueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
 
-        await manager.broadcast(json.dumps({"type": "update", "entity": "processes"}))
-        return {"message": f"Profile '{profile.name}' executed", "results": results}
+        return {"message": f"Profile '{profile.name}' queued", "job_id": job.id, "results": queued}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Profile execution error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -868,8 +1349,7 @@ async def create_user_api(user: dict, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="User already exists")
 
         db_user = crud.create_user(db, user)
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "users"}))
+        manager.notify("users")
         return db_user
     except HTTPException:
         raise
@@ -885,8 +1365,7 @@ async def update_user_api(user_id: int, user_data: dict,
         db_user = crud.update_user(db, user_id, user_data)
         if not db_user:
             raise HTTPException(status_code=404, detail="User not found")
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "users"}))
+        manager.notify("users")
         return db_user
     except HTTPException:
         raise
@@ -901,8 +1380,7 @@ async def delete_user_api(user_id: int, db: Session = Depends(get_db)):
         result = crud.delete_user(db, user_id)
         if not result:
             raise HTTPException(status_code=404, detail="User not found")
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "users"}))
+        manager.notify("users")
         return {"message": "User deleted"}
     except HTTPException:
         raise
@@ -912,49 +1390,132 @@ async def delete_user_api(user_id: int, db: Session = Depends(get_db)):
 
 
 # Process endpoints
+PROCESS_TABLE_FIELDS = ("machine",) + PROCESS_FIELDS
+# Средний размер строки ps aux — для оценки объёма ответа перед сериализацией
+PROCESS_ROW_BYTES = 120
+
+
+def machine_info(machine: models.Machine) -> Dict:
+    return {"id": machine.id, "name": machine.name, "address": machine.address,
+            "is_current": machine.is_current}
+
+
+def build_process_table(polled) -> Dict:
+    """Процессы нескольких машин по столбцам: имена полей один раз, затем массивы значений.
+
+    polled — пары (machine_info, столбцы из poll_machine). Данные машины хранятся один раз
+    в machines, столбец machine — индекс в этом списке.
+    """
+    machines = []
+    columns = {field: [] for field in PROCESS_TABLE_FIELDS}
+    for index, (machine, processes) in enumerate(polled):
+        machines.append(machine)
+        columns["machine"].extend([index] * len(processes["pid"]))
+        for field in PROCESS_FIELDS:
+            columns[field].extend(processes[field])
+    return {
+        "count": len(columns["pid"]),
+        "machines": machines,
+        "fields": list(PROCESS_TABLE_FIELDS),
+        "columns": [columns[field] for field in PROCESS_TABLE_FIELDS],
+    }
+
+
+def process_table_rows(table: Dict) -> List[Dict]:
+    """Прежний построчный формат (layout=rows) для внешних клиентов API."""
+    machines = [{"machine_host": m["address"], "machine_id": m["id"], "machine_name": m["name"],
+                 "machine_address": m["address"], "machine_is_current": m["is_current"]}
+                for m in table["machines"]]
+    rows = []
+    for machine_index, *values in zip(*table["columns"]):
+        row = dict(zip(PROCESS_FIELDS, values))
+        row.update(machines[machine_index])
+        rows.append(row)
+    return rows
+
+
+def render_process_table(polled, layout: str, extra: Dict) -> bytes:
+    """Собирает и сериализует ответ со списком процессов; для больших списков — в пуле offloader."""
+    table = build_process_table(polled)
+    if layout == "rows":
+        content = {"count": table["count"], "processes": process_table_rows(table)}
+    else:
+        content = table
+    content.update(extra)
+    with span("json", "render"):
+        return render_json(content)
+
+
+async def process_table_response(request: Request, polled, layout: str, extra: Dict) -> Response:
+    rows = sum(len(processes["pid"]) for _machine, processes in polled)
+    body = await offloader.run(render_process_table, polled, layout, extra,
+                               size=rows * PROCESS_ROW_BYTES)
+    # Живые данные не кэшируются, но неизменившийся список не пересылается (304) и сжимается
+    return await conditional_response(request, body)
+
+
 @app.get("/api/processes/live")
-async def get_live_processes(process_filter: str = None,
+async def get_live_processes(request: Request, process_filter: str = None, layout: str = "columns",
                              db: Session = Depends(get_db)):
-    """Получение процессов со всех машин в реальном времени"""
+    """Получение процессов со всех машин в реальном времени.
+
+    По умолчанию — столбцовый формат (см. build_process_table), layout=rows — список объектов.
+    """
     try:
         machines = crud.get_machines(db)
         active_machines = [m for m in machines if m.is_active]
 
-        all_processes = []
+        polled = []
 
-        # Собираем процессы параллельно
-        tasks = []
-        for machine in active_machines:
-            task = ssh_manager.get_processes_from_machine(
+        async def poll_direct(machine):
+            return [await ssh_manager.poll_machine(
                 host=machine.address,
                 port=machine.ssh_port,
                 username=machine.username,
                 password=machine.password,
                 process_filter=process_filter
-            )
-            tasks.append((machine, asyncio.create_task(task)))
+            )]
+
+        async def poll_site(relay, members):
+            # Машины площадки — одним запросом к ретранслятору
+            polls = await ssh_manager.relay_poll(
+                relay.address, relay.ssh_port, relay.username, relay.password,
+                targets=[relay_target(m) for m in members], process_filter=process_filter)
+            return [polls[connection_key(m.address, m.ssh_port, m.username)] for m in members]
+
+        # Собираем процессы параллельно
+        fanout_started = time.perf_counter()
+        tasks = []
+        sites: Dict[int, List[models.Machine]] = {}
+        for machine in active_machines:
+            if machine.relay_id:
+                sites.setdefault(machine.relay_id, []).append(machine)
+            else:
+                tasks.append(([machine], asyncio.create_task(poll_direct(machine))))
+        relays = {m.id: m for m in machines}
+        for relay_id, members in sites.items():
+            relay = relays.get(relay_id) or crud.get_machine(db, relay_id)
+            if relay is None:
+                logger.error(f"Relay {relay_id} not found for {len(members)} machines")
+                continue
+            tasks.append((members, asyncio.create_task(poll_site(relay, members))))
 
         # Ждем завершения всех задач
-        for machine, task in tasks:
+        for members, task in tasks:
             try:
-                processes = await task
-                for process in processes:
-                    process.update({
-                        'machine_id': machine.id,
-                        'machine_name': machine.name,
-                        'machine_address': machine.address,
-                        'machine_is_current': machine.is_current
-                    })
-                all_processes.extend(processes)
+                for machine, poll in zip(members, await task):
+                    processes = poll["processes"]
+                    # Неудачный опрос не записываем: пустой список стёр бы историю машины
+                    if "error" not in poll:
+                        process_metrics.record(machine.id, processes, complete=not process_filter)
+                        host_metrics.record(machine.id, poll["host"])
+                    polled.append((machine_info(machine), processes))
             except Exception as e:
-                logger.error(
-                    f"Error getting processes from {machine.name}: {e}")
+                logger.error(f"Error getting processes from {', '.join(m.name for m in members)}: {e}")
+        LIVE_FANOUT_SECONDS.observe(time.perf_counter() - fanout_started)
 
-        return {
-            "count": len(all_processes),
-            "processes": all_processes,
-            "machines_scanned": len(active_machines)
-        }
+        return await process_table_response(request, polled, layout,
+                                            {"machines_scanned": len(active_machines)})
 
     except Exception as e:
         logger.error(f"Error getting live processes: {e}")
@@ -962,45 +1523,47 @@ async def get_live_processes(process_filter: str = None,
 
 
 @app.get("/api/processes/live/{machine_id}")
-async def get_machine_live_processes(machine_id: int,
+async def get_machine_live_processes(request: Request, machine_id: int,
                                      process_filter: str = None,
+                                     layout: str = "columns",
                                      db: Session = Depends(get_db)):
-    """Получение процессов с конкретной машины"""
+    """Получение процессов с конкретной машины (формат — как у /api/processes/live)"""
     try:
         machine = crud.get_machine(db, machine_id)
         if not machine:
             raise HTTPException(status_code=404, detail="Machine not found")
 
         if not machine.is_active:
-            return {
+            response = {
                 "machine_id": machine_id,
                 "machine_name": machine.name,
                 "error": "Machine is offline",
-                "processes": []
             }
+            return await process_table_response(request, [], layout, response)
 
-        processes = await ssh_manager.get_processes_from_machine(
+        poll = await ssh_manager.poll_machine(
             host=machine.address,
             port=machine.ssh_port,
             username=machine.username,
             password=machine.password,
             process_filter=process_filter
         )
+        processes = poll["processes"]
+        if "error" not in poll:
+            process_metrics.record(machine.id, processes, complete=not process_filter)
+            host_metrics.record(machine.id, poll["host"])
 
-        # Добавляем информацию о машине
-        for process in processes:
-            process.update({
-                'machine_id': machine.id,
-                'machine_name': machine.name,
-                'machine_address': machine.address
-            })
-
-        return {
+        extra = {
             "machine_id": machine_id,
             "machine_name": machine.name,
-            "process_count": len(processes),
-            "processes": processes
+            "process_count": len(processes["pid"]),
         }
+        if "error" in poll:
+            extra["error"] = poll["error"]
+        if "exited" in poll:
+            # Агент событий процессов: завершившиеся недавно, в том числе короткоживущие
+            extra["exited"] = poll["exited"]
+        return await process_table_response(request, [(machine_info(machine), processes)], layout, extra)
 
     except HTTPException:
         raise
@@ -1009,6 +1572,37 @@ async def get_machine_live_processes(machine_id: int,
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/api/metrics/processes")
+async def get_process_metrics_api(machine_id: int = None, pid: int = None, window: float = None):
+    """Ряды CPU/памяти процессов (для спарклайнов), собранные при опросе процессов."""
+    since = time.time() - window if window else None
+    return process_metrics.get_series(machine_id, pid, since)
+
+
+@app.get("/api/metrics/processes/top")
+async def get_top_processes_api(n: int = 10, window: float = 600, field: str = "cpu",
+                                machine_id: int = None):
+    """Процессы с наибольшим средним значением поля за последние window секунд."""
+    try:
+        return process_metrics.top(n, window, field, machine_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/metrics/hosts")
+async def get_hosts_metrics_api():
+    """Последние метрики всех машин (загрузка, CPU, память, диск)."""
+    return host_metrics.get_latest()
+
+
+@app.get("/api/metrics/hosts/{machine_id}")
+async def get_host_metrics_api(machine_id: int, window: float = None):
+    series = host_metrics.get_series(machine_id, time.time() - window if window else None)
+    if series is None:
+        raise HTTPException(status_code=404, detail="No metrics for this machine")
+    return series
+
+
 @app.post("/api/processes/kill/{machine_id}/{pid}")
 async def kill_process_api(machine_id: int, pid: int, request: dict,
                            db: Session = Depends(get_db)):
@@ -1061,55 +1655,159 @@ async def kill_process_api(machine_id: int, pid: int, request: dict,
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/processes")
-async def get_processes_api(db: Session = Depends(get_db)):
-    processes = crud.get_processes(db)
-    result = []
-    for p in processes:
-        result.append({
-            "id": p.id,
-            "machine_id": p.machine_id,
-            "machine_name": p.machine.name if p.machine else f"Машина #{p.machine_id}",
-            "script_id": p.script_id,
-            "script_name": p.script.name if p.script else "Без сценария",
-            "command": p.command,
-            "status": p.status,
-            "pid": p.pid,
-            "started_at": p.started_at.isoformat() if p.started_at else None,
-            "stopped_at": p.stopped_at.isoformat() if p.stopped_at else None
-        })
-    return result
+async def get_processes_api(request: Request, db: Session = Depends(get_db)):
+    def build():
+        result = []
+        for p in crud.get_processes(db):
+            result.append({
+                "id": p.id,
+                "machine_id": p.machine_id,
+                "machine_name": p.machine.name if p.machine else f"Машина #{p.machine_id}",
+                "script_id": p.script_id,
+                "script_name": p.script.name if p.script else "Без сценария",
+                "command": p.command,
+                "status": p.status,
+                "pid": p.pid,
+                "pid_start": p.pid_start,
+                "log_path": p.log_path,
+                "started_at": p.started_at.isoformat() if p.started_at else None,
+                "stopped_at": p.stopped_at.isoformat() if p.stopped_at else None
+            })
+        return result
 
+    # В записях есть имена машин и сценариев — их изменения тоже сбрасывают кэш
+    return await response_cache.respond(request, "processes", ("processes", "machines", "scripts"), build)
 
-@app.delete("/api/processes/{process_id}")
-async def stop_process_api(process_id: int, db: Session = Depends(get_db)):
+
+@app.get("/api/processes/{process_id}/log")
+async def get_process_log_api(request: Request, process_id: int, offset: int = None,
+                              length: int = 65536, wait: float = 0, db: Session = Depends(get_db)):
+    """Фрагмент лога запуска: length байт с offset (без offset — хвост файла).
+
+    wait > 0 — ждать появления новых байт после offset до wait секунд (follow).
+    """
     try:
         process = crud.get_process(db, process_id)
         if not process:
             raise HTTPException(status_code=404, detail="Process not found")
+        if not process.log_path:
+            raise HTTPException(status_code=404, detail="Process has no log")
+        machine = crud.get_machine(db, process.machine_id)
+        if not machine:
+            raise HTTPException(status_code=404, detail="Machine not found")
 
-        # Отмечаем процесс как остановленный в базе
-        crud.update_process_status(db, process_id, "stopped")
-
-        # Если есть машина и PID, пытаемся остановить процесс через SSH
-        if process.machine_id and process.pid:
-            machine = crud.get_machine(db, process.machine_id)
-            if machine:
-                await ssh_manager.kill_process(
-                    machine.address, machine.ssh_port, machine.username,
-                    machine.password,
-                    process.pid
-                )
+        length = min(max(length, 0), config.LOG_MAX_CHUNK)
+        if offset is None:
+            offset = -length
+        deadline = asyncio.get_running_loop().time() + min(max(wait, 0), config.LOG_FOLLOW_MAX_WAIT)
+        while True:
+            chunk = await ssh_manager.read_log(
+                machine.address, machine.ssh_port, machine.username, machine.password,
+                process.log_path, offset, length
+            )
+            if chunk is None:
+                raise HTTPException(status_code=404, detail="Log file not found")
+            if chunk["data"] or asyncio.get_running_loop().time() >= deadline:
+                break
+            await asyncio.sleep(config.LOG_FOLLOW_POLL_INTERVAL)
+
+        chunk["eof"] = chunk["next_offset"] >= chunk["size"]
+        # Фрагмент лога бывает большим: сжимается по Accept-Encoding, как списки процессов
+        return await conditional_response(request, render_json(chunk))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading log of process {process_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "processes"}))
-        return {"message": "Process stopped"}
+
+async def stop_machine_processes(db: Session, machine_id: int, processes: list,
+                                 signal: str = "TERM") -> List[Dict[str, Any]]:
+    """Останавливает процессы одной машины за один SSH-запрос и отмечает их в базе."""
+    machine = crud.get_machine(db, machine_id)
+    with_pid = [p for p in processes if p.pid]
+    statuses = {}
+    if machine and with_pid:
+        for item in await ssh_manager.signal_pids(
+            machine.address, machine.ssh_port, machine.username, machine.password,
+            [{"pid": p.pid, "start": p.pid_start} for p in with_pid], signal
+        ):
+            statuses[item["pid"]] = item["status"]
+
+    results = []
+    for process in processes:
+        if not process.pid:
+            status = "no_pid"
+        elif not machine:
+            status = "machine_not_found"
+        else:
+            status = statuses.get(process.pid, "failed")
+        # gone/reused — нашего процесса на машине уже нет
+        if status != "failed":
+            crud.update_process_status(db, process.id, "stopped")
+        results.append({"id": process.id, "pid": process.pid, "status": status})
+    manager.notify(f"processes:machine:{machine_id}")
+    return results
+
+
+@app.delete("/api/processes/{process_id}")
+async def stop_process_api(process_id: int, signal: str = "TERM", db: Session = Depends(get_db)):
+    try:
+        process = crud.get_process(db, process_id)
+        if not process:
+            raise HTTPException(status_code=404, detail="Process not found")
+
+        [result] = await stop_machine_processes(db, process.machine_id, [process], signal)
+        if result["status"] == "failed":
+            raise HTTPException(status_code=500, detail=f"Failed to stop process {process.pid}")
+        return {"message": "Process stopped", "status": result["status"]}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error stopping process: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.post("/api/processes/stop")
+async def stop_processes_api(request: dict, db: Session = Depends(get_db)):
+    """Массовая остановка запусков из истории: по одному SSH-запросу на машину."""
+    try:
+        signal = request.get("signal", "TERM")
+        by_machine: Dict[int, list] = {}
+        for process_id in request.get("process_ids", []):
+            process = crud.get_process(db, process_id)
+            if process:
+                by_machine.setdefault(process.machine_id, []).append(process)
+
+        async def stop_one(machine_id, processes):
+            try:
+                return await stop_machine_processes(db, machine_id, processes, signal)
+            except ValueError:
+                raise
+            except Exception as e:
+                return [{"id": p.id, "pid": p.pid, "status": "failed", "error": str(e)} for p in processes]
+
+        groups = await asyncio.gather(*(stop_one(mid, procs) for mid, procs in by_machine.items()))
+        return {"results": [r for group in groups for r in group]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error stopping processes: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/api/processes/reconcile")
+async def reconcile_processes_api():
+    """Сверяет статусы запущенных процессов с машинами прямо сейчас."""
+    try:
+        return await reconciler.reconcile_once()
+    except Exception as e:
+        logger.error(f"Error reconciling processes: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @app.post("/api/processes/batch-kill")
 async def batch_kill_processes(request: dict, db: Session = Depends(get_db)):
     """Массовая остановка процессов"""
@@ -1208,7 +1906,15 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 message = json.loads(data)
                 if message.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong"}))
+                    manager.send_nowait(websocket, json.dumps({"type": "pong"}))
+                elif message.get("type") in ("subscribe", "unsubscribe"):
+                    # Подписка на темы: machines, processes:machine:<id>, run:<id> ...
+                    topics = message.get("topics") or []
+                    if message["type"] == "subscribe":
+                        current = manager.subscribe(websocket, topics)
+                    else:
+                        current = manager.unsubscribe(websocket, topics)
+                    manager.send_nowait(websocket, json.dumps({"type": "subscribed", "topics": current}))
             except:
                 pass
     except WebSocketDisconnect:
@@ -1221,7 +1927,15 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.on_event("shutdown")
 async def shutdown():
     try:
+        for task in background_tasks:
+            task.cancel()
+        await reconciler.stop()
+        await warmer.stop()
+        await job_queue.stop()
+        await cluster.stop()
+        await sidecar_client.stop()
         await ssh_manager.close_all()
+        offloader.shutdown()
         logger.info("SSH connections closed on shutdown")
     except Exception as e:
         logger.error(f"Error during shutdown: {e}")
@@ -1302,8 +2016,8 @@ async def add_current_machine(machine_data: dict,
         machine_data["is_current"] = True
 
         db_machine = crud.create_machine(db, machine_data)
-        await manager.broadcast(
-            json.dumps({"type": "update", "entity": "machines"}))
+        apply_machine_settings(db_machine, db)
+        manager.notify("machines")
         return db_machine
     except HTTPException:
         raise
@@ -1312,6 +2026,101 @@ async def add_current_machine(machine_data: dict,
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/metrics")
+async def metrics_api():
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/admin/profile")
+async def profile_api(seconds: float = 10, interval: float = 0.005,
+                      x_admin_token: str = Header(default="")):
+    """Сэмплирующий профилировщик на seconds секунд; ответ — свёрнутые стеки для flamegraph.
+
+    Доступен только при заданном SSHM_ADMIN_TOKEN, с тем же токеном в X-Admin-Token.
+    """
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not hmac.compare_digest(x_admin_token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    seconds = min(max(seconds, 0.1), config.PROFILE_MAX_SECONDS)
+    interval = max(interval, 0.001)
+    try:
+        folded = await profiler.profile(seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    filename = f"profile-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# Состояние кластера воркеров и владельцы SSH-подключений
+@app.get("/api/cluster")
+async def cluster_status(db: Session = Depends(get_db)):
+    status = cluster.status()
+    status["machines"] = [
+        {
+            "machine_id": m.id,
+            "name": m.name,
+            "owner": cluster.owner_of(m.address, m.ssh_port, m.username)
+        }
+        for m in crud.get_machines(db)
+    ]
+    return status
+
+
+# Лимиты SSH и время ожидания на них
+@app.get("/api/ssh/limits")
+async def ssh_limits_stats():
+    return ssh_manager.limits.stats()
+
+
+# Автоматы отключения недоступных хостов
+@app.get("/api/ssh/breakers")
+async def ssh_breakers_stats():
+    return ssh_manager.breakers.stats()
+
+
+@app.get("/api/ssh/process-agents")
+async def ssh_process_agents_stats():
+    return await ssh_manager.process_agent_stats()
+
+
+# Процесс-хранитель SSH-подключений: состояние клиента и самого хранителя
+@app.get("/api/sidecar/stats")
+async def sidecar_stats():
+    stats = {"enabled": bool(config.SIDECAR_SOCKET), "client": sidecar_client.stats()}
+    if sidecar_client.connected:
+        try:
+            stats["sidecar"] = await sidecar_client.call("stats", {})
+        except Exception as e:
+            stats["error"] = str(e)
+    return stats
+
+
+# Разбор и сериализация вне event loop: сколько задач ушло в пул
+@app.get("/api/offload/stats")
+async def offload_stats():
+    return offloader.stats()
+
+
+# Прогрев подключений: число машин по состояниям
+@app.get("/api/warmup/stats")
+async def warmup_stats():
+    return await warmer.stats()
+
+
+# Кэш готовых ответов списочных эндпоинтов
+@app.get("/api/response-cache/stats")
+async def response_cache_stats():
+    return response_cache.stats()
+
+
+# Состояние очередей WebSocket
+@app.get("/api/ws/stats")
+async def websocket_stats():
+    return manager.stats()
+
+
 # Health check
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,181 @@
+"""Сквозной бенчмарк API на фейковом SSH-парке.
+
+Поднимает парк (benchmarks.fleet) и сервер с временной БД, регистрирует машины
+через POST /api/machines и замеряет задержку и пропускную способность:
+/api/processes/live, запуск сценария и профиля (до завершения задания),
+/api/processes/batch-kill и /api/machines/batch-test.
+
+    python -m benchmarks.api --hosts 50 --latency 0.02 --output result.json
+    python -m benchmarks.api --hosts 50 --save-baseline
+    python -m benchmarks.api --hosts 50 --relay   # машины за ретранслятором площадки
+
+Результат — JSON; при наличии базовой линии (benchmarks/baseline.json) с теми же
+параметрами регрессии печатаются в stderr, код выхода 1.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+from benchmarks import common, fleet as fleet_module
+from benchmarks.fleet import FakeFleet
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+async def measure(call, iterations: int, concurrency: int):
+    """Выполняет call() iterations раз не более чем concurrency параллельно."""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    return common.summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def wait_job(client: httpx.AsyncClient, job_id: int, timeout: float = 600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = (await client.get(f"/api/jobs/{job_id}")).json()
+        if job["status"] in ("done", "failed", "cancelled"):
+            if job["status"] != "done":
+                raise RuntimeError(f"Job {job_id} {job['status']}: {job.get('error')}")
+            return job
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+
+def checked(response: httpx.Response) -> httpx.Response:
+    response.raise_for_status()
+    return response
+
+
+async def register_machines(client: httpx.AsyncClient, machines, attempts: int = 5):
+    ids = []
+    semaphore = asyncio.Semaphore(16)
+
+    async def register(machine):
+        async with semaphore:
+            for _ in range(attempts):
+                response = await client.post("/api/machines", json=machine)
+                if response.status_code == 200:
+                    ids.append(response.json()["id"])
+                    return
+            raise RuntimeError(f"Cannot register {machine['address']}: {response.text}")
+
+    await asyncio.gather(*(register(m) for m in machines))
+    return sorted(ids)
+
+
+async def run(args) -> dict:
+    fleet = FakeFleet(args.hosts, args.port, relay=args.relay)
+    fleet_args = ["--hosts", str(args.hosts), "--port", str(args.port),
+                  "--processes", str(args.processes), "--latency", str(args.latency),
+                  "--jitter", str(args.jitter), "--failure-rate", str(args.failure_rate),
+                  "--seed", str(args.seed)] + (["--relay"] if args.relay else [])
+    params = {k: v for k, v in vars(args).items()
+              if k not in ("output", "baseline", "save_baseline", "tolerance", "scenarios", "verbose")}
+    scenarios = {}
+
+    async with common.BenchEnvironment(fleet_args, verbose=args.verbose) as env:
+        async with httpx.AsyncClient(base_url=env.base_url, timeout=600) as client:
+            rss_start = env.server_rss_kb()
+            registered = time.perf_counter()
+            machines = fleet.machines()
+            if args.relay:
+                relay_id = (await register_machines(client, [fleet.relay_machine()]))[0]
+                machines = [{**m, "relay_id": relay_id} for m in machines]
+            machine_ids = await register_machines(client, machines)
+            register_seconds = time.perf_counter() - registered
+
+            script = checked(await client.post("/api/scripts", json={
+                "name": "bench", "content": "echo bench $1\nsleep 1\n", "parameters": []})).json()
+            profile = checked(await client.post("/api/profiles", json={
+                "name": "bench", "global_parameters": [],
+                "steps": [{"script_id": script["id"], "machine_ids": machine_ids, "parameters": []},
+                          {"script_id": script["id"], "machine_ids": machine_ids, "parameters": []}],
+            })).json()
+
+            async def processes_live():
+                checked(await client.get("/api/processes/live"))
+
+            async def script_execute():
+                job = checked(await client.post(f"/api/scripts/{script['id']}/execute",
+                                                json={"machine_ids": machine_ids, "params": []})).json()
+                await wait_job(client, job["job_id"])
+
+            async def profile_execute():
+                job = checked(await client.post(f"/api/profiles/{profile['id']}/execute", json={})).json()
+                await wait_job(client, job["job_id"])
+
+            kill_list = [{"machine_id": mid, "pid": 1000 + i}
+                         for mid in machine_ids for i in range(args.kill_per_host)]
+
+            async def batch_kill():
+                checked(await client.post("/api/processes/batch-kill", json={"processes": kill_list}))
+
+            async def batch_test():
+                checked(await client.post("/api/machines/batch-test"))
+
+            # batch-test последним: отказы парка помечают машины неактивными
+            plan = [
+                ("processes_live", processes_live, args.iterations, args.concurrency),
+                ("script_execute", script_execute, max(1, args.iterations // 4), 1),
+                ("profile_execute", profile_execute, max(1, args.iterations // 4), 1),
+                ("batch_kill", batch_kill, max(1, args.iterations // 4), 1),
+                ("batch_test", batch_test, max(1, args.iterations // 4), 1),
+            ]
+            for name, call, iterations, concurrency in plan:
+                if args.scenarios and name not in args.scenarios:
+                    continue
+                print(f"Running {name} x{iterations}...", file=sys.stderr)
+                scenarios[name] = await measure(call, iterations, concurrency)
+
+            rss_end = env.server_rss_kb()
+
+    return {
+        "benchmark": "api",
+        "params": params,
+        "environment": common.environment(),
+        "setup": {"machines": args.hosts, "register_seconds": round(register_seconds, 3)},
+        "server_rss_kb": {"start": rss_start, "end": rss_end},
+        "scenarios": scenarios,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк API SSH Manager на фейковом SSH-парке")
+    fleet_module.add_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--kill-per-host", type=int, default=2)
+    parser.add_argument("--scenarios", nargs="*", help="запустить только эти сценарии")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение (доля)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="показывать логи сервера и парка")
+    args = parser.parse_args()
+    # ssh_manager при импорте включает INFO-логи; запросы клиента в выводе не нужны
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(run(args))
+    sys.exit(common.report(results, args.baseline, args.tolerance, args.output, args.save_baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Общие части бенчмарков: запуск сервера и парка, замеры, сравнение с базовой линией."""
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Метрики, по которым ищутся регрессии: для *_ms больше — хуже, для rps меньше — хуже
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """latencies в секундах; результат в миллисекундах."""
+    count = len(latencies) + errors
+    return {
+        "count": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """Резидентная память процесса (Linux), КБ."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def environment() -> Dict:
+    commit = None
+    with contextlib.suppress(Exception):
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "commit": commit, "timestamp": time.time()}
+
+
+async def _wait_line(stream, expected: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        line = await asyncio.wait_for(stream.readline(), timeout=max(0.1, deadline - time.monotonic()))
+        if not line:
+            raise RuntimeError("Process exited before it was ready")
+        if expected in line.decode(errors="replace"):
+            return
+    raise TimeoutError(f"'{expected}' not received")
+
+
+class BenchEnvironment:
+    """Сервер SSH Manager (отдельный процесс uvicorn с временной БД) и, при необходимости, фейковый парк."""
+
+    def __init__(self, fleet_args: List[str] = None, server_env: Dict[str, str] = None,
+                 verbose: bool = False):
+        self.fleet_args = fleet_args
+        self.server_env = server_env or {}
+        # Логи сервера и парка по умолчанию не нужны: они только мешают читать результат
+        self.output = None if verbose else asyncio.subprocess.DEVNULL
+        self.workdir = tempfile.mkdtemp(prefix="sshm-bench-")
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.fleet: Optional[asyncio.subprocess.Process] = None
+        self.server: Optional[asyncio.subprocess.Process] = None
+
+    async def __aenter__(self):
+        if self.fleet_args is not None:
+            self.fleet = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "benchmarks.fleet", *self.fleet_args,
+                cwd=REPO_ROOT, stdout=asyncio.subprocess.PIPE, stderr=self.output)
+            await _wait_line(self.fleet.stdout, "READY", 60)
+
+        env = dict(os.environ)
+        env.update({
+            "SSHM_DATABASE_URL": f"sqlite:///{self.workdir}/bench.db",
+            "SSHM_EVENT_BUS_PATH": f"{self.workdir}/bus.db",
+            "SSHM_ARTIFACTS_DIR": f"{self.workdir}/artifacts",
+            # Фоновые циклы искажают замеры
+            "SSHM_RECONCILE_INTERVAL": "0",
+            "SSHM_SCRIPT_CACHE_GC_INTERVAL": "0",
+            "SSHM_TRACE_SLOW_REQUEST": "0",
+        })
+        env.update(self.server_env)
+        self.server = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+            "--port", str(self.port), "--log-level", "warning",
+            cwd=REPO_ROOT, env=env, stdout=self.output, stderr=self.output)
+        await self._wait_http()
+        return self
+
+    async def _wait_http(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with contextlib.suppress(OSError):
+                reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                return
+            await asyncio.sleep(0.1)
+        raise TimeoutError("Server did not start")
+
+    async def __aexit__(self, *exc):
+        for process in (self.server, self.fleet):
+            if process and process.returncode is None:
+                process.terminate()
+                with contextlib.suppress(Exception):
+                    await asyncio.wait_for(process.wait(), timeout=10)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        return False
+
+    def server_rss_kb(self) -> Optional[int]:
+        return rss_kb(self.server.pid) if self.server else None
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Регрессии относительно базовой линии: список строк-описаний."""
+    regressions = []
+    for scenario, current in results.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        for metric in LOWER_IS_BETTER:
+            if base.get(metric) and current.get(metric, 0) > base[metric] * (1 + tolerance):
+                regressions.append(f"{scenario}.{metric}: {current[metric]} > {base[metric]} (+{tolerance:.0%})")
+        for metric in HIGHER_IS_BETTER:
+            if base.get(metric) and current.get(metric, 0) < base[metric] * (1 - tolerance):
+                regressions.append(f"{scenario}.{metric}: {current[metric]} < {base[metric]} (-{tolerance:.0%})")
+        if current.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{scenario}.errors: {current['errors']} > {base.get('errors', 0)}")
+    return regressions
+
+
+def report(results: Dict, baseline_path: str, tolerance: float, output: str = None,
+           save_baseline: bool = False) -> int:
+    """Печатает результаты, пишет JSON и сравнивает с базовой линией. Возвращает код выхода."""
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    if save_baseline:
+        with open(baseline_path, "w") as f:
+            f.write(text + "\n")
+        print(f"Baseline saved to {baseline_path}", file=sys.stderr)
+        return 0
+    baseline = load_baseline(baseline_path)
+    if baseline is None:
+        print(f"No baseline at {baseline_path}, comparison skipped", file=sys.stderr)
+        return 0
+    if baseline.get("params") != results.get("params"):
+        print("Baseline was recorded with different parameters, comparison skipped", file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline, tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
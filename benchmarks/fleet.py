@@ -0,0 +1,235 @@
+"""Парк фейковых SSH-хостов для бенчмарков: asyncssh-серверы в одном процессе.
+
+Команды не исполняются — сервер узнаёт команды SSHManager и отвечает правдоподобным
+выводом (ps aux, метрики хоста, PID запущенного скрипта) с заданной задержкой
+и долей отказов. Каждый хост слушает свой адрес 127.0.x.y на общем порту.
+
+С --relay добавляется ещё один хост-ретранслятор (следующий адрес): он исполняет команды
+по-настоящему (агент ретранслятора, python3, ssh) и пропускает SSH-туннели к остальным.
+
+    python -m benchmarks.fleet --hosts 50 --port 42222 --latency 0.02
+    python -m benchmarks.fleet --hosts 50 --port 42222 --relay
+"""
+import argparse
+import asyncio
+import random
+import re
+import time
+
+import asyncssh
+
+from ssh_manager import SECTION_MARKER, SCRIPT_MISSING_EXIT
+
+PASSWORD = "bench"
+USERNAME = "bench"
+START_TIME = "Mon Jan  5 10:00:00 2026"
+
+
+def host_address(index: int) -> str:
+    return f"127.0.{index // 250}.{index % 250 + 1}"
+
+
+class FakeHost:
+    def __init__(self, index: int, processes: int, latency: float, jitter: float,
+                 failure_rate: float, rng: random.Random):
+        self.index = index
+        self.address = host_address(index)
+        self.processes = processes
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.next_pid = 10000
+        self.scripts = set()
+        self.commands = 0
+
+    def ps_lines(self) -> str:
+        lines = ["USER PID %CPU %MEM VSZ RSS TTY STAT START TIME COMMAND"]
+        for i in range(self.processes):
+            cpu = self.rng.random() * 20
+            lines.append(f"bench {1000 + i} {cpu:.1f} {cpu / 4:.1f} 123456 {4096 + i} ? S 10:00 0:0{i % 10} "
+                         f"/usr/bin/worker --id {i} --host {self.index}")
+        return "\n".join(lines)
+
+    def poll_output(self) -> str:
+        jiffies = int(time.monotonic() * 100)
+        return "\n".join([
+            SECTION_MARKER + "ps", self.ps_lines(),
+            SECTION_MARKER + "loadavg", f"{self.rng.random() * 4:.2f} 1.00 0.50 1/200 12345",
+            SECTION_MARKER + "meminfo",
+            "MemTotal:       16384000 kB", "MemAvailable:    8192000 kB",
+            "SwapTotal:       2048000 kB", "SwapFree:        2048000 kB",
+            SECTION_MARKER + "stat", f"cpu  {jiffies} 0 {jiffies // 2} {jiffies * 4} 0 0 0 0 0 0",
+            SECTION_MARKER + "df", "/dev/sda1 100000000 40000000 60000000 40% /",
+        ]) + "\n"
+
+    async def handle(self, process: asyncssh.SSHServerProcess):
+        command = process.command or ""
+        self.commands += 1
+        if self.latency:
+            await asyncio.sleep(max(0.0, self.rng.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        if self.failure_rate and self.rng.random() < self.failure_rate and "echo test" not in command:
+            process.stderr.write("simulated failure\n")
+            process.exit(1)
+            return
+
+        exit_status = 0
+        if SECTION_MARKER in command:
+            process.stdout.write(self.poll_output())
+        elif command.startswith("ps aux"):
+            process.stdout.write(self.ps_lines().split("\n", 1)[1] + "\n")
+        elif ".ssh_manager/scripts/" in command:
+            digest = re.search(r"scripts/([0-9a-f]{64})\.sh", command).group(1)
+            if "cat >" in command:
+                await process.stdin.read()
+                self.scripts.add(digest)
+            if digest not in self.scripts:
+                exit_status = SCRIPT_MISSING_EXIT
+            else:
+                self.next_pid += 1
+                process.stdout.write(f"{self.next_pid} {START_TIME}\n")
+        elif command.startswith("for p in"):
+            for pid in re.match(r"for p in ([\d ]+);", command).group(1).split():
+                process.stdout.write(f"{pid} {START_TIME}\n")
+        elif " gone; " in command:
+            for pid in re.findall(r"echo (\d+) gone", command):
+                process.stdout.write(f"{pid} killed\n")
+        elif command.startswith("echo "):
+            process.stdout.write(command[5:].strip("'\"") + "\n")
+        process.exit(exit_status)
+
+
+class RelayHost:
+    """Ретранслятор: команды выполняются локальной оболочкой."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.address = host_address(index)
+        self.commands = 0
+
+    async def handle(self, process: asyncssh.SSHServerProcess):
+        self.commands += 1
+        local = await asyncio.create_subprocess_shell(
+            process.command or "true", stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        # Вывод пересылаем сами и зовём exit только после него: с redirect канал мог
+        # закрыться раньше, чем вывод дойдёт до клиента. stdin клиент может и не
+        # закрыть — копируем его в фоне, не дожидаясь EOF
+        feeder = asyncio.create_task(self._feed(process, local))
+        try:
+            await asyncio.gather(self._pump(local.stdout, process.stdout),
+                                 self._pump(local.stderr, process.stderr))
+        except (BrokenPipeError, ConnectionError, asyncssh.Error):
+            # Клиент закрыл канал раньше, чем команда завершилась (долгий агент)
+            local.kill()
+        returncode = await local.wait()
+        feeder.cancel()
+        process.exit(returncode)
+
+    @staticmethod
+    async def _pump(reader: asyncio.StreamReader, writer: asyncssh.SSHWriter):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            writer.write(data)
+            await writer.drain()
+
+    @staticmethod
+    async def _feed(process: asyncssh.SSHServerProcess, local):
+        try:
+            while True:
+                data = await process.stdin.read(65536)
+                if not data:
+                    break
+                local.stdin.write(data)
+                await local.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            local.stdin.close()
+
+
+class _Server(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return username == USERNAME and password == PASSWORD
+
+
+class _RelayServer(_Server):
+    def connection_requested(self, dest_host, dest_port, orig_host, orig_port):
+        # Туннель (direct-tcpip) к машинам площадки
+        return True
+
+
+class FakeFleet:
+    def __init__(self, hosts: int, port: int, processes: int = 100, latency: float = 0.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 1,
+                 relay: bool = False):
+        rng = random.Random(seed)
+        self.port = port
+        self.hosts = [FakeHost(i, processes, latency, jitter, failure_rate, random.Random(rng.random()))
+                      for i in range(hosts)]
+        self.relay = RelayHost(hosts) if relay else None
+        self.servers = []
+
+    async def start(self):
+        key = asyncssh.generate_private_key("ssh-ed25519")
+        for host in self.hosts:
+            self.servers.append(await asyncssh.create_server(
+                _Server, host.address, self.port, server_host_keys=[key],
+                process_factory=host.handle, reuse_address=True))
+        if self.relay:
+            # Агент ретранслятора пишет в stdout сжатые (двоичные) данные
+            self.servers.append(await asyncssh.create_server(
+                _RelayServer, self.relay.address, self.port, server_host_keys=[key],
+                process_factory=self.relay.handle, encoding=None, reuse_address=True))
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    def machines(self):
+        """Описания машин для POST /api/machines."""
+        return [{"name": f"bench-{h.index}", "address": h.address, "ssh_port": self.port,
+                 "username": USERNAME, "password": PASSWORD} for h in self.hosts]
+
+    def relay_machine(self):
+        """Описание ретранслятора для POST /api/machines (только с relay=True)."""
+        return {"name": "bench-relay", "address": self.relay.address, "ssh_port": self.port,
+                "username": USERNAME, "password": PASSWORD}
+
+
+async def _main(args):
+    fleet = FakeFleet(args.hosts, args.port, args.processes, args.latency, args.jitter,
+                      args.failure_rate, args.seed, args.relay)
+    await fleet.start()
+    print("READY", flush=True)
+    await asyncio.Event().wait()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--port", type=int, default=42222)
+    parser.add_argument("--processes", type=int, default=100, help="процессов в ps aux на хост")
+    parser.add_argument("--latency", type=float, default=0.01, help="задержка ответа на команду, сек")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="доля команд, завершающихся ошибкой")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--relay", action="store_true",
+                        help="добавить хост-ретранслятор, исполняющий команды по-настоящему")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фейковый SSH-парк для бенчмарков")
+    add_arguments(parser)
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,242 @@
+"""Нагрузочный тест рассылки обновлений по /ws/updates.
+
+Открывает тысячи клиентов WebSocket (быстрые, медленные и «зависшие», которые
+совсем не читают), порождает пачки изменений сущности scripts и замеряет, через
+сколько после начала пачки клиенты получают уведомление. Две фазы: только быстрые
+клиенты, затем те же быстрые клиенты при подключённых медленных — разница
+показывает, как медленные клиенты сказываются на быстрых. Память сервера
+снимается после каждого этапа, статистика менеджера — из /api/ws/stats.
+
+    python -m benchmarks.ws --clients 2000 --slow 200 --stalled 50 --bursts 10
+    python -m benchmarks.ws --clients 2000 --save-baseline
+
+Задержка считается в процессе бенчмарка, поэтому включает и его собственную
+загрузку event loop; для очень больших --clients имеет смысл смотреть на
+относительную разницу фаз, а не на абсолютные значения.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+import websockets
+
+from benchmarks import common
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_ws.json")
+TOPIC = "scripts"
+
+
+class Burst:
+    """Текущая пачка обновлений: клиенты отмечают первое сообщение после её начала."""
+
+    def __init__(self):
+        self.number = 0
+        self.started = 0.0
+
+    def begin(self):
+        self.number += 1
+        self.started = time.perf_counter()
+
+
+class Client:
+    def __init__(self, kind: str, burst: Burst, read_delay: float = 0.0):
+        self.kind = kind
+        self.burst = burst
+        self.read_delay = read_delay
+        self.connection = None
+        self.task: Optional[asyncio.Task] = None
+        self.seen_burst = 0
+        self.latencies: List[float] = []
+        self.received = 0
+        self.closed_by_server = False
+
+    async def connect(self, url: str):
+        # max_queue=1: не читающий клиент быстро перестаёт забирать данные из сокета
+        self.connection = await websockets.connect(url, max_queue=1, open_timeout=60,
+                                                   ping_interval=None)
+        await self.connection.send(json.dumps({"type": "subscribe", "topics": [TOPIC]}))
+        if self.kind != "stalled":
+            self.task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            async for raw in self.connection:
+                received = time.perf_counter()
+                if '"update"' not in raw:
+                    continue
+                self.received += 1
+                if self.seen_burst != self.burst.number and received >= self.burst.started:
+                    self.seen_burst = self.burst.number
+                    self.latencies.append(received - self.burst.started)
+                if self.read_delay:
+                    await asyncio.sleep(self.read_delay)
+        except websockets.ConnectionClosed:
+            self.closed_by_server = True
+
+    def reset(self):
+        self.latencies = []
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        if self.connection is not None:
+            try:
+                await asyncio.wait_for(self.connection.close(), timeout=2)
+            except Exception:
+                pass
+
+
+def raise_fd_limit():
+    """Каждый клиент — дескриптор у нас и у сервера (он наследует лимит)."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def open_clients(url: str, clients: List[Client], concurrency: int) -> int:
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def open_one(client):
+        nonlocal failures
+        async with semaphore:
+            try:
+                await client.connect(url)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(open_one(c) for c in clients))
+    return failures
+
+
+async def run_phase(http: httpx.AsyncClient, burst: Burst, clients: List[Client], args) -> float:
+    """Отправляет args.bursts пачек по args.burst_size изменений. Возвращает длительность фазы."""
+    for client in clients:
+        client.reset()
+    started = time.perf_counter()
+    for _ in range(args.bursts):
+        burst.begin()
+        await asyncio.gather(*(
+            http.post("/api/scripts", json={"name": f"ws-bench-{burst.number}-{i}",
+                                            "content": "true", "parameters": []})
+            for i in range(args.burst_size)))
+        # Ждём, пока уведомление дойдёт до всех быстрых клиентов (или до таймаута)
+        deadline = time.perf_counter() + args.burst_interval
+        while time.perf_counter() < deadline:
+            if all(c.seen_burst == burst.number for c in clients if not c.closed_by_server):
+                break
+            await asyncio.sleep(0.01)
+        if args.fixed_interval:
+            await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+    return time.perf_counter() - started
+
+
+def phase_summary(clients: List[Client], bursts: int, elapsed: float) -> dict:
+    latencies = [value for c in clients for value in c.latencies]
+    missed = sum(bursts - len(c.latencies) for c in clients)
+    return common.summarize(latencies, missed, elapsed)
+
+
+async def run(args) -> dict:
+    params = {k: v for k, v in vars(args).items()
+              if k not in ("output", "baseline", "save_baseline", "tolerance", "verbose")}
+    server_env = {
+        "SSHM_WS_COALESCE_WINDOW": str(args.coalesce_window),
+        "SSHM_WS_QUEUE_SIZE": str(args.queue_size),
+        "SSHM_WS_OVERFLOW_POLICY": args.overflow_policy,
+        "SSHM_WS_SEND_TIMEOUT": str(args.send_timeout),
+    }
+    raise_fd_limit()
+    burst = Burst()
+    fast = [Client("fast", burst) for _ in range(args.clients)]
+    slow = [Client("slow", burst, args.slow_delay) for _ in range(args.slow)]
+    stalled = [Client("stalled", burst) for _ in range(args.stalled)]
+    rss = {}
+
+    async with common.BenchEnvironment(server_env=server_env, verbose=args.verbose) as env:
+        url = env.base_url.replace("http://", "ws://") + "/ws/updates"
+        # Изменения порождаются не более чем по 4 запроса параллельно: тест меряет рассылку,
+        # а не упирается в пул соединений БД синхронных обработчиков
+        async with httpx.AsyncClient(base_url=env.base_url, timeout=120,
+                                     limits=httpx.Limits(max_connections=4)) as http:
+            rss["start"] = env.server_rss_kb()
+
+            connected = time.perf_counter()
+            failed = await open_clients(url, fast, args.connect_concurrency)
+            connect_seconds = time.perf_counter() - connected
+            rss["fast_connected"] = env.server_rss_kb()
+            print(f"{len(fast) - failed} fast clients connected in {connect_seconds:.1f}s", file=sys.stderr)
+
+            print("Phase fast_only...", file=sys.stderr)
+            fast_only = phase_summary(fast, args.bursts, await run_phase(http, burst, fast, args))
+            rss["after_fast_only"] = env.server_rss_kb()
+
+            failed += await open_clients(url, slow + stalled, args.connect_concurrency)
+            rss["slow_connected"] = env.server_rss_kb()
+
+            print("Phase fast_with_slow...", file=sys.stderr)
+            elapsed = await run_phase(http, burst, fast, args)
+            fast_with_slow = phase_summary(fast, args.bursts, elapsed)
+            slow_summary = phase_summary(slow, args.bursts, elapsed) if slow else None
+            rss["after_fast_with_slow"] = env.server_rss_kb()
+            ws_stats = (await http.get("/api/ws/stats")).json()
+            fast_dropped = sum(c.closed_by_server for c in fast)
+
+            await asyncio.gather(*(c.close() for c in fast + slow + stalled))
+            await asyncio.sleep(1)
+            rss["after_disconnect"] = env.server_rss_kb()
+
+    slowdown = None
+    if fast_only["p95_ms"]:
+        slowdown = round(fast_with_slow["p95_ms"] / fast_only["p95_ms"], 2)
+    return {
+        "benchmark": "ws",
+        "params": params,
+        "environment": common.environment(),
+        "setup": {"connect_seconds": round(connect_seconds, 3), "connect_failures": failed},
+        "server_rss_kb": rss,
+        "scenarios": {"fast_only": fast_only, "fast_with_slow": fast_with_slow},
+        "slow_clients": slow_summary,
+        "fast_p95_slowdown": slowdown,
+        "fast_clients_dropped": fast_dropped,
+        "ws_stats": ws_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест рассылки по /ws/updates")
+    parser.add_argument("--clients", type=int, default=1000, help="быстрых клиентов")
+    parser.add_argument("--slow", type=int, default=100, help="клиентов, читающих с задержкой")
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="пауза медленного клиента после сообщения, сек")
+    parser.add_argument("--stalled", type=int, default=20, help="клиентов, которые совсем не читают")
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--burst-size", type=int, default=20, help="изменений в одной пачке")
+    parser.add_argument("--burst-interval", type=float, default=3.0, help="максимальное ожидание доставки пачки, сек")
+    parser.add_argument("--fixed-interval", action="store_true",
+                        help="всегда выжидать --burst-interval (постоянный темп пачек)")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--coalesce-window", type=float, default=0.25)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--overflow-policy", default="coalesce")
+    parser.add_argument("--send-timeout", type=float, default=10.0)
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение (доля)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="показывать логи сервера")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(run(args))
+    sys.exit(common.report(results, args.baseline, args.tolerance, args.output, args.save_baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import time
+from typing import Callable, Dict, List, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Подключение не пробуется: хост недавно был недоступен, автомат разомкнут."""
+
+    def __init__(self, key: str, retry_in: float, last_error: str = None):
+        self.key = key
+        self.retry_in = retry_in
+        self.last_error = last_error
+        message = f"Circuit open for {key}, retry in {retry_in:.1f}s"
+        if last_error:
+            message += f" (last error: {last_error})"
+        super().__init__(message)
+
+
+class CircuitBreaker:
+    """Автомат одного ключа подключения.
+
+    closed — подключения идут как обычно; после failure_threshold неудач подряд
+    автомат размыкается (open) и попытки сразу завершаются CircuitOpenError.
+    Когда окно истекло, пропускается ровно одна пробная попытка (half_open):
+    успех замыкает автомат, неудача размыкает его снова на вдвое большее окно
+    (не больше max_open_seconds).
+    """
+
+    def __init__(self, failure_threshold: int, open_seconds: float, max_open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        # Сколько раз подряд автомат размыкался без успешного подключения между ними
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.last_error: Optional[str] = None
+        self.rejected = 0
+        self.changed = time.time()
+
+    def retry_in(self) -> float:
+        return max(0.0, self.open_until - time.monotonic())
+
+    def due(self) -> bool:
+        """Окно истекло и пробная попытка ещё не идёт."""
+        return self.state != CLOSED and not self.probe_in_flight and self.retry_in() == 0
+
+    def acquire(self, key: str, force: bool = False) -> bool:
+        """Разрешение на попытку подключения. True — это пробная попытка (half_open).
+
+        force — явная проверка пользователем: пропускается и при разомкнутом автомате,
+        но её исход учитывается как обычно.
+        """
+        if self.state == CLOSED:
+            return False
+        if force:
+            return False
+        if self.due():
+            self.state = HALF_OPEN
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        raise CircuitOpenError(key, self.retry_in(), self.last_error)
+
+    def release(self):
+        """Попытка прервана (отмена, ожидание лимитов) — исход хоста неизвестен."""
+        if self.probe_in_flight:
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def record_success(self) -> bool:
+        """Возвращает True, если автомат замкнулся."""
+        self.failures = 0
+        self.trips = 0
+        self.last_error = None
+        self.probe_in_flight = False
+        if self.state == CLOSED:
+            return False
+        self.state = CLOSED
+        self.changed = time.time()
+        return True
+
+    def record_failure(self, error: str) -> bool:
+        """Возвращает True, если автомат только что разомкнулся."""
+        self.failures += 1
+        self.last_error = error
+        if self.state == OPEN:
+            # Попытка, начатая до размыкания, или явная проверка: окно не продлеваем
+            return False
+        if self.state == CLOSED and self.failures < self.failure_threshold:
+            return False
+        opened = self.state == CLOSED
+        self.probe_in_flight = False
+        self.trips += 1
+        window = min(self.max_open_seconds, self.open_seconds * 2 ** (self.trips - 1))
+        self.state = OPEN
+        self.open_until = time.monotonic() + window
+        if opened:
+            self.changed = time.time()
+        return opened
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "retry_in": round(self.retry_in(), 1) if self.state != CLOSED else 0.0,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "since": self.changed,
+        }
+
+
+class CircuitBreakers:
+    """Автоматы по ключам подключений (host:port:username).
+
+    on_change(key, state) вызывается при размыкании (open) и замыкании (closed),
+    но не при повторных неудачных пробах.
+    """
+
+    def __init__(self, failure_threshold: int, open_seconds: float, max_open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.on_change: Optional[Callable[[str, str], None]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.open_seconds, self.max_open_seconds)
+            self.breakers[key] = breaker
+        return breaker
+
+    def acquire(self, key: str, force: bool = False) -> bool:
+        if not self.enabled:
+            return False
+        breaker = self.breakers.get(key)
+        return breaker.acquire(key, force) if breaker is not None else False
+
+    def release(self, key: str):
+        breaker = self.breakers.get(key)
+        if breaker is not None:
+            breaker.release()
+
+    def success(self, key: str):
+        breaker = self.breakers.get(key)
+        # Для исправных хостов автомат не заводится: словарь не растёт с каждым подключением
+        if breaker is not None and breaker.record_success():
+            self._changed(key, CLOSED)
+
+    def failure(self, key: str, error: str) -> bool:
+        """Учитывает неудачу. Возвращает True, если автомат разомкнулся."""
+        if not self.enabled or not self.get(key).record_failure(error):
+            return False
+        self._changed(key, OPEN)
+        return True
+
+    def forget(self, key: str):
+        self.breakers.pop(key, None)
+
+    def state(self, key: str) -> str:
+        breaker = self.breakers.get(key)
+        return breaker.state if breaker is not None else CLOSED
+
+    def open_keys(self) -> List[str]:
+        return [key for key, breaker in self.breakers.items() if breaker.state != CLOSED]
+
+    def due_keys(self) -> List[str]:
+        """Разомкнутые автоматы, которым пора пропустить пробную попытку."""
+        return [key for key, breaker in self.breakers.items() if breaker.due()]
+
+    def _changed(self, key: str, state: str):
+        if self.on_change:
+            self.on_change(key, state)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "failure_threshold": self.failure_threshold,
+            "open": len(self.open_keys()),
+            "hosts": {key: breaker.stats() for key, breaker in self.breakers.items()
+                      if breaker.state != CLOSED or breaker.failures},
+        }
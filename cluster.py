@@ -0,0 +1,315 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, List, Optional
+
+import config
+import crud
+import database
+from event_bus import EventBus, create_event_bus
+
+logger = logging.getLogger(__name__)
+
+
+# Вызовы, которые можно повторить на своём воркере, если владелец не ответил вовремя:
+# они только читают состояние хоста, повтор ничего не меняет
+IDEMPOTENT_METHODS = frozenset({
+    "connection_readiness", "get_processes_from_machine", "poll_machine", "relay_poll",
+    "test_connection", "get_processes", "get_pids_status", "read_log",
+})
+
+
+def connection_key(host: str, port: int, username: str) -> str:
+    return f"{host}:{port}:{username}"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Консистентное хеширование ключей подключений по воркерам (с виртуальными узлами)."""
+
+    def __init__(self, nodes: List[str] = None, replicas: int = 64):
+        self.replicas = replicas
+        self.nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.set_nodes(nodes or [])
+
+    def set_nodes(self, nodes: List[str]):
+        ring = sorted((_hash(f"{node}#{i}"), node)
+                      for node in set(nodes) for i in range(self.replicas))
+        self.nodes = sorted(set(nodes))
+        self._points = [p for p, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[idx]
+
+
+class Cluster:
+    """Координация воркеров: шина событий, членство и владение SSH-подключениями.
+
+    Каждое SSH-подключение принадлежит одному воркеру (по хешу ключа подключения).
+    Вызовы SSHManager для чужих машин пересылаются владельцу через шину.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.bus: Optional[EventBus] = None
+        self.ring = HashRing([self.worker_id])
+        self.enabled = False
+        self.ssh_manager = None
+        self.ws_manager = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._membership_task: Optional[asyncio.Task] = None
+        self.forwarded_calls = 0
+        self.served_calls = 0
+
+    async def start(self, ssh_manager, ws_manager, backend: str = None):
+        self.ssh_manager = ssh_manager
+        self.ws_manager = ws_manager
+        self.bus = create_event_bus(self.worker_id, backend)
+        await self.bus.start(self._on_event)
+        # С локальной шиной воркер один — маршрутизация не нужна
+        self.enabled = self.bus.name != "local"
+        if self.enabled:
+            await self._refresh_membership()
+            self._membership_task = asyncio.create_task(self._membership_loop())
+            ssh_manager.router = self
+            ws_manager.bus_publish = self.publish_ws
+        logger.info(f"Cluster started: worker={self.worker_id}, bus={self.bus.name}")
+
+    async def stop(self):
+        if self._membership_task:
+            self._membership_task.cancel()
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        if self.bus:
+            await self.bus.stop()
+
+    # --- Членство ---
+
+    async def _refresh_membership(self):
+        workers = await self.bus.live_workers()
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        if sorted(workers) != self.ring.nodes:
+            self.ring.set_nodes(workers)
+            logger.info(f"Cluster membership changed: {self.ring.nodes}")
+
+    async def _membership_loop(self):
+        while True:
+            await asyncio.sleep(config.EVENT_BUS_WORKER_TTL / 3)
+            try:
+                await self._refresh_membership()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cluster membership refresh failed: {e}")
+
+    def owner_of(self, host: str, port: int, username: str) -> str:
+        return self.ring.owner(connection_key(host, port, username)) or self.worker_id
+
+    def is_local(self, host: str, port: int, username: str) -> bool:
+        return not self.enabled or self.owner_of(host, port, username) == self.worker_id
+
+    async def _alive(self, worker_id: str) -> bool:
+        return worker_id == self.worker_id or worker_id in await self.bus.live_workers()
+
+    # --- Секреты ---
+    # Пароли и тексты скриптов в шину не пишутся (это общий файл на диске): вместо них
+    # передаются id машины и скрипта, владелец берёт значения из БД приложения
+
+    @staticmethod
+    def _machine_ref(db, host: str, port: int, username: str, password: str) -> Optional[int]:
+        machine = crud.get_machine_by_connection(db, host, port, username)
+        if machine is None or machine.password != password:
+            return None
+        return machine.id
+
+    @staticmethod
+    def _machine_password(db, machine_id: int, host: str, port: int, username: str) -> str:
+        machine = crud.get_machine(db, machine_id)
+        if machine is None or (machine.address, machine.ssh_port, machine.username) != (host, port, username):
+            raise LookupError(f"Machine {host}:{port} not found")
+        return machine.password
+
+    def _seal(self, kwargs: dict) -> Optional[dict]:
+        """kwargs для шины без секретов; None — их нет в БД, владелец не сможет их восстановить."""
+        db = database.SessionLocal()
+        try:
+            sealed = dict(kwargs)
+            if "password" in sealed:
+                ref = self._machine_ref(db, sealed["host"], sealed["port"], sealed["username"],
+                                        sealed.pop("password"))
+                if ref is None:
+                    return None
+                sealed["password_ref"] = ref
+            if sealed.get("targets"):
+                targets = []
+                for target in sealed["targets"]:
+                    target = dict(target)
+                    ref = self._machine_ref(db, target["host"], target["port"], target["username"],
+                                            target.pop("password"))
+                    if ref is None:
+                        return None
+                    targets.append({**target, "password_ref": ref})
+                sealed["targets"] = targets
+            if sealed.get("script_content") is not None:
+                script = crud.get_script_by_content(db, sealed.pop("script_content"))
+                if script is None:
+                    return None
+                sealed["script_ref"] = script.id
+            return sealed
+        finally:
+            db.close()
+
+    def _unseal(self, kwargs: dict) -> dict:
+        db = database.SessionLocal()
+        try:
+            kwargs = dict(kwargs)
+            if "password_ref" in kwargs:
+                kwargs["password"] = self._machine_password(db, kwargs.pop("password_ref"), kwargs["host"],
+                                                            kwargs["port"], kwargs["username"])
+            if kwargs.get("targets"):
+                targets = []
+                for target in kwargs["targets"]:
+                    target = dict(target)
+                    target["password"] = self._machine_password(db, target.pop("password_ref"), target["host"],
+                                                                target["port"], target["username"])
+                    targets.append(target)
+                kwargs["targets"] = targets
+            if "script_ref" in kwargs:
+                script = crud.get_script(db, kwargs.pop("script_ref"))
+                if script is None:
+                    raise LookupError("Script not found")
+                kwargs["script_content"] = script.content
+            return kwargs
+        finally:
+            db.close()
+
+    # --- Пересылка вызовов SSHManager ---
+
+    async def forward(self, method: str, kwargs: dict, local_call):
+        """Пересылает вызов владельцу подключения.
+
+        Если владельца уже нет среди живых воркеров, вызов сразу выполняется здесь.
+        Если владелец не ответил, повторяются только чтения (IDEMPOTENT_METHODS):
+        остальное могло выполниться, и второй запуск сделал бы работу дважды.
+        """
+        owner = self.owner_of(kwargs["host"], kwargs["port"], kwargs["username"])
+        if not await self._alive(owner):
+            await self._refresh_membership()
+            owner = self.owner_of(kwargs["host"], kwargs["port"], kwargs["username"])
+        if owner == self.worker_id:
+            return await local_call()
+        sealed = self._seal(kwargs)
+        if sealed is None:
+            # Владелец не найдёт пароль или скрипт в БД (новая машина, изменённый пароль
+            # в форме) — выполняем сами, секреты в шину не кладём
+            return await local_call()
+
+        call_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        self.forwarded_calls += 1
+        try:
+            await self.bus.publish("rpc", {"id": call_id, "target": owner,
+                                           "method": method, "kwargs": sealed})
+            # Вызовы со своим таймаутом (команды ретранслятора, раздача артефактов) ждём дольше
+            timeout = config.CLUSTER_RPC_TIMEOUT
+            if kwargs.get("timeout"):
+                timeout = max(timeout, float(kwargs["timeout"]) + 30)
+            response = await self._wait(owner, future, timeout)
+        except asyncio.TimeoutError:
+            if method in IDEMPOTENT_METHODS:
+                logger.warning(f"Worker {owner} did not answer '{method}', executing locally")
+                return await local_call()
+            raise TimeoutError(f"Worker {owner} did not answer '{method}'")
+        finally:
+            self._pending.pop(call_id, None)
+        if response is None:
+            if method in IDEMPOTENT_METHODS:
+                logger.warning(f"Worker {owner} left the cluster during '{method}', executing locally")
+                return await local_call()
+            raise ConnectionError(f"Worker {owner} left the cluster during '{method}'")
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response.get("result")
+
+    async def _wait(self, owner: str, future: asyncio.Future, timeout: float) -> Optional[dict]:
+        """Ответ владельца; None — владелец пропал из членства, не ответив.
+
+        Пока ждём, проверяем heartbeat владельца — умерший воркер замечается за
+        EVENT_BUS_WORKER_TTL, а не за весь таймаут.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                return await asyncio.wait_for(asyncio.shield(future),
+                                              timeout=min(remaining, config.EVENT_BUS_WORKER_TTL))
+            except asyncio.TimeoutError:
+                if not await self._alive(owner):
+                    return None
+
+    async def _serve(self, payload: dict):
+        method = getattr(self.ssh_manager, payload["method"], None)
+        response = {"id": payload["id"]}
+        try:
+            if method is None:
+                raise AttributeError(f"Unknown method {payload['method']}")
+            kwargs = self._unseal(payload["kwargs"])
+            # Владелец исполняет вызов локально, в обход маршрутизации
+            response["result"] = await method.__wrapped__(self.ssh_manager, **kwargs)
+            self.served_calls += 1
+        except Exception as e:
+            response["error"] = str(e)
+        await self.bus.publish("rpc_result", response)
+
+    # --- События ---
+
+    async def publish_ws(self, kind: str, value: str):
+        await self.bus.publish("ws", {"kind": kind, "value": value})
+
+    async def _on_event(self, channel: str, payload: dict, origin: str):
+        if channel == "ws":
+            if origin == self.worker_id:
+                return
+            if payload.get("kind") == "notify":
+                self.ws_manager.notify(payload["value"], local_only=True)
+            else:
+                self.ws_manager.broadcast_nowait(payload["value"], local_only=True)
+        elif channel == "rpc":
+            if payload.get("target") == self.worker_id:
+                asyncio.create_task(self._serve(payload))
+        elif channel == "rpc_result":
+            future = self._pending.get(payload.get("id"))
+            if future and not future.done():
+                future.set_result(payload)
+
+    def status(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "backend": self.bus.name if self.bus else None,
+            "enabled": self.enabled,
+            "workers": self.ring.nodes,
+            "forwarded_calls": self.forwarded_calls,
+            "served_calls": self.served_calls,
+        }
+
+
+cluster = Cluster()
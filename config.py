@@ -0,0 +1,156 @@
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+
+# База данных (по умолчанию — SQLite-файл в текущем каталоге)
+DATABASE_URL = _env_str("SSHM_DATABASE_URL", "sqlite:///./ssh_manager.db")
+
+# WebSocket: размер исходящей очереди на клиента и политика переполнения
+# (coalesce | drop_oldest | disconnect)
+WS_QUEUE_SIZE = _env_int("SSHM_WS_QUEUE_SIZE", 100)
+WS_OVERFLOW_POLICY = _env_str("SSHM_WS_OVERFLOW_POLICY", "coalesce")
+WS_SEND_TIMEOUT = _env_float("SSHM_WS_SEND_TIMEOUT", 10.0)
+# Окно (сек), в течение которого уведомления об изменениях склеиваются в одно
+WS_COALESCE_WINDOW = _env_float("SSHM_WS_COALESCE_WINDOW", 0.25)
+
+# Шина событий между воркерами: local (один процесс) | sqlite
+EVENT_BUS_BACKEND = _env_str("SSHM_EVENT_BUS", "local")
+EVENT_BUS_PATH = _env_str("SSHM_EVENT_BUS_PATH", "./ssh_manager_bus.db")
+EVENT_BUS_POLL_INTERVAL = _env_float("SSHM_EVENT_BUS_POLL_INTERVAL", 0.05)
+EVENT_BUS_WORKER_TTL = _env_float("SSHM_EVENT_BUS_WORKER_TTL", 5.0)
+# Сколько ждать ответа живого воркера-владельца машины; после этого чтения выполняются
+# самостоятельно, остальные вызовы завершаются ошибкой (умерший владелец замечается раньше,
+# по heartbeat)
+CLUSTER_RPC_TIMEOUT = _env_float("SSHM_CLUSTER_RPC_TIMEOUT", 60.0)
+
+# Очередь заданий (запуски сценариев и профилей)
+JOB_WORKERS = _env_int("SSHM_JOB_WORKERS", 4)
+JOB_MAX_QUEUED = _env_int("SSHM_JOB_MAX_QUEUED", 100)
+# Сколько машин одного задания обрабатываются одновременно
+JOB_MACHINE_CONCURRENCY = _env_int("SSHM_JOB_MACHINE_CONCURRENCY", 20)
+JOB_MAX_ATTEMPTS = _env_int("SSHM_JOB_MAX_ATTEMPTS", 3)
+JOB_RETRY_BACKOFF = _env_float("SSHM_JOB_RETRY_BACKOFF", 2.0)
+JOB_POLL_INTERVAL = _env_float("SSHM_JOB_POLL_INTERVAL", 5.0)
+
+# Ограничения SSH: одновременные каналы на хост и всего, скорость открытия каналов
+SSH_MAX_SESSIONS_PER_HOST = _env_int("SSHM_SSH_MAX_SESSIONS_PER_HOST", 8)
+SSH_GLOBAL_MAX_SESSIONS = _env_int("SSHM_SSH_GLOBAL_MAX_SESSIONS", 256)
+SSH_RATE_LIMIT = _env_float("SSHM_SSH_RATE_LIMIT", 10.0)
+SSH_RATE_BURST = _env_int("SSHM_SSH_RATE_BURST", 10)
+# Сколько ждать свободного слота, прежде чем вернуть ошибку
+SSH_LIMIT_WAIT_TIMEOUT = _env_float("SSHM_SSH_LIMIT_WAIT_TIMEOUT", 60.0)
+
+# Раздача артефактов: каталог на контроллере, число прямых загрузок
+# и сколько копий одновременно раздаёт каждый получивший файл хост
+ARTIFACTS_DIR = _env_str("SSHM_ARTIFACTS_DIR", "./artifacts")
+ARTIFACT_DIRECT_SEEDS = _env_int("SSHM_ARTIFACT_DIRECT_SEEDS", 4)
+ARTIFACT_RELAY_FANOUT = _env_int("SSHM_ARTIFACT_RELAY_FANOUT", 2)
+ARTIFACT_RELAY_TIMEOUT = _env_float("SSHM_ARTIFACT_RELAY_TIMEOUT", 600.0)
+
+# Кэш скриптов на хостах: возраст удаляемых файлов и период сборки мусора (0 — выключено)
+SCRIPT_CACHE_MAX_AGE_DAYS = _env_int("SSHM_SCRIPT_CACHE_MAX_AGE_DAYS", 7)
+SCRIPT_CACHE_GC_INTERVAL = _env_float("SSHM_SCRIPT_CACHE_GC_INTERVAL", 86400.0)
+
+# Чтение логов запусков: максимальный фрагмент, ожидание новых байт (follow) и период опроса
+LOG_MAX_CHUNK = _env_int("SSHM_LOG_MAX_CHUNK", 1024 * 1024)
+LOG_FOLLOW_MAX_WAIT = _env_float("SSHM_LOG_FOLLOW_MAX_WAIT", 30.0)
+LOG_FOLLOW_POLL_INTERVAL = _env_float("SSHM_LOG_FOLLOW_POLL_INTERVAL", 1.0)
+
+# Сверка статусов запущенных процессов: период (0 — выключено) и число машин параллельно
+RECONCILE_INTERVAL = _env_float("SSHM_RECONCILE_INTERVAL", 30.0)
+RECONCILE_CONCURRENCY = _env_int("SSHM_RECONCILE_CONCURRENCY", 32)
+
+# Ряды CPU/памяти процессов: точки полного разрешения, усреднённые корзины и их шаг (сек),
+# время жизни ряда без обновлений и общий лимит рядов
+METRICS_FINE_POINTS = _env_int("SSHM_METRICS_FINE_POINTS", 120)
+METRICS_COARSE_POINTS = _env_int("SSHM_METRICS_COARSE_POINTS", 120)
+METRICS_COARSE_STEP = _env_float("SSHM_METRICS_COARSE_STEP", 60.0)
+METRICS_SERIES_TTL = _env_float("SSHM_METRICS_SERIES_TTL", 600.0)
+METRICS_MAX_SERIES = _env_int("SSHM_METRICS_MAX_SERIES", 5000)
+
+# Трассировка: запросы и задания дольше порога (сек) пишутся в лог с разбивкой по фазам
+TRACE_SLOW_REQUEST = _env_float("SSHM_TRACE_SLOW_REQUEST", 1.0)
+TRACE_SLOW_JOB = _env_float("SSHM_TRACE_SLOW_JOB", 60.0)
+
+# Админские эндпоинты (профилировщик): без токена отключены, с ним нужен заголовок X-Admin-Token
+ADMIN_TOKEN = _env_str("SSHM_ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = _env_float("SSHM_PROFILE_MAX_SECONDS", 60.0)
+
+# Разбор и сериализация больших выводов вне event loop: порог (байт, 0 — всегда на месте)
+# и число потоков пула
+OFFLOAD_THRESHOLD = _env_int("SSHM_OFFLOAD_THRESHOLD", 256 * 1024)
+OFFLOAD_WORKERS = _env_int("SSHM_OFFLOAD_WORKERS", 4)
+
+# Кэш готовых ответов списочных эндпоинтов (сбрасывается при изменениях; ttl — страховка, сек)
+# и сжатие ответов: минимальный размер тела, уровни gzip и brotli
+RESPONSE_CACHE_TTL = _env_float("SSHM_RESPONSE_CACHE_TTL", 60.0)
+RESPONSE_COMPRESS_MIN_SIZE = _env_int("SSHM_RESPONSE_COMPRESS_MIN_SIZE", 1024)
+RESPONSE_GZIP_LEVEL = _env_int("SSHM_RESPONSE_GZIP_LEVEL", 6)
+RESPONSE_BROTLI_QUALITY = _env_int("SSHM_RESPONSE_BROTLI_QUALITY", 5)
+
+# Прогрев SSH-подключений при старте (0 — выключен): сколько машин подключать одновременно,
+# случайная задержка старта (сек) и период обновления списка машин.
+# Оборванные подключения восстанавливаются с экспоненциальной задержкой от BASE до MAX.
+WARMUP_ENABLED = _env_int("SSHM_WARMUP", 0)
+WARMUP_CONCURRENCY = _env_int("SSHM_WARMUP_CONCURRENCY", 16)
+WARMUP_JITTER = _env_float("SSHM_WARMUP_JITTER", 2.0)
+WARMUP_REFRESH_INTERVAL = _env_float("SSHM_WARMUP_REFRESH_INTERVAL", 60.0)
+RECONNECT_BACKOFF_BASE = _env_float("SSHM_RECONNECT_BACKOFF_BASE", 1.0)
+RECONNECT_BACKOFF_MAX = _env_float("SSHM_RECONNECT_BACKOFF_MAX", 300.0)
+# Интервал keepalive SSH-подключений, сек (0 — выключен)
+SSH_KEEPALIVE_INTERVAL = _env_float("SSHM_SSH_KEEPALIVE_INTERVAL", 30.0)
+
+# Автомат отключения недоступных хостов: после BREAKER_FAILURES неудачных подключений подряд
+# (0 — выключен) попытки сразу отклоняются на BREAKER_OPEN_SECONDS, окно удваивается при
+# каждой неудачной пробе до BREAKER_MAX_OPEN_SECONDS. Период проверки разомкнутых хостов (0 — нет).
+BREAKER_FAILURES = _env_int("SSHM_BREAKER_FAILURES", 3)
+BREAKER_OPEN_SECONDS = _env_float("SSHM_BREAKER_OPEN_SECONDS", 30.0)
+BREAKER_MAX_OPEN_SECONDS = _env_float("SSHM_BREAKER_MAX_OPEN_SECONDS", 600.0)
+BREAKER_PROBE_INTERVAL = _env_float("SSHM_BREAKER_PROBE_INTERVAL", 5.0)
+
+# Процесс-хранитель SSH-подключений (python sidecar.py): путь его Unix-сокета (пусто — не
+# используется), сколько ждать подключения при старте и пауза между попытками переподключения
+SIDECAR_SOCKET = _env_str("SSHM_SIDECAR_SOCKET", "")
+SIDECAR_CONNECT_TIMEOUT = _env_float("SSHM_SIDECAR_CONNECT_TIMEOUT", 2.0)
+SIDECAR_RECONNECT_INTERVAL = _env_float("SSHM_SIDECAR_RECONNECT_INTERVAL", 1.0)
+# Сколько ждать ответа хранителя на вызов (самые долгие команды SSHManager — 300 с)
+SIDECAR_CALL_TIMEOUT = _env_float("SSHM_SIDECAR_CALL_TIMEOUT", 330.0)
+
+# Ретрансляторы площадок: таймаут команды на машине площадки (сек), сколько машин агент
+# опрашивает параллельно и сколько держит подключения к ним после последней команды (сек)
+RELAY_COMMAND_TIMEOUT = _env_float("SSHM_RELAY_COMMAND_TIMEOUT", 30.0)
+RELAY_CONCURRENCY = _env_int("SSHM_RELAY_CONCURRENCY", 32)
+RELAY_PERSIST = _env_int("SSHM_RELAY_PERSIST", 600)
+
+# Замер профилей транспорта SSH (transport.py): объём выборки (байт) и число повторов
+TRANSPORT_CALIBRATION_BYTES = _env_int("SSHM_TRANSPORT_CALIBRATION_BYTES", 4 * 1024 * 1024)
+TRANSPORT_CALIBRATION_ROUNDS = _env_int("SSHM_TRANSPORT_CALIBRATION_ROUNDS", 3)
+
+# Агент событий процессов (process_agent.py): вместо ps при каждом опросе на хосте работает
+# агент, который следит за /proc и передаёт изменения (1 — включён). Период чтения /proc и
+# метрик хоста (сек), через сколько секунд без чтения списка агент останавливается, пауза
+# перед повторным запуском после сбоя, сколько секунд и штук помнить завершившиеся процессы
+PROCESS_AGENT = _env_int("SSHM_PROCESS_AGENT", 0)
+PROCESS_AGENT_INTERVAL = _env_float("SSHM_PROCESS_AGENT_INTERVAL", 1.0)
+PROCESS_AGENT_HOST_INTERVAL = _env_float("SSHM_PROCESS_AGENT_HOST_INTERVAL", 5.0)
+PROCESS_AGENT_IDLE = _env_float("SSHM_PROCESS_AGENT_IDLE", 300.0)
+PROCESS_AGENT_RETRY = _env_float("SSHM_PROCESS_AGENT_RETRY", 300.0)
+PROCESS_AGENT_EXITED_WINDOW = _env_float("SSHM_PROCESS_AGENT_EXITED_WINDOW", 60.0)
+PROCESS_AGENT_MAX_EXITED = _env_int("SSHM_PROCESS_AGENT_MAX_EXITED", 1000)
@@ -40,6 +40,17 @@ def get_machine_by_address(db: Session, address: str):
     return db.query(models.Machine).filter(models.Machine.address == address).first()
 
 
+def get_machine_by_connection(db: Session, address: str, ssh_port: int, username: str):
+    return db.query(models.Machine).filter(models.Machine.address == address,
+                                           models.Machine.ssh_port == ssh_port,
+                                           models.Machine.username == username).first()
+
+
+def get_relay_members(db: Session, relay_id: int):
+    """Машины, подключающиеся через ретранслятор relay_id."""
+    return db.query(models.Machine).filter(models.Machine.relay_id == relay_id).all()
+
+
 def create_machine(db: Session, machine_data: dict):
     db_machine = models.Machine(**machine_data)
     db.add(db_machine)
@@ -144,6 +155,10 @@ def get_script(db: Session, script_id: int):
     return script
 
 
+def get_script_by_content(db: Session, content: str):
+    return db.query(models.Script).filter(models.Script.content == content).first()
+
+
 def create_script(db: Session, script_data: dict):
     db_script = models.Script(**script_data)
     db.add(db_script)
@@ -347,6 +362,29 @@ def get_machine_processes(db: Session, machine_id: int):
     ).all()
 
 
+def get_running_processes(db: Session):
+    """Процессы со статусом running и известным PID — то, что сверяет reconciler."""
+    return db.query(models.Process).filter(
+        models.Process.status == "running",
+        models.Process.pid.isnot(None)
+    ).all()
+
+
+def bulk_update_process_status(db: Session, process_ids: list, status: str):
+    """Меняет статус нескольких процессов одной транзакцией."""
+    if not process_ids:
+        return 0
+    values = {models.Process.status: status}
+    if status in ("stopped", "exited"):
+        values[models.Process.stopped_at] = datetime.datetime.now()
+    updated = db.query(models.Process).filter(
+        models.Process.id.in_(process_ids),
+        models.Process.status == "running"
+    ).update(values, synchronize_session=False)
+    db.commit()
+    return updated
+
+
 def get_process(db: Session, process_id: int):
     return db.query(models.Process).filter(models.Process.id == process_id).first()
 
@@ -389,4 +427,113 @@ def stop_machine_processes(db: Session, machine_id: int):
         process.stopped_at = datetime.datetime.now()
 
     db.commit()
-    return len(processes)
\ No newline at end of file
+    return len(processes)
+
+# Job CRUD operations
+def create_job(db: Session, kind: str, payload: dict, priority: int = 0, progress_total: int = 0):
+    db_job = models.Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        priority=priority,
+        progress_total=progress_total
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+
+def get_jobs(db: Session, skip: int = 0, limit: int = 100):
+    return db.query(models.Job).order_by(models.Job.id.desc()).offset(skip).limit(limit).all()
+
+
+def get_job(db: Session, job_id: int):
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def get_job_status(db: Session, job_id: int):
+    return db.query(models.Job.status).filter(models.Job.id == job_id).scalar()
+
+
+def count_jobs_by_status(db: Session, status: str):
+    return db.query(models.Job).filter(models.Job.status == status).count()
+
+
+def claim_next_job(db: Session, worker_id: str):
+    """Забирает самое приоритетное задание из очереди. Атомарно и для нескольких воркеров."""
+    while True:
+        candidate = db.query(models.Job.id).filter(models.Job.status == "queued")\
+            .order_by(models.Job.priority.desc(), models.Job.id).first()
+        if not candidate:
+            return None
+        claimed = db.query(models.Job).filter(
+            models.Job.id == candidate.id,
+            models.Job.status == "queued"
+        ).update({
+            models.Job.status: "running",
+            models.Job.worker_id: worker_id,
+            models.Job.started_at: datetime.datetime.now(),
+            models.Job.attempts: models.Job.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return get_job(db, candidate.id)
+
+
+def finish_job(db: Session, job_id: int, status: str, error: str = None):
+    db_job = get_job(db, job_id)
+    if db_job:
+        db_job.status = status
+        db_job.error = error
+        db_job.finished_at = datetime.datetime.now()
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+
+def cancel_job(db: Session, job_id: int):
+    db_job = get_job(db, job_id)
+    if db_job and db_job.status in ("queued", "running"):
+        db_job.status = "cancelled"
+        db_job.finished_at = datetime.datetime.now()
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+
+def requeue_interrupted_jobs(db: Session, live_workers: list):
+    """Возвращает в очередь задания, чей воркер больше не работает (например, после рестарта)."""
+    jobs = db.query(models.Job).filter(models.Job.status == "running").all()
+    requeued = 0
+    for job in jobs:
+        if job.worker_id not in live_workers:
+            job.status = "queued"
+            job.worker_id = None
+            requeued += 1
+    db.commit()
+    return requeued
+
+
+def add_job_result(db: Session, job_id: int, step_index: int, machine_id: int,
+                   success: bool, message: str = None, attempts: int = 1):
+    db_result = models.JobResult(
+        job_id=job_id,
+        step_index=step_index,
+        machine_id=machine_id,
+        success=success,
+        message=message,
+        attempts=attempts
+    )
+    db.add(db_result)
+    db.query(models.Job).filter(models.Job.id == job_id).update(
+        {models.Job.progress_done: models.Job.progress_done + 1},
+        synchronize_session=False
+    )
+    db.commit()
+    return db_result
+
+
+def get_job_results(db: Session, job_id: int):
+    return db.query(models.JobResult).filter(
+        models.JobResult.job_id == job_id
+    ).order_by(models.JobResult.id).all()
@@ -0,0 +1,335 @@
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import posixpath
+import secrets
+import shlex
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+# Одноразовый HTTP-сервер на уже получившем файл хосте: отдаёт файл по секретному пути
+# (с поддержкой Range — загрузку можно докачать) и завершается после одной полной отдачи
+# или по таймауту. Слушает только интерфейс, на который пришло наше SSH-подключение
+# (из SSH_CONNECTION, иначе — переданный адрес), и печатает "порт адрес".
+RELAY_SERVER = r'''
+import http.server, os, sys, socket, threading
+path, token, timeout, bind = sys.argv[1], sys.argv[2], float(sys.argv[3]), sys.argv[4]
+ssh = os.environ.get("SSH_CONNECTION", "").split()
+if len(ssh) == 4:
+    bind = ssh[2]
+if bind.startswith("::ffff:") and "." in bind:
+    bind = bind[7:]
+class H(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/" + token:
+            self.send_error(404); return
+        size = os.path.getsize(path)
+        start = 0
+        spec = self.headers.get("Range", "")
+        if spec.startswith("bytes=") and spec[6:].split("-")[0].isdigit():
+            start = int(spec[6:].split("-")[0])
+        if start >= size > 0:
+            self.send_error(416); return
+        if start:
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                chunk = f.read(262144)
+                if not chunk: break
+                self.wfile.write(chunk)
+        threading.Thread(target=self.server.shutdown).start()
+    def log_message(self, *a): pass
+class S(http.server.HTTPServer):
+    address_family = socket.AF_INET6 if ":" in bind else socket.AF_INET
+srv = S((bind, 0), H)
+print(srv.server_address[1], bind, flush=True)
+threading.Timer(timeout, srv.shutdown).start()
+srv.serve_forever()
+'''
+
+# Загрузка с ретранслятора на целевом хосте: curl, wget или python3. Все три дописывают
+# уже полученную часть .part (Range), а не скачивают файл заново
+RELAY_FETCH = (
+    "curl -fsS -C - -o {part} {url} 2>/dev/null || wget -q -c -O {part} {url} 2>/dev/null || "
+    "python3 -c 'import os,sys,urllib.request,shutil; p=sys.argv[2]; "
+    "o=os.path.getsize(p) if os.path.exists(p) else 0; "
+    "r=urllib.request.urlopen(urllib.request.Request(sys.argv[1],headers=dict(Range=\"bytes=%d-\"%o))); "
+    "shutil.copyfileobj(r,open(p,\"ab\" if r.status==206 else \"wb\"))' {url} {part}"
+)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RemotePath:
+    """Путь на удалённой машине: "~/x" — относительно домашнего каталога."""
+
+    def __init__(self, path: str):
+        if path.startswith("~/"):
+            self.sftp = path[2:]
+            self.shell = '"$HOME"/' + shlex.quote(path[2:])
+        else:
+            self.sftp = path
+            self.shell = shlex.quote(path)
+        directory = posixpath.dirname(path)
+        if directory.startswith("~/") or directory == "~":
+            self.shell_dir = '"$HOME"/' + shlex.quote(directory[2:] or ".")
+        else:
+            self.shell_dir = shlex.quote(directory or ".")
+
+    @property
+    def part_sftp(self) -> str:
+        return self.sftp + ".part"
+
+    @property
+    def part_shell(self) -> str:
+        return self.shell + ".part"
+
+
+class ArtifactDistributor:
+    """Раздача файла на много машин: SFTP с докачкой и проверкой sha256,
+    для больших парков — дерево ретрансляции, где получившие файл хосты раздают его дальше.
+    """
+
+    def __init__(self, ssh_manager):
+        self.ssh_manager = ssh_manager
+
+    async def distribute(self, local_path: str, remote_path: str, targets: List[Dict],
+                         seeds: int = None, fanout: int = None,
+                         on_result: Callable[[Dict], None] = None) -> List[Dict]:
+        """targets: [{"machine_id", "name", "host", "port", "username", "password"}].
+
+        Первые seeds машин получают файл напрямую от контроллера, остальные —
+        с уже получивших (каждый хост раздаёт не более fanout копий одновременно).
+        """
+        seeds = seeds or config.ARTIFACT_DIRECT_SEEDS
+        fanout = config.ARTIFACT_RELAY_FANOUT if fanout is None else fanout
+        loop = asyncio.get_running_loop()
+        checksum = await loop.run_in_executor(None, file_sha256, local_path)
+        size = os.path.getsize(local_path)
+        remote = RemotePath(remote_path)
+        results: List[Dict] = []
+
+        def finish(result: Dict):
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+        pending = collections.deque(targets)
+        direct_slots = asyncio.Semaphore(seeds)
+        # Источники для ретрансляции: по одному элементу на свободный слот раздачи
+        sources: asyncio.Queue = asyncio.Queue()
+        tasks = set()
+
+        async def direct(target: Dict):
+            async with direct_slots:
+                result = await self._push_direct(target, local_path, remote, checksum, size)
+            finish(result)
+            if result["success"] and fanout > 0:
+                for _ in range(fanout):
+                    sources.put_nowait(target)
+            return result
+
+        async def relayed(source: Dict, target: Dict):
+            result = await self._push_relay(source, target, remote, checksum, size)
+            sources.put_nowait(source)
+            if not result["success"]:
+                logger.warning(f"Relay {source['name']} -> {target['name']} failed: {result['error']}, pushing directly")
+                await direct(target)
+                return
+            finish(result)
+            for _ in range(fanout):
+                sources.put_nowait(target)
+
+        # Первая волна — напрямую от контроллера
+        first_wave = [pending.popleft() for _ in range(min(seeds if fanout > 0 else len(pending), len(pending)))]
+        for target in first_wave:
+            tasks.add(asyncio.create_task(direct(target)))
+
+        while pending:
+            running = {t for t in tasks if not t.done()}
+            if not running and sources.empty():
+                # Ни одного источника не появилось — остаток раздаём напрямую
+                while pending:
+                    tasks.add(asyncio.create_task(direct(pending.popleft())))
+                break
+            getter = asyncio.create_task(sources.get())
+            done, _ = await asyncio.wait(running | {getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                target = pending.popleft()
+                tasks.add(asyncio.create_task(relayed(getter.result(), target)))
+            else:
+                getter.cancel()
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return results
+
+    def _result(self, target: Dict, source: str) -> Dict:
+        return {
+            "machine_id": target.get("machine_id"),
+            "name": target.get("name"),
+            "source": source,
+            "success": False,
+            "skipped": False,
+            "bytes": 0,
+            "resumed_from": 0,
+            "seconds": 0.0,
+            "throughput_bps": 0,
+            "error": None,
+        }
+
+    async def _run(self, target: Dict, command: str) -> Tuple[bool, str, str]:
+        """Команда на машине с таймаутом раздачи: sha256sum и загрузка большого файла
+        не укладываются в 30 секунд execute_command."""
+        conn = await self.ssh_manager.get_connection(
+            target["host"], target["port"], target["username"], target["password"])
+        if not conn:
+            return False, "", "Failed to establish connection"
+        key = self.ssh_manager._key(target["host"], target["port"], target["username"])
+        result = await self.ssh_manager._run(key, conn, command, operation="artifact",
+                                             timeout=config.ARTIFACT_RELAY_TIMEOUT)
+        return result.exit_status == 0, result.stdout, result.stderr
+
+    async def _remote_sha256(self, target: Dict, shell_path: str) -> Optional[str]:
+        success, stdout, _ = await self._run(
+            target, f"sha256sum {shell_path} 2>/dev/null | cut -d' ' -f1")
+        return stdout.strip() if success and stdout.strip() else None
+
+    async def _finalize(self, target: Dict, remote: RemotePath, checksum: str) -> Optional[str]:
+        """Проверяет контрольную сумму .part и переименовывает его. Возвращает ошибку или None."""
+        actual = await self._remote_sha256(target, remote.part_shell)
+        if actual != checksum:
+            await self._run(target, f"rm -f {remote.part_shell}")
+            return f"Checksum mismatch ({actual} != {checksum})"
+        success, _, stderr = await self._run(target, f"mv -f {remote.part_shell} {remote.shell}")
+        return None if success else f"Rename failed: {stderr.strip()}"
+
+    async def _push_direct(self, target: Dict, local_path: str, remote: RemotePath,
+                           checksum: str, size: int) -> Dict:
+        result = self._result(target, "controller")
+        started = time.monotonic()
+        try:
+            if await self._remote_sha256(target, remote.shell) == checksum:
+                result.update(success=True, skipped=True)
+                return result
+            conn = await self.ssh_manager.get_connection(
+                target["host"], target["port"], target["username"], target["password"])
+            if not conn:
+                result["error"] = "Failed to establish connection"
+                return result
+            await self._run(target, f"mkdir -p {remote.shell_dir}")
+            for attempt in range(2):
+                async with self.ssh_manager.channel_slot(target["host"], target["port"], target["username"]):
+                    sent, offset = await self._sftp_upload(conn, local_path, remote.part_sftp, size)
+                result["bytes"] += sent
+                result["resumed_from"] = offset
+                error = await self._finalize(target, remote, checksum)
+                if error is None:
+                    result["success"] = True
+                    break
+                result["error"] = error
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+        finally:
+            self._timing(result, started)
+        if result["success"]:
+            result["error"] = None
+        return result
+
+    async def _sftp_upload(self, conn, local_path: str, part_path: str, size: int):
+        """Дописывает .part с того места, где закончилась прошлая попытка."""
+        async with conn.start_sftp_client() as sftp:
+            offset = 0
+            if await sftp.exists(part_path):
+                offset = (await sftp.stat(part_path)).size or 0
+                if offset > size:
+                    await sftp.remove(part_path)
+                    offset = 0
+            sent = 0
+            async with sftp.open(part_path, "ab" if offset else "wb") as remote_file:
+                with open(local_path, "rb") as f:
+                    f.seek(offset)
+                    while True:
+                        chunk = f.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        await remote_file.write(chunk)
+                        sent += len(chunk)
+            return sent, offset
+
+    async def _push_relay(self, source: Dict, target: Dict, remote: RemotePath,
+                          checksum: str, size: int) -> Dict:
+        result = self._result(target, source.get("name") or source["host"])
+        started = time.monotonic()
+        server = None
+        try:
+            if await self._remote_sha256(target, remote.shell) == checksum:
+                result.update(success=True, skipped=True)
+                return result
+            conn = await self.ssh_manager.get_connection(
+                source["host"], source["port"], source["username"], source["password"])
+            if not conn:
+                result["error"] = f"Relay {source['host']} unreachable"
+                return result
+            token = secrets.token_hex(16)
+            async with self.ssh_manager.channel_slot(source["host"], source["port"], source["username"]):
+                server = await conn.create_process(
+                    f"python3 -c {shlex.quote(RELAY_SERVER)} {remote.shell} {token} "
+                    f"{config.ARTIFACT_RELAY_TIMEOUT} {shlex.quote(source['host'])}"
+                )
+                port_line = await asyncio.wait_for(server.stdout.readline(), timeout=15)
+                port, address = port_line.split()
+                if ":" in address:
+                    address = f"[{address}]"
+                url = shlex.quote(f"http://{address}:{int(port)}/{token}")
+                fetch = RELAY_FETCH.format(part=remote.part_shell, url=url)
+                # Уже полученная целиком часть не скачивается снова; оборванная загрузка
+                # при повторе продолжается с места обрыва
+                fetch = (f"mkdir -p {remote.shell_dir} && n=0; [ -f {remote.part_shell} ] && "
+                         f"n=$(wc -c < {remote.part_shell}); [ \"$n\" -gt {size} ] && "
+                         f"rm -f {remote.part_shell} && n=0; [ \"$n\" -eq {size} ] || ( {fetch} )")
+                for attempt in range(2):
+                    success, _, stderr = await self._run(target, fetch)
+                    if success:
+                        break
+            if not success:
+                result["error"] = f"Fetch failed: {stderr.strip()}"
+                return result
+            result["bytes"] = size
+            error = await self._finalize(target, remote, checksum)
+            result["success"] = error is None
+            result["error"] = error
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+        finally:
+            if server is not None:
+                server.close()
+            self._timing(result, started)
+        return result
+
+    @staticmethod
+    def _timing(result: Dict, started: float):
+        seconds = time.monotonic() - started
+        result["seconds"] = round(seconds, 3)
+        if result["bytes"] and seconds > 0:
+            result["throughput_bps"] = int(result["bytes"] / seconds)
@@ -0,0 +1,183 @@
+import abc
+import asyncio
+import concurrent.futures
+import json
+import logging
+import sqlite3
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# handler(channel, payload, origin)
+EventHandler = Callable[[str, dict, str], Awaitable[None]]
+
+
+class EventBus(abc.ABC):
+    """Шина событий между процессами-воркерами; реализации задают publish."""
+
+    name = "base"
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.handler: Optional[EventHandler] = None
+
+    async def start(self, handler: EventHandler):
+        self.handler = handler
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, channel: str, payload: dict):
+        """Отправляет событие обработчикам всех воркеров."""
+
+    async def live_workers(self) -> List[str]:
+        return [self.worker_id]
+
+
+class LocalEventBus(EventBus):
+    """Шина внутри одного процесса: события сразу уходят обработчику."""
+
+    name = "local"
+
+    async def publish(self, channel: str, payload: dict):
+        if self.handler:
+            await self.handler(channel, payload, self.worker_id)
+
+
+class SQLiteEventBus(EventBus):
+    """Шина на общем SQLite-файле: воркеры пишут события в таблицу и опрашивают её.
+
+    Там же хранится heartbeat каждого воркера — по нему строится список живых воркеров.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, worker_id: str, path: str = None,
+                 poll_interval: float = None, worker_ttl: float = None):
+        super().__init__(worker_id)
+        self.path = path or config.EVENT_BUS_PATH
+        self.poll_interval = poll_interval or config.EVENT_BUS_POLL_INTERVAL
+        self.worker_ttl = worker_ttl or config.EVENT_BUS_WORKER_TTL
+        # Все обращения к sqlite идут через один поток
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_id = 0
+        self._tasks: List[asyncio.Task] = []
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS bus_events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, "
+            "payload TEXT NOT NULL, origin TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS bus_workers ("
+            "worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        row = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM bus_events").fetchone()
+        self._last_id = row[0]
+        self._heartbeat()
+
+    def _heartbeat(self):
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO bus_workers (worker_id, heartbeat) VALUES (?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (self.worker_id, now))
+        # Чистим старые события и умершие воркеры
+        self._db.execute("DELETE FROM bus_events WHERE created_at < ?", (now - 60,))
+        self._db.execute("DELETE FROM bus_workers WHERE heartbeat < ?", (now - self.worker_ttl * 10,))
+
+    def _insert(self, channel: str, payload: str):
+        self._db.execute(
+            "INSERT INTO bus_events (channel, payload, origin, created_at) VALUES (?, ?, ?, ?)",
+            (channel, payload, self.worker_id, time.time()))
+
+    def _fetch(self):
+        rows = self._db.execute(
+            "SELECT id, channel, payload, origin FROM bus_events WHERE id > ? ORDER BY id",
+            (self._last_id,)).fetchall()
+        if rows:
+            self._last_id = rows[-1][0]
+        return rows
+
+    def _workers(self):
+        rows = self._db.execute(
+            "SELECT worker_id FROM bus_workers WHERE heartbeat >= ? ORDER BY worker_id",
+            (time.time() - self.worker_ttl,)).fetchall()
+        return [r[0] for r in rows]
+
+    def _unregister(self):
+        self._db.execute("DELETE FROM bus_workers WHERE worker_id = ?", (self.worker_id,))
+        self._db.close()
+
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        await self._run(self._open)
+        self._tasks = [asyncio.create_task(self._poll_loop()),
+                       asyncio.create_task(self._heartbeat_loop())]
+        logger.info(f"SQLite event bus started at {self.path} as worker {self.worker_id}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._db is not None:
+            try:
+                await self._run(self._unregister)
+            except Exception as e:
+                logger.warning(f"Error closing event bus: {e}")
+        self._executor.shutdown(wait=False)
+
+    async def publish(self, channel: str, payload: dict):
+        await self._run(self._insert, channel, json.dumps(payload, separators=(",", ":")))
+
+    async def live_workers(self) -> List[str]:
+        return await self._run(self._workers)
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                rows = await self._run(self._fetch)
+                for _, channel, payload, origin in rows:
+                    try:
+                        await self.handler(channel, json.loads(payload), origin)
+                    except Exception as e:
+                        logger.error(f"Event bus handler error on '{channel}': {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event bus poll error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.worker_ttl / 3)
+            try:
+                await self._run(self._heartbeat)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Event bus heartbeat error: {e}")
+
+
+BACKENDS = {
+    LocalEventBus.name: LocalEventBus,
+    SQLiteEventBus.name: SQLiteEventBus,
+}
+
+
+def create_event_bus(worker_id: str, backend: str = None) -> EventBus:
+    backend = backend or config.EVENT_BUS_BACKEND
+    bus_class = BACKENDS.get(backend)
+    if bus_class is None:
+        logger.warning(f"Unknown event bus backend '{backend}', using 'local'")
+        bus_class = LocalEventBus
+    return bus_class(worker_id)
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import config
+import crud
+import database
+import models
+from tracing import end_trace, start_trace
+
+logger = logging.getLogger(__name__)
+
+# Ошибки SSH, после которых имеет смысл повторить попытку: только сбои до отправки
+# команды. После таймаута или обрыва канала запуск мог уже состояться на хосте (nohup
+# отработал), и повтор запустил бы скрипт второй раз
+TRANSIENT_ERRORS = (
+    "Failed to establish connection",
+    "Connection refused",
+)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def is_transient_error(message: str) -> bool:
+    message = (message or "").lower()
+    return any(marker.lower() in message for marker in TRANSIENT_ERRORS)
+
+
+class JobContext:
+    """Выполняемое задание: payload, прогресс и уже обработанные машины (для возобновления)."""
+
+    def __init__(self, queue: "JobQueue", job: models.Job, db):
+        self.queue = queue
+        self.job_id = job.id
+        self.kind = job.kind
+        self.payload = job.get_payload()
+        self.db = db
+        self.completed: Set[Tuple[int, int]] = {
+            (r.step_index, r.machine_id) for r in crud.get_job_results(db, job.id)
+        }
+        self.machine_semaphore = asyncio.Semaphore(queue.machine_concurrency)
+
+    def is_done(self, step_index: int, machine_id: int) -> bool:
+        return (step_index, machine_id) in self.completed
+
+    def is_cancelled(self) -> bool:
+        status = crud.get_job_status(self.db, self.job_id)
+        return status is None or status == "cancelled"
+
+    def record(self, step_index: int, machine_id: int, success: bool,
+               message: str = None, attempts: int = 1):
+        crud.add_job_result(self.db, self.job_id, step_index, machine_id,
+                            success, message, attempts)
+        self.completed.add((step_index, machine_id))
+        self.queue.notify(self.job_id)
+
+    async def retry(self, call: Callable[[], Awaitable[Tuple[bool, str]]]) -> Tuple[bool, str, int]:
+        """Повторяет вызов при временных сбоях SSH с экспоненциальной задержкой.
+
+        call возвращает (success, message). Результат: (success, message, attempts).
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                success, message = await call()
+            except Exception as e:
+                success, message = False, str(e)
+            if success or attempt >= self.queue.max_attempts or not is_transient_error(message):
+                return success, message, attempt
+            delay = self.queue.retry_backoff * (2 ** (attempt - 1))
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+
+JobHandler = Callable[[JobContext], Awaitable[None]]
+
+
+class JobQueue:
+    """Очередь фоновых заданий, хранящаяся в БД, с ограниченным пулом исполнителей."""
+
+    def __init__(self, workers: int = None, max_queued: int = None,
+                 machine_concurrency: int = None):
+        self.workers = workers or config.JOB_WORKERS
+        self.max_queued = max_queued or config.JOB_MAX_QUEUED
+        self.machine_concurrency = machine_concurrency or config.JOB_MACHINE_CONCURRENCY
+        self.max_attempts = config.JOB_MAX_ATTEMPTS
+        self.retry_backoff = config.JOB_RETRY_BACKOFF
+        self.worker_id = "local"
+        self.handlers: Dict[str, JobHandler] = {}
+        self.on_progress: Optional[Callable[[int], None]] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def handler(self, kind: str):
+        def decorator(func: JobHandler):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def notify(self, job_id: int):
+        if self.on_progress:
+            self.on_progress(job_id)
+
+    async def start(self, worker_id: str, live_workers: List[str]):
+        self.worker_id = worker_id
+        self._wakeup = asyncio.Event()
+        db = database.SessionLocal()
+        try:
+            requeued = crud.requeue_interrupted_jobs(db, live_workers)
+            if requeued:
+                logger.info(f"Requeued {requeued} interrupted jobs")
+        finally:
+            db.close()
+        self._tasks = [asyncio.create_task(self._worker_loop(i)) for i in range(self.workers)]
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def submit(self, db, kind: str, payload: dict, priority: int = 0,
+               progress_total: int = 0) -> models.Job:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if crud.count_jobs_by_status(db, "queued") >= self.max_queued:
+            raise JobQueueFull(f"Job queue is full ({self.max_queued} queued jobs)")
+        job = crud.create_job(db, kind, payload, priority, progress_total)
+        if self._wakeup:
+            self._wakeup.set()
+        self.notify(job.id)
+        return job
+
+    async def _worker_loop(self, index: int):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=config.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Разбираем очередь, пока в ней есть задания
+            while True:
+                db = database.SessionLocal()
+                try:
+                    job = crud.claim_next_job(db, self.worker_id)
+                    if not job:
+                        break
+                    # Остальные исполнители тоже могут что-то взять
+                    self._wakeup.set()
+                    await self._run_job(job, db)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Job worker {index} error: {e}", exc_info=True)
+                    break
+                finally:
+                    db.close()
+
+    async def _run_job(self, job: models.Job, db):
+        handler = self.handlers.get(job.kind)
+        self.notify(job.id)
+        if handler is None:
+            crud.finish_job(db, job.id, "failed", f"No handler for job kind '{job.kind}'")
+            return
+        logger.info(f"Job {job.id} ({job.kind}) started, attempt {job.attempts}")
+        trace_token = start_trace(f"job {job.id} ({job.kind})")
+        ctx = JobContext(self, job, db)
+        try:
+            await handler(ctx)
+        except asyncio.CancelledError:
+            # Остановка сервера: задание вернётся в очередь при следующем старте
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            crud.finish_job(db, job.id, "failed", str(e))
+        else:
+            if not ctx.is_cancelled():
+                crud.finish_job(db, job.id, "done")
+        finally:
+            end_trace(trace_token, config.TRACE_SLOW_JOB)
+        self.notify(job.id)
+        logger.info(f"Job {job.id} finished")
+
+
+job_queue = JobQueue()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -18,9 +18,23 @@ class Machine(Base):
     is_active = Column(Boolean, default=True)
     last_checked = Column(DateTime, default=func.now())
     created_at = Column(DateTime, default=func.now())
+    # Ограничения нагрузки на sshd; None — значения по умолчанию из config
+    max_sessions = Column(Integer, nullable=True)   # одновременных каналов
+    rate_limit = Column(Float, nullable=True)       # новых каналов/подключений в секунду
+    rate_burst = Column(Integer, nullable=True)
+    # Ретранслятор площадки: подключения и массовые опросы идут через эту машину
+    relay_id = Column(Integer, ForeignKey("machines.id"), nullable=True)
+    # Профиль транспорта SSH (JSON, см. transport.py); None — настройки asyncssh по умолчанию
+    transport = Column(Text, nullable=True)
 
     processes = relationship("Process", back_populates="machine")
 
+    def get_transport(self):
+        return json.loads(self.transport) if self.transport else None
+
+    def set_transport(self, profile):
+        self.transport = json.dumps(profile) if profile else None
+
 
 class ProcessViewSetting(Base):
     __tablename__ = "process_view_settings"
@@ -116,10 +130,76 @@ class Process(Base):
     machine_id = Column(Integer, ForeignKey("machines.id"))
     script_id = Column(Integer, ForeignKey("scripts.id"), nullable=True)
     pid = Column(Integer, nullable=True)
+    pid_start = Column(String, nullable=True)   # время старта процесса (ps lstart): отличает его от чужого с тем же PID
     command = Column(String, nullable=False)
-    status = Column(String, default="running")  # running, stopped, error
+    status = Column(String, default="running")  # running, stopped, exited, error
+    log_path = Column(String, nullable=True)    # лог запуска на машине, например ~/.ssh_manager/logs/<id>.log
     started_at = Column(DateTime, default=func.now())
     stopped_at = Column(DateTime, nullable=True)
 
     machine = relationship("Machine", back_populates="processes")
-    script = relationship("Script")
\ No newline at end of file
+    script = relationship("Script")
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)            # script, profile
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed, cancelled
+    priority = Column(Integer, default=0)            # больше — раньше
+    payload = Column(Text, default="{}")             # JSON с контентом скриптов и списком машин
+    progress_total = Column(Integer, default=0)
+    progress_done = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    worker_id = Column(String, nullable=True)        # воркер, который выполняет задание
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    results = relationship("JobResult", back_populates="job")
+
+    def get_payload(self):
+        return json.loads(self.payload) if self.payload else {}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "progress_total": self.progress_total,
+            "progress_done": self.progress_done,
+            "attempts": self.attempts,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobResult(Base):
+    __tablename__ = "job_results"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True)
+    step_index = Column(Integer, default=0)
+    machine_id = Column(Integer, nullable=True)
+    success = Column(Boolean, default=False)
+    attempts = Column(Integer, default=1)
+    message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+
+    job = relationship("Job", back_populates="results")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "job_id": self.job_id,
+            "step_index": self.step_index,
+            "machine_id": self.machine_id,
+            "success": self.success,
+            "attempts": self.attempts,
+            "message": self.message,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
@@ -0,0 +1,48 @@
+import asyncio
+import concurrent.futures
+from typing import Callable, Optional
+
+import config
+from tracing import span
+
+
+class Offloader:
+    """Выполняет CPU-ёмкую работу (разбор вывода, сериализацию) вне потока event loop.
+
+    Небольшие данные обрабатываются на месте: передача в пул дороже самой работы.
+    Пул потоков, а не процессов: результат разбора — большие списки, и их пересылка
+    через pickle заняла бы event loop не меньше, чем сам разбор. GIL по-прежнему
+    общий, но интерпретатор переключает потоки каждые несколько миллисекунд, так что
+    остальные задачи loop не ждут окончания разбора целиком.
+    """
+
+    def __init__(self, threshold: int = None, workers: int = None):
+        self.threshold = config.OFFLOAD_THRESHOLD if threshold is None else threshold
+        self.workers = max(1, config.OFFLOAD_WORKERS if workers is None else workers)
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.offloaded = 0
+        self.inline = 0
+
+    async def run(self, func: Callable, *args, size: int = 0):
+        """func(*args) на месте, если size меньше порога, иначе — в пуле."""
+        if self.threshold <= 0 or size < self.threshold:
+            self.inline += 1
+            return func(*args)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="offload")
+        self.offloaded += 1
+        with span("offload", getattr(func, "__name__", "")):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {"workers": self.workers, "threshold": self.threshold,
+                "offloaded": self.offloaded, "inline": self.inline}
+
+
+offloader = Offloader()
@@ -0,0 +1,262 @@
+"""Агент событий процессов: следит за /proc и передаёт изменения одним долгим SSH-каналом.
+
+SSHManager загружает этот файл в кэш скриптов хоста (как агент ретранслятора) и запускает
+
+    python3 process_agent.py <interval> <host_interval>
+
+Только стандартная библиотека. Вывод — кадры «длина (4 байта, big-endian) + JSON»:
+
+    {"t": время хоста, "s": 1, "e": [событие, ...], "h": {секция: текст}}
+
+"s" есть только в первом кадре: его события — полный список процессов. События:
+
+    ["+", user, pid, cpu, mem, vsz, rss, tty, stat, start, time, command, started]
+                                                                         процесс появился
+    ["-", pid]                                                           процесс завершился
+    ["~", pid, cpu, mem, vsz, rss, stat, time]                           изменились ресурсы
+
+Поля и их формат — как у ps aux, поэтому строки агента и опроса через ps взаимозаменяемы;
+started — время старта в формате ps -o lstart (оно, в отличие от START, не меняется).
+"h" — сырые секции для метрик хоста, как у опроса (loadavg, meminfo, stat, df), не чаще
+раза в host_interval секунд; кадр с одной "h" служит и признаком жизни.
+
+/proc перечитывается каждые interval секунд: процессы, прожившие дольше интервала,
+видны, даже если контроллер спрашивает список реже. Агент завершается, когда канал
+закрыт (EOF на stdin или ошибка записи).
+"""
+import json
+import os
+import pwd
+import struct
+import sys
+import threading
+import time
+
+FRAME_HEADER = struct.Struct("!I")
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+MEMINFO_FIELDS = ("MemTotal:", "MemAvailable:", "SwapTotal:", "SwapFree:")
+# Индексы полей /proc/<pid>/stat после "(comm)"
+STATE, PPID, PGRP, SESSION, TTY_NR, TPGID = 0, 1, 2, 3, 4, 5
+UTIME, STIME, NICE, THREADS, STARTTIME, VSIZE, RSS = 11, 12, 16, 17, 19, 20, 21
+
+KTHREADD = 2
+
+_users = {}
+
+
+def read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def user_name(uid: int) -> str:
+    name = _users.get(uid)
+    if name is None:
+        try:
+            name = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            name = str(uid)
+        # Как ps: длинные имена обрезаются до 7 символов и «+»
+        if len(name) > 8:
+            name = name[:7] + "+"
+        _users[uid] = name
+    return name
+
+
+def tty_name(tty_nr: int) -> str:
+    major = (tty_nr >> 8) & 0xfff
+    minor = (tty_nr & 0xff) | ((tty_nr >> 12) & 0xfff00)
+    if 136 <= major <= 143:
+        return f"pts/{minor + (major - 136) * 256}"
+    if major == 4 and minor < 64:
+        return f"tty{minor}"
+    if major == 4:
+        return f"ttyS{minor - 64}"
+    return "?"
+
+
+def stat_flags(pid: int, fields: list) -> str:
+    """Столбец STAT: состояние и флаги (<, N, s, l, +) как у ps."""
+    flags = fields[STATE]
+    nice = int(fields[NICE])
+    if nice < 0:
+        flags += "<"
+    elif nice > 0:
+        flags += "N"
+    if int(fields[SESSION]) == pid:
+        flags += "s"
+    if int(fields[THREADS]) > 1:
+        flags += "l"
+    if fields[PGRP] == fields[TPGID]:
+        flags += "+"
+    return flags
+
+
+def start_column(started: float, now: float) -> str:
+    """Столбец START: время для процессов моложе суток, иначе дата, иначе год."""
+    age = now - started
+    if age < 24 * 3600:
+        return time.strftime("%H:%M", time.localtime(started))
+    if age < 365 * 24 * 3600:
+        return time.strftime("%b%d", time.localtime(started))
+    return time.strftime("%Y", time.localtime(started))
+
+
+def lstart_column(started: float) -> str:
+    """Время старта как у ps -o lstart, пробелы схлопнуты: «Mon Jan 1 10:00:00 2024»."""
+    local = time.localtime(started)
+    return f"{time.strftime('%a %b', local)} {local.tm_mday} {time.strftime('%H:%M:%S %Y', local)}"
+
+
+class Scanner:
+    def __init__(self):
+        self.boot_time = 0
+        for line in read("/proc/stat").splitlines():
+            if line.startswith("btime"):
+                self.boot_time = int(line.split()[1])
+        # pid -> [comm, starttime, строка ps aux]
+        self.known = {}
+
+    def mem_total_kb(self) -> int:
+        for line in read("/proc/meminfo").splitlines():
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1])
+        return 0
+
+    def process(self, pid: int, uptime: float, mem_total: int, now: float):
+        """(comm, starttime, ppid, строка ps aux без command) или None, если процесс уже завершился."""
+        try:
+            raw = read(f"/proc/{pid}/stat")
+            uid = os.stat(f"/proc/{pid}").st_uid
+        except OSError:
+            return None
+        comm = raw[raw.index("(") + 1:raw.rindex(")")]
+        fields = raw[raw.rindex(")") + 2:].split()
+        cpu_seconds = (int(fields[UTIME]) + int(fields[STIME])) / CLK_TCK
+        started = int(fields[STARTTIME]) / CLK_TCK
+        elapsed = uptime - started
+        rss_kb = int(fields[RSS]) * PAGE_KB
+        row = [
+            user_name(uid),
+            pid,
+            f"{100.0 * cpu_seconds / elapsed if elapsed > 0 else 0.0:.1f}",
+            f"{100.0 * rss_kb / mem_total if mem_total else 0.0:.1f}",
+            str(int(fields[VSIZE]) // 1024),
+            str(rss_kb),
+            tty_name(int(fields[TTY_NR])),
+            stat_flags(pid, fields),
+            start_column(self.boot_time + started, now),
+            f"{int(cpu_seconds) // 60}:{int(cpu_seconds) % 60:02d}",
+        ]
+        return comm, fields[STARTTIME], int(fields[PPID]), row
+
+    @staticmethod
+    def command(pid: int, comm: str) -> str:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().rstrip(b"\0")
+        except OSError:
+            cmdline = b""
+        if not cmdline:
+            # Потоки ядра и зомби — как в ps, имя в квадратных скобках
+            return f"[{comm}]"
+        return cmdline.replace(b"\0", b" ").decode("utf-8", errors="replace")
+
+    def scan(self) -> list:
+        now = time.time()
+        uptime = float(read("/proc/uptime").split()[0])
+        mem_total = self.mem_total_kb()
+        events = []
+        seen = set()
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            current = self.process(pid, uptime, mem_total, now)
+            if current is None:
+                continue
+            comm, starttime, ppid, row = current
+            seen.add(pid)
+            previous = self.known.get(pid)
+            # Новый процесс, повторно занятый PID, exec (сменилось имя) или смена формата
+            # START через сутки — строка целиком. Потоки ядра (kworker) меняют имя
+            # постоянно, для них это не exec
+            kernel = pid == KTHREADD or ppid == KTHREADD
+            if (previous is None or previous[1] != starttime or previous[2][8] != row[8]
+                    or (previous[0] != comm and not kernel)):
+                row.append(self.command(pid, comm))
+                row.append(lstart_column(self.boot_time + int(starttime) // CLK_TCK))
+                self.known[pid] = [comm, starttime, row]
+                events.append(["+"] + row)
+                continue
+            old = previous[2]
+            if old[2:6] != row[2:6] or old[7] != row[7] or old[9] != row[9]:
+                old[2:6] = row[2:6]
+                old[7] = row[7]
+                old[9] = row[9]
+                events.append(["~", pid] + row[2:6] + [row[7], row[9]])
+        for pid in [pid for pid in self.known if pid not in seen]:
+            del self.known[pid]
+            events.append(["-", pid])
+        return events
+
+
+def host_sections() -> dict:
+    sections = {}
+    try:
+        sections["loadavg"] = read("/proc/loadavg").strip()
+        sections["meminfo"] = "\n".join(line for line in read("/proc/meminfo").splitlines()
+                                        if line.startswith(MEMINFO_FIELDS))
+        sections["stat"] = read("/proc/stat").split("\n", 1)[0]
+    except OSError:
+        pass
+    try:
+        fs = os.statvfs("/")
+        total = fs.f_blocks * fs.f_frsize // 1024
+        used = (fs.f_blocks - fs.f_bfree) * fs.f_frsize // 1024
+        available = fs.f_bavail * fs.f_frsize // 1024
+        capacity = round(100 * used / (used + available)) if used + available else 0
+        # Строка в формате df -P -k
+        sections["df"] = f"/ {total} {used} {available} {capacity}% /"
+    except OSError:
+        pass
+    return sections
+
+
+def write_frame(frame: dict):
+    body = json.dumps(frame, separators=(",", ":")).encode("utf-8")
+    sys.stdout.buffer.write(FRAME_HEADER.pack(len(body)) + body)
+    sys.stdout.buffer.flush()
+
+
+def watch_stdin():
+    # Контроллер закрыл канал — завершаемся сразу, не дожидаясь ошибки записи
+    sys.stdin.buffer.read()
+    os._exit(0)
+
+
+def main():
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    host_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    threading.Thread(target=watch_stdin, daemon=True).start()
+
+    scanner = Scanner()
+    frame = {"t": time.time(), "s": 1, "e": scanner.scan(), "h": host_sections()}
+    last_host = time.monotonic()
+    try:
+        write_frame(frame)
+        while True:
+            time.sleep(interval)
+            frame = {"t": time.time(), "e": scanner.scan()}
+            if time.monotonic() - last_host >= host_interval:
+                frame["h"] = host_sections()
+                last_host = time.monotonic()
+            if frame["e"] or "h" in frame:
+                write_frame(frame)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == "__main__":
+    main()
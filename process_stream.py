@@ -0,0 +1,122 @@
+"""Список процессов хоста по событиям агента (process_agent.py).
+
+ProcessStream применяет кадры агента к таблице процессов и отдаёт её в формате
+poll_machine, так что живой список процессов читается из памяти, а не командой ps.
+Жизненным циклом потоков (запуск агента, простой, повторы) управляет SSHManager.
+"""
+import collections
+import re
+import time
+from typing import Dict, List, Optional
+
+import config
+
+# Поля строки (порядок — ssh_manager.PROCESS_FIELDS), которые меняет событие "~"
+RESOURCE_INDEXES = (2, 3, 4, 5, 7, 9)
+
+
+class ProcessStream:
+    def __init__(self, key: str):
+        self.key = key
+        # pid -> строка ps aux (user, pid, cpu, mem, vsz, rss, tty, stat, start, time, command)
+        # и время старта started (lstart)
+        self.rows: Dict[int, list] = {}
+        self.host_sections: Dict[str, str] = {}
+        # Завершившиеся процессы: (время завершения, строка) — в том числе короткоживущие,
+        # которых опрос через ps мог не застать
+        self.exited = collections.deque(maxlen=config.PROCESS_AGENT_MAX_EXITED)
+        self.ready = False
+        self.task = None
+        self.started = time.time()
+        self.last_frame: Optional[float] = None
+        self.last_read = time.monotonic()
+        self.frames = 0
+        self.events = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+        # Когда можно запускать агент снова после неудачи (monotonic)
+        self.retry_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def apply(self, frame: Dict, size: int = 0):
+        if frame.get("s"):
+            # Начальный снимок (в том числе после перезапуска агента) заменяет таблицу целиком
+            self.rows.clear()
+        now = time.time()
+        rows = self.rows
+        for event in frame.get("e", ()):
+            kind = event[0]
+            if kind == "+":
+                rows[event[2]] = event[1:]
+            elif kind == "-":
+                row = rows.pop(event[1], None)
+                if row is not None:
+                    self.exited.append((now, row))
+            elif kind == "~":
+                row = rows.get(event[1])
+                if row is not None:
+                    for index, value in zip(RESOURCE_INDEXES, event[2:]):
+                        row[index] = value
+        if "h" in frame:
+            self.host_sections = frame["h"]
+        self.events += len(frame.get("e", ()))
+        self.frames += 1
+        self.bytes += size
+        self.last_frame = now
+        self.ready = True
+
+    def touch(self):
+        self.last_read = time.monotonic()
+
+    def idle(self) -> bool:
+        return time.monotonic() - self.last_read > config.PROCESS_AGENT_IDLE
+
+    @staticmethod
+    def _matcher(process_filter: str):
+        """Как grep -i в опросе через ps: регулярное выражение по всей строке процесса."""
+        if not process_filter:
+            return None
+        try:
+            pattern = re.compile(process_filter, re.IGNORECASE)
+        except re.error:
+            pattern = re.compile(re.escape(process_filter), re.IGNORECASE)
+        return lambda row: pattern.search(" ".join(map(str, row))) is not None
+
+    @staticmethod
+    def _columns(rows: List[list], fields) -> Dict[str, list]:
+        columns = {field: [] for field in fields}
+        appends = [columns[field].append for field in fields]
+        for row in rows:
+            for append, value in zip(appends, row):
+                append(value)
+        return columns
+
+    def snapshot(self, fields, process_filter: str = None) -> Dict:
+        """Столбцы процессов (как parse_ps_aux) и процессы, завершившиеся за последние
+        PROCESS_AGENT_EXITED_WINDOW секунд (столбцы с дополнительным полем ended)."""
+        matches = self._matcher(process_filter)
+        rows = self.rows.values()
+        since = time.time() - config.PROCESS_AGENT_EXITED_WINDOW
+        exited = [(ended, row) for ended, row in self.exited if ended >= since]
+        if matches is not None:
+            rows = [row for row in rows if matches(row)]
+            exited = [(ended, row) for ended, row in exited if matches(row)]
+        exited_columns = self._columns([row for _ended, row in exited], fields)
+        exited_columns["ended"] = [round(ended, 3) for ended, _row in exited]
+        return {"processes": self._columns(rows, fields), "exited": exited_columns}
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "ready": self.ready,
+            "processes": len(self.rows),
+            "frames": self.frames,
+            "events": self.events,
+            "bytes": self.bytes,
+            "started": self.started,
+            "last_frame": self.last_frame,
+            "error": self.error,
+        }
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+import config
+import crud
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessReconciler:
+    """Периодическая сверка статусов запущенных процессов с машинами.
+
+    Все отслеживаемые PID одной машины проверяются одной SSH-командой, машины — параллельно
+    (не больше concurrency одновременно). Изменившиеся строки обновляются одной транзакцией.
+    """
+
+    def __init__(self, interval: float = None, concurrency: int = None):
+        self.interval = config.RECONCILE_INTERVAL if interval is None else interval
+        self.concurrency = concurrency or config.RECONCILE_CONCURRENCY
+        self.ssh_manager = None
+        self.on_change: Optional[Callable[[int], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.last_stats: Dict = {}
+
+    async def start(self, ssh_manager):
+        self.ssh_manager = ssh_manager
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Process reconcile failed: {e}", exc_info=True)
+
+    def _is_local(self, machine) -> bool:
+        # С несколькими воркерами каждый сверяет только свои подключения
+        router = self.ssh_manager.router
+        return router is None or router.is_local(machine.address, machine.ssh_port, machine.username)
+
+    async def reconcile_once(self) -> Dict:
+        async with self._lock:
+            started = time.monotonic()
+            db = database.SessionLocal()
+            try:
+                by_machine: Dict[int, List] = {}
+                for process in crud.get_running_processes(db):
+                    by_machine.setdefault(process.machine_id, []).append(process)
+
+                machines = {}
+                for machine_id in by_machine:
+                    machine = crud.get_machine(db, machine_id)
+                    if machine and machine.is_active and self._is_local(machine):
+                        machines[machine_id] = machine
+
+                semaphore = asyncio.Semaphore(self.concurrency)
+                stats = {"machines": len(machines), "processes": 0, "exited": 0, "errors": 0}
+
+                async def check(machine, processes) -> List[int]:
+                    async with semaphore:
+                        statuses = await self.ssh_manager.get_pids_status(
+                            machine.address, machine.ssh_port, machine.username, machine.password,
+                            sorted({p.pid for p in processes})
+                        )
+                    current = {item["pid"]: item["start"] for item in statuses}
+                    exited = []
+                    for process in processes:
+                        start = current.get(process.pid)
+                        # Процесса нет или PID уже принадлежит другому процессу
+                        if start is None or (process.pid_start and start != process.pid_start):
+                            exited.append(process.id)
+                    return exited
+
+                tasks = {machine_id: asyncio.create_task(check(machine, by_machine[machine_id]))
+                         for machine_id, machine in machines.items()}
+                exited_ids: List[int] = []
+                changed_machines = []
+                for machine_id, task in tasks.items():
+                    stats["processes"] += len(by_machine[machine_id])
+                    try:
+                        exited = await task
+                    except Exception as e:
+                        # Машина недоступна — статусы не трогаем до следующего прохода
+                        stats["errors"] += 1
+                        logger.warning(f"Reconcile of machine {machine_id} failed: {e}")
+                        continue
+                    if exited:
+                        exited_ids.extend(exited)
+                        changed_machines.append(machine_id)
+
+                stats["exited"] = crud.bulk_update_process_status(db, exited_ids, "exited")
+            finally:
+                db.close()
+
+            if self.on_change:
+                for machine_id in changed_machines:
+                    self.on_change(machine_id)
+            stats["seconds"] = round(time.monotonic() - started, 3)
+            stats["finished_at"] = time.time()
+            self.last_stats = stats
+            if stats["exited"]:
+                logger.info(f"Reconciled {stats['processes']} processes on {stats['machines']} machines, "
+                            f"{stats['exited']} exited")
+            return stats
+
+
+reconciler = ProcessReconciler()
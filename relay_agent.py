@@ -0,0 +1,109 @@
+"""Агент ретранслятора: выполняет команды на машинах площадки и возвращает общий ответ.
+
+SSHManager загружает этот файл на ретранслятор (кэш скриптов, как и обычные скрипты)
+и запускает его через python3 — только стандартная библиотека. Запрос приходит JSON
+через stdin:
+
+    {"targets": [{"key", "host", "port", "username", "password", "command"}, ...],
+     "timeout": 30, "concurrency": 32, "persist": 600}
+
+Ответ — gzip-сжатый JSON в stdout:
+
+    {"results": {key: {"exit_status", "stdout", "stderr"} | {"error"}}, "elapsed": сек}
+
+До машин площадки агент ходит системным ssh: пароль отдаёт SSH_ASKPASS, а
+подключения переиспользуются через ControlMaster и живут persist секунд после
+последней команды — повторные опросы не проходят рукопожатие заново.
+"""
+import concurrent.futures
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CONTROL_DIR = os.path.expanduser("~/.ssh_manager/relay")
+# ssh завершается с кодом 255, если не удалось подключиться или пройти аутентификацию
+SSH_ERROR_EXIT = 255
+
+
+def write_askpass(directory: str) -> str:
+    path = os.path.join(directory, "askpass.sh")
+    with open(path, "w") as f:
+        f.write('#!/bin/sh\nprintf \'%s\\n\' "$SSHM_RELAY_PASSWORD"\n')
+    os.chmod(path, 0o700)
+    return path
+
+
+def ssh_command(target: dict, timeout: float, persist: int) -> list:
+    return [
+        "ssh", "-T",
+        "-p", str(target.get("port") or 22),
+        "-o", "StrictHostKeyChecking=no",
+        "-o", "UserKnownHostsFile=/dev/null",
+        "-o", "LogLevel=ERROR",
+        "-o", f"ConnectTimeout={max(1, int(timeout))}",
+        "-o", "NumberOfPasswordPrompts=1",
+        "-o", "PreferredAuthentications=password,keyboard-interactive",
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={CONTROL_DIR}/cm-%C",
+        "-o", f"ControlPersist={persist}",
+        f"{target['username']}@{target['host']}",
+        target["command"],
+    ]
+
+
+def run_target(target: dict, askpass: str, timeout: float, persist: int) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "SSH_ASKPASS": askpass,
+        "SSH_ASKPASS_REQUIRE": "force",
+        # Старые версии OpenSSH вызывают SSH_ASKPASS, только если задан DISPLAY
+        "DISPLAY": env.get("DISPLAY", ":0"),
+        "SSHM_RELAY_PASSWORD": target.get("password") or "",
+    })
+    try:
+        result = subprocess.run(ssh_command(target, timeout, persist), stdin=subprocess.DEVNULL,
+                                capture_output=True, env=env, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": "Command timeout"}
+    except OSError as e:
+        return {"error": f"Cannot run ssh: {e}"}
+    stdout = result.stdout.decode("utf-8", errors="replace")
+    stderr = result.stderr.decode("utf-8", errors="replace")
+    if result.returncode == SSH_ERROR_EXIT and not stdout:
+        return {"error": stderr.strip() or "SSH connection failed"}
+    return {"exit_status": result.returncode, "stdout": stdout, "stderr": stderr}
+
+
+def main():
+    started = time.monotonic()
+    request = json.loads(sys.stdin.buffer.read())
+    targets = request.get("targets", [])
+    timeout = float(request.get("timeout", 30))
+    persist = int(request.get("persist", 600))
+    concurrency = max(1, int(request.get("concurrency", 32)))
+    os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="sshm-relay-") as directory:
+        askpass = write_askpass(directory)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(targets) or 1)) as pool:
+            futures = {pool.submit(run_target, target, askpass, timeout, persist): target["key"]
+                       for target in targets}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = {"error": str(e)}
+
+    body = json.dumps({"results": results, "elapsed": round(time.monotonic() - started, 3)},
+                      separators=(",", ":")).encode("utf-8")
+    sys.stdout.buffer.write(gzip.compress(body, compresslevel=6))
+    sys.stdout.buffer.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+import config
+from offload import offloader
+from tracing import render_json, span
+
+try:
+    import brotli
+except ImportError:  # без brotli ответы сжимаются только gzip
+    brotli = None
+
+
+def etag_for(body: bytes) -> str:
+    # Слабый ETag: тело одно и то же, а сжатое представление зависит от Accept-Encoding
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    """br, если клиент его принимает и brotli установлен, иначе gzip, иначе без сжатия."""
+    accepted = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def encode_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=config.RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=config.RESPONSE_GZIP_LEVEL)
+
+
+async def conditional_response(request: Request, body: bytes, etag: str = None,
+                               encoded: Dict[str, bytes] = None) -> Response:
+    """JSON-ответ с ETag: 304, если у клиента та же версия, иначе тело, сжатое по Accept-Encoding.
+
+    encoded — кэш уже сжатых вариантов тела (заполняется здесь же).
+    """
+    etag = etag or etag_for(body)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    encoding = negotiate_encoding(request) if len(body) >= config.RESPONSE_COMPRESS_MIN_SIZE else None
+    if encoding is None:
+        return Response(content=body, media_type="application/json", headers=headers)
+    data = encoded.get(encoding) if encoded is not None else None
+    if data is None:
+        with span("compress", encoding):
+            data = await offloader.run(encode_body, body, encoding, size=len(body))
+        if encoded is not None:
+            encoded[encoding] = data
+    headers["Content-Encoding"] = encoding
+    return Response(content=data, media_type="application/json", headers=headers)
+
+
+class _Entry:
+    __slots__ = ("version", "body", "etag", "created", "encoded")
+
+    def __init__(self, version: Tuple[int, ...], body: bytes):
+        self.version = version
+        self.body = body
+        self.etag = etag_for(body)
+        self.created = time.monotonic()
+        self.encoded: Dict[str, bytes] = {}
+
+
+class ResponseCache:
+    """Готовые (сериализованные и сжатые) тела ответов списочных эндпоинтов.
+
+    У каждой сущности (machines, scripts, ...) есть версия; она растёт при каждом
+    уведомлении об изменении (manager.notify, в том числе пришедшем от других воркеров),
+    и закэшированное тело с устаревшей версией собирается заново. ttl — страховка
+    на случай записи, о которой уведомление не отправили.
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = config.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.versions: Dict[str, int] = {}
+        self.entries: Dict[str, _Entry] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, topic: str):
+        entity = topic.split(":", 1)[0]
+        self.versions[entity] = self.versions.get(entity, 0) + 1
+
+    def _version(self, entities: Sequence[str]) -> Tuple[int, ...]:
+        return tuple(self.versions.get(entity, 0) for entity in entities)
+
+    async def respond(self, request: Request, key: str, entities: Sequence[str],
+                      build: Callable[[], object]) -> Response:
+        """Ответ из кэша по key; build() строит содержимое, если версия entities изменилась."""
+        version = self._version(entities)
+        entry = self.entries.get(key)
+        if entry is None or entry.version != version or time.monotonic() - entry.created > self.ttl:
+            self.misses += 1
+            entry = _Entry(version, render_json(jsonable_encoder(build())))
+            # Изменение во время сборки — тело уже может быть устаревшим, не кэшируем его
+            if self._version(entities) == version:
+                self.entries[key] = entry
+        else:
+            self.hits += 1
+        return await conditional_response(request, entry.body, entry.etag, entry.encoded)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "versions": dict(self.versions), "brotli": brotli is not None}
+
+
+response_cache = ResponseCache()
@@ -1,3 +1,4 @@
+import argparse
 import subprocess
 import sys
 import os
@@ -20,10 +21,21 @@ if __name__ == "__main__":
     # create_directories()
     # install_requirements()
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Количество процессов-воркеров uvicorn")
+    args = parser.parse_args()
+
     print("Запускаем приложение...")
     print("Откройте в браузере: http://localhost:8000")
 
-    from app import app
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if args.workers > 1:
+        # Воркерам нужна общая шина событий, иначе WebSocket-рассылки
+        # и SSH-подключения не согласованы между процессами
+        os.environ.setdefault("SSHM_EVENT_BUS", "sqlite")
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=args.workers)
+    else:
+        from app import app
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,370 @@
+"""Процесс-хранитель SSH-подключений (sidecar).
+
+Долгоживущий локальный процесс держит SSH-подключения ко всем машинам, а веб-приложение
+(любое число воркеров) обращается к нему через Unix-сокет. Рестарт или масштабирование
+веб-части не рвут установленные сессии: парку не нужно заново проходить рукопожатие
+и аутентификацию.
+
+    python sidecar.py --socket /run/sshm/sidecar.sock
+    SSHM_SIDECAR_SOCKET=/run/sshm/sidecar.sock python run.py
+
+Протокол — кадры «длина (4 байта, big-endian) + JSON»:
+    {"id": 1, "method": "poll_machine", "kwargs": {...}}  — вызов, ответ {"id": 1, "result": ...}
+                                                            или {"id": 1, "error": "...",
+                                                            "error_type": "ValueError"}
+    {"method": "configure_machine", "kwargs": {...}}       — без id: ответа нет
+    {"event": "breaker", "key": ..., "state": ...}         — событие хранителя всем клиентам
+
+Через хранитель идут все методы SSHManager с @routed; если он недоступен, вызов
+выполняется в самом воркере.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+import time
+from typing import Dict, Optional, Set
+
+import config
+from circuit_breaker import CircuitOpenError
+from offload import offloader
+from tracing import render_json
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json, только медленнее
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+# Методы SSHManager без @routed, которые хранитель тоже исполняет
+EXTRA_METHODS = ("configure_machine", "breaker_due_keys", "process_agent_stats")
+
+# Ошибки хранителя, которые клиент поднимает с тем же типом (по ним API выбирает код
+# ответа: 400 для ValueError, 503 для разомкнутого автомата); остальные — RuntimeError
+REMOTE_ERRORS = {error.__name__: error for error in (
+    CircuitOpenError, ValueError, TypeError, KeyError, LookupError, PermissionError,
+    ConnectionError, ConnectionRefusedError, ConnectionResetError, TimeoutError,
+    FileNotFoundError, OSError,
+)}
+
+
+class SidecarUnavailable(ConnectionError):
+    pass
+
+
+def _loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def encode_frame(message: Dict) -> bytes:
+    body = render_json(message)
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict]:
+    """Следующий кадр или None, если соединение закрыто."""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {size} bytes")
+    data = await reader.readexactly(size)
+    # Ответ со списком процессов большого хоста — мегабайты JSON, разбираем вне event loop
+    return await offloader.run(_loads, data, size=size)
+
+
+class SidecarClient:
+    """Клиент хранителя в воркере веб-приложения.
+
+    Одно Unix-соединение на воркер, вызовы мультиплексируются по id. Соединение
+    восстанавливается в фоне; после переподключения (в том числе к перезапущенному
+    хранителю) заново отправляются настройки машин.
+    """
+
+    def __init__(self, path: str = None, reconnect_interval: float = None):
+        self.path = path or config.SIDECAR_SOCKET
+        self.reconnect_interval = reconnect_interval or config.SIDECAR_RECONNECT_INTERVAL
+        self.ssh_manager = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        # Последние настройки по ключу подключения: повторяются при каждом подключении
+        self._configured: Dict[str, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._connected_event = asyncio.Event()
+        self.calls = 0
+        self.fallbacks = 0
+        self.connects = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None
+
+    async def start(self, ssh_manager, wait: float = None):
+        """Подключает SSHManager к хранителю; ждёт первого подключения не дольше wait сек."""
+        self.ssh_manager = ssh_manager
+        ssh_manager.sidecar = self
+        self._task = asyncio.create_task(self._run())
+        wait = config.SIDECAR_CONNECT_TIMEOUT if wait is None else wait
+        try:
+            await asyncio.wait_for(self._connected_event.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            logger.warning(f"Sidecar {self.path} is not available, SSH calls run in this worker")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.ssh_manager is not None:
+            self.ssh_manager.sidecar = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+            self.writer = writer
+            self.connects += 1
+            for kwargs in self._configured.values():
+                writer.write(encode_frame({"method": "configure_machine", "kwargs": kwargs}))
+            self._connected_event.set()
+            logger.info(f"Connected to sidecar {self.path}")
+            try:
+                await self._read_loop(reader)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Sidecar connection error: {e}")
+            finally:
+                self._disconnected(writer)
+            await asyncio.sleep(self.reconnect_interval)
+
+    def _disconnected(self, writer: asyncio.StreamWriter):
+        if self.writer is writer:
+            self.writer = None
+        self._connected_event.clear()
+        writer.close()
+        # Повторять вызовы нельзя: хранитель мог успеть их выполнить (запуск скрипта)
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(SidecarUnavailable("Sidecar connection lost"))
+        self._pending.clear()
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        while True:
+            message = await read_frame(reader)
+            if message is None:
+                logger.warning("Sidecar closed the connection")
+                return
+            if "event" in message:
+                self._on_event(message)
+                continue
+            future = self._pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    def _on_event(self, message: Dict):
+        if message["event"] == "breaker":
+            # Автоматы отключения живут в хранителе, а is_active машин меняет веб-часть
+            on_change = self.ssh_manager.breakers.on_change
+            if on_change:
+                try:
+                    on_change(message["key"], message["state"])
+                except Exception as e:
+                    logger.error(f"Error handling sidecar breaker event: {e}")
+
+    async def call(self, method: str, kwargs: Dict):
+        """Вызов метода в хранителе. Ждём не дольше SIDECAR_CALL_TIMEOUT (для вызовов
+        со своим timeout — дольше него); ответ после таймаута отбрасывается."""
+        if self.writer is None:
+            raise SidecarUnavailable(f"Sidecar {self.path} is not connected")
+        self._next_id += 1
+        call_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        self.calls += 1
+        try:
+            self.writer.write(encode_frame({"id": call_id, "method": method, "kwargs": kwargs}))
+            await self.writer.drain()
+            timeout = config.SIDECAR_CALL_TIMEOUT
+            if kwargs.get("timeout"):
+                timeout = max(timeout, float(kwargs["timeout"]) + 30)
+            try:
+                response = await asyncio.wait_for(future, timeout=timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Sidecar did not answer '{method}' in {timeout:.0f}s")
+        finally:
+            self._pending.pop(call_id, None)
+        if "error" in response:
+            error = REMOTE_ERRORS.get(response.get("error_type"), RuntimeError)
+            raise error(*response.get("error_args") or [response["error"]])
+        return response.get("result")
+
+    def configure_machine(self, key: str, kwargs: Dict):
+        """Настройки машины: отправляются сейчас (если подключены) и после каждого переподключения."""
+        self._configured[key] = kwargs
+        if self.writer is not None:
+            self.writer.write(encode_frame({"method": "configure_machine", "kwargs": kwargs}))
+
+    def stats(self) -> Dict:
+        return {
+            "socket": self.path,
+            "connected": self.connected,
+            "connects": self.connects,
+            "calls": self.calls,
+            "pending": len(self._pending),
+            "fallbacks": self.fallbacks,
+        }
+
+
+class SidecarServer:
+    """Сторона хранителя: исполняет вызовы клиентов на своём SSHManager."""
+
+    def __init__(self, ssh_manager, path: str):
+        self.ssh_manager = ssh_manager
+        self.path = path
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.clients: Set[asyncio.StreamWriter] = set()
+        self.started = time.time()
+        self.calls = 0
+        self.errors = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Сокет от прошлого запуска: занятый — значит, хранитель уже работает
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+                writer.close()
+                raise RuntimeError(f"Sidecar is already running on {self.path}")
+            except OSError:
+                os.unlink(self.path)
+        # Через сокет передаются пароли машин — доступ только владельцу
+        old_umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+        finally:
+            os.umask(old_umask)
+        logger.info(f"Sidecar listening on {self.path}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self.clients):
+                writer.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _method(self, name: str):
+        method = getattr(self.ssh_manager, name, None)
+        if method is None or not (hasattr(method, "__wrapped__") or name in EXTRA_METHODS):
+            raise AttributeError(f"Unknown method {name}")
+        return method
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients.add(writer)
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                asyncio.create_task(self._serve(writer, message))
+        except Exception as e:
+            logger.warning(f"Sidecar client error: {e}")
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def _serve(self, writer: asyncio.StreamWriter, message: Dict):
+        call_id = message.get("id")
+        response = {"id": call_id}
+        try:
+            if message["method"] == "stats":
+                response["result"] = self.stats()
+            else:
+                result = self._method(message["method"])(**message.get("kwargs", {}))
+                if asyncio.iscoroutine(result):
+                    result = await result
+                response["result"] = result
+            self.calls += 1
+        except Exception as e:
+            self.errors += 1
+            response["error"] = str(e) or type(e).__name__
+            response["error_type"] = type(e).__name__
+            if isinstance(e, CircuitOpenError):
+                response["error_args"] = [e.key, e.retry_in, e.last_error]
+        if call_id is not None and not writer.is_closing():
+            writer.write(encode_frame(response))
+
+    def broadcast(self, event: Dict):
+        frame = encode_frame(event)
+        for writer in self.clients:
+            if not writer.is_closing():
+                writer.write(frame)
+
+    def stats(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "clients": len(self.clients),
+            "calls": self.calls,
+            "errors": self.errors,
+            "connections": len(self.ssh_manager.connections),
+            "limits": self.ssh_manager.limits.stats(),
+            "breakers": self.ssh_manager.breakers.stats(),
+            "process_agents": sum(stream.running for stream in self.ssh_manager.streams.values()),
+        }
+
+
+sidecar_client = SidecarClient()
+
+
+async def serve(path: str):
+    from ssh_manager import ssh_manager
+    from warmup import warmer
+
+    server = SidecarServer(ssh_manager, path)
+    ssh_manager.breakers.on_change = lambda key, state: server.broadcast(
+        {"event": "breaker", "key": key, "state": state})
+    await server.start()
+    # Прогрев (SSHM_WARMUP=1) — здесь, а не в воркерах: подключения держит хранитель
+    await warmer.start(ssh_manager)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    await warmer.stop()
+    await server.stop()
+    await ssh_manager.close_all()
+    offloader.shutdown()
+    logger.info("Sidecar stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хранитель SSH-подключений SSH Manager")
+    parser.add_argument("--socket", default=config.SIDECAR_SOCKET or "./sshm-sidecar.sock",
+                        help="путь Unix-сокета (по умолчанию SSHM_SIDECAR_SOCKET)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, не больше burst накопленных."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Очередь ожидающих под замком — токены выдаются в порядке прихода
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class HostLimiter:
+    """Лимиты одного хоста: одновременные каналы и скорость их открытия."""
+
+    def __init__(self, max_sessions: int, rate: float, burst: int):
+        self.max_sessions = max_sessions
+        self.semaphore = asyncio.Semaphore(max_sessions)
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, waited: float):
+        if waited > 0.001:
+            self.waits += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def stats(self) -> Dict:
+        return {
+            "max_sessions": self.max_sessions,
+            "rate": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "in_flight": self.in_flight,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait": round(self.max_wait, 3),
+        }
+
+
+class SSHLimits:
+    """Реестр лимитов по ключам подключений плюс общий лимит каналов контроллера."""
+
+    def __init__(self, default_sessions: int, default_rate: float, default_burst: int,
+                 global_sessions: int, wait_timeout: float):
+        self.default_sessions = default_sessions
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.wait_timeout = wait_timeout
+        self.global_semaphore = asyncio.Semaphore(global_sessions)
+        self.global_sessions = global_sessions
+        self.hosts: Dict[str, HostLimiter] = {}
+        self.global_waits = 0
+        self.global_wait_seconds = 0.0
+
+    def configure(self, key: str, max_sessions: Optional[int] = None,
+                  rate: Optional[float] = None, burst: Optional[int] = None):
+        sessions = max_sessions or self.default_sessions
+        rate = rate or self.default_rate
+        burst = burst or self.default_burst
+        current = self.hosts.get(key)
+        if current and (current.max_sessions, current.bucket.rate, current.bucket.burst) == (sessions, rate, burst):
+            return
+        # Новый лимитер применяется к следующим каналам; текущие дорабатывают со старым
+        self.hosts[key] = HostLimiter(sessions, rate, burst)
+
+    def get(self, key: str) -> HostLimiter:
+        limiter = self.hosts.get(key)
+        if limiter is None:
+            limiter = HostLimiter(self.default_sessions, self.default_rate, self.default_burst)
+            self.hosts[key] = limiter
+        return limiter
+
+    def channel(self, key: str) -> "_Slot":
+        """Слот под один канал: лимит хоста и токен скорости, затем общий лимит."""
+        return _Slot(self, self.get(key))
+
+    async def throttle_connect(self, key: str):
+        """Попытка подключения расходует только токен скорости хоста."""
+        limiter = self.get(key)
+        started = time.monotonic()
+        await asyncio.wait_for(limiter.bucket.acquire(), timeout=self.wait_timeout)
+        limiter.record_wait(time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        return {
+            "global": {
+                "max_sessions": self.global_sessions,
+                "waits": self.global_waits,
+                "wait_seconds": round(self.global_wait_seconds, 3),
+            },
+            "hosts": {key: limiter.stats() for key, limiter in self.hosts.items()},
+        }
+
+
+class _Slot:
+    def __init__(self, limits: SSHLimits, limiter: HostLimiter):
+        self.limits = limits
+        self.limiter = limiter
+        self._acquired = []
+
+    async def _acquire(self):
+        # Сначала лимиты хоста, потом общий слот: очередь к медленному или ограниченному
+        # хосту ждёт, не занимая общих слотов, и не задерживает остальные хосты
+        started = time.monotonic()
+        await self.limiter.semaphore.acquire()
+        self._acquired.append(self.limiter.semaphore)
+        await self.limiter.bucket.acquire()
+        self.limiter.record_wait(time.monotonic() - started)
+        started = time.monotonic()
+        await self.limits.global_semaphore.acquire()
+        self._acquired.append(self.limits.global_semaphore)
+        global_waited = time.monotonic() - started
+        if global_waited > 0.001:
+            self.limits.global_waits += 1
+            self.limits.global_wait_seconds += global_waited
+
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(self._acquire(), timeout=self.limits.wait_timeout)
+        except BaseException:
+            self._release()
+            raise
+        self.limiter.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.in_flight -= 1
+        self._release()
+        return False
+
+    def _release(self):
+        while self._acquired:
+            self._acquired.pop().release()
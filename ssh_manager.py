@@ -2,110 +2,726 @@ import asyncio
 import asyncssh
 from typing import Dict, List, Optional, Tuple
 import datetime
+import functools
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import shlex
 import socket
+import struct
+import time
 import logging
+import re
+import uuid
+
+import config
+from circuit_breaker import CircuitBreakers, CircuitOpenError
+from distribution import RemotePath
+from offload import offloader
+from process_stream import ProcessStream
+from ssh_limits import SSHLimits
+from tracing import span
+from transport import PROFILES, connect_options, sample_command, summarize
+from telemetry import (SSH_BREAKER_REJECTIONS, SSH_BREAKER_TRIPS, SSH_COMMAND_SECONDS,
+                       SSH_CONNECT_FAILURES, SSH_HANDSHAKE_SECONDS, SSH_POOL_HITS,
+                       SSH_POOL_MISSES)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Кэш скриптов на удалённых хостах (имя файла — sha256 содержимого)
+SCRIPT_CACHE_DIR = '"$HOME"/.ssh_manager/scripts'
+SCRIPT_MISSING_EXIT = 97
+
+# Логи фоновых запусков: у каждого запуска свой файл
+RUN_LOG_DIR = "~/.ssh_manager/logs"
+LOG_MISSING_EXIT = 3
+
+
+def new_run_log_path() -> str:
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"{RUN_LOG_DIR}/{stamp}-{uuid.uuid4().hex[:12]}.log"
+
+
+def parse_launch_output(stdout: str) -> Tuple[Optional[int], Optional[str]]:
+    """Разбирает строку "<pid> <время старта>", которую печатает обёртка запуска."""
+    for line in reversed((stdout or "").strip().split('\n')):
+        parts = line.split(None, 1)
+        if parts and parts[0].isdigit():
+            start = ' '.join(parts[1].split()) if len(parts) > 1 else None
+            return int(parts[0]), start or None
+    return None, None
+
+
+# Опрос машины: ps и метрики хоста одной командой, каждая секция начинается с маркера
+SECTION_MARKER = "@@sshm:"
+POLL_COMMAND = (
+    "echo '" + SECTION_MARKER + "ps'; {ps}; "
+    "echo '" + SECTION_MARKER + "starts'; ps -eo pid=,lstart= 2>/dev/null; "
+    "echo '" + SECTION_MARKER + "loadavg'; cat /proc/loadavg 2>/dev/null; "
+    "echo '" + SECTION_MARKER + "meminfo'; "
+    "grep -E '^(MemTotal|MemAvailable|SwapTotal|SwapFree):' /proc/meminfo 2>/dev/null; "
+    "echo '" + SECTION_MARKER + "stat'; head -n 1 /proc/stat 2>/dev/null; "
+    "echo '" + SECTION_MARKER + "df'; df -P -k / 2>/dev/null | tail -n 1; "
+    "true"
+)
+
+
+def split_sections(output: str) -> Dict[str, str]:
+    sections: Dict[str, List[str]] = {}
+    current = None
+    for line in output.split('\n'):
+        if line.startswith(SECTION_MARKER):
+            current = line[len(SECTION_MARKER):].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return {name: '\n'.join(lines) for name, lines in sections.items()}
+
+
+# Поля строки ps aux; список процессов машины хранится по столбцам в этом порядке
+PROCESS_FIELDS = ("user", "pid", "cpu", "mem", "vsz", "rss", "tty", "stat", "start", "time", "command")
+# Необязательный столбец: точное время старта в формате lstart (как Process.pid_start).
+# START из ps aux через сутки меняет формат (HH:MM -> MonDD), а lstart — нет
+STARTED_FIELD = "started"
+
+
+def parse_ps_aux(output: str) -> Dict[str, list]:
+    """Разбирает вывод ps aux в столбцы {поле: [значения]} — без словаря на каждую строку."""
+    columns = {field: [] for field in PROCESS_FIELDS}
+    appends = [columns[field].append for field in PROCESS_FIELDS]
+    for line in output.splitlines():
+        parts = line.rstrip().split(None, 10)
+        if len(parts) < 11:
+            continue
+        try:
+            parts[1] = int(parts[1])
+        except ValueError:
+            # Строка заголовка
+            continue
+        for append, value in zip(appends, parts):
+            append(value)
+    return columns
+
+
+def parse_process_starts(output: str) -> Dict[int, str]:
+    """Вывод ps -eo pid=,lstart= -> {pid: lstart}; пробелы схлопнуты, как в _ps_start."""
+    starts = {}
+    for line in output.splitlines():
+        pid, _, started = line.strip().partition(' ')
+        if pid.isdigit() and started.strip():
+            starts[int(pid)] = ' '.join(started.split())
+    return starts
+
+
+def process_rows(columns: Dict[str, list]) -> List[Dict]:
+    """Столбцы процессов -> список словарей (для мест, где нужен построчный вид)."""
+    fields = [field for field in PROCESS_FIELDS if field in columns]
+    return [dict(zip(fields, values)) for values in zip(*(columns[f] for f in fields))]
+
+
+def parse_host_metrics(sections: Dict[str, str]) -> Dict:
+    """Метрики хоста из секций опроса. Отсутствующие на хосте источники пропускаются.
+
+    cpu_counters — сырые счётчики /proc/stat: загрузку CPU считают по разнице двух опросов.
+    """
+    metrics: Dict = {}
+    loadavg = sections.get("loadavg", "").split()
+    if len(loadavg) >= 3:
+        try:
+            metrics["load1"], metrics["load5"], metrics["load15"] = (float(v) for v in loadavg[:3])
+        except ValueError:
+            pass
+
+    meminfo = {}
+    for line in sections.get("meminfo", "").split('\n'):
+        name, _, value = line.partition(':')
+        if value.split():
+            meminfo[name.strip()] = int(value.split()[0])
+    if meminfo.get("MemTotal"):
+        available = meminfo.get("MemAvailable", 0)
+        metrics["mem_total_kb"] = meminfo["MemTotal"]
+        metrics["mem_available_kb"] = available
+        metrics["mem_used_pct"] = round(100.0 * (1 - available / meminfo["MemTotal"]), 2)
+    if meminfo.get("SwapTotal"):
+        metrics["swap_used_pct"] = round(100.0 * (1 - meminfo.get("SwapFree", 0) / meminfo["SwapTotal"]), 2)
+
+    cpu = sections.get("stat", "").split()
+    if len(cpu) >= 5 and cpu[0] == "cpu":
+        counters = [int(v) for v in cpu[1:] if v.isdigit()]
+        # idle + iowait
+        idle = counters[3] + (counters[4] if len(counters) > 4 else 0)
+        metrics["cpu_counters"] = [sum(counters), idle]
+
+    df = sections.get("df", "").split()
+    if len(df) >= 6 and df[1].isdigit():
+        total, used, available = int(df[1]), int(df[2]), int(df[3])
+        metrics["disk_total_kb"] = total
+        metrics["disk_available_kb"] = available
+        if used + available:
+            metrics["disk_used_pct"] = round(100.0 * used / (used + available), 2)
+    return metrics
+
+
+def parse_poll_output(stdout: str) -> Dict:
+    """Вывод POLL_COMMAND -> {"processes": столбцы, "host": метрики}. Может выполняться в пуле."""
+    sections = split_sections(stdout)
+    processes = parse_ps_aux(sections.get("ps", ""))
+    starts = parse_process_starts(sections.get("starts", ""))
+    processes[STARTED_FIELD] = [starts.get(pid) for pid in processes["pid"]]
+    return {
+        "processes": processes,
+        "host": parse_host_metrics(sections),
+    }
+
+
+def poll_command(process_filter: str = None) -> str:
+    if process_filter:
+        ps_command = f"ps aux | grep -i '{process_filter}' | grep -v grep"
+    else:
+        ps_command = "ps aux"
+    return POLL_COMMAND.format(ps=ps_command)
+
+
+# Агенты на хостах загружаются в кэш скриптов: ретранслятора (relay_agent.py)
+# и событий процессов (process_agent.py)
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+RELAY_AGENT_PATH = os.path.join(AGENTS_DIR, "relay_agent.py")
+PROCESS_AGENT_PATH = os.path.join(AGENTS_DIR, "process_agent.py")
+# Кадр агента событий процессов: длина (4 байта, big-endian) + JSON
+AGENT_FRAME_HEADER = struct.Struct("!I")
+
+
+@functools.lru_cache(maxsize=None)
+def agent_source(path: str) -> Tuple[str, str]:
+    """(исходник агента, sha256)."""
+    with open(path) as f:
+        source = f.read()
+    return source, hashlib.sha256(source.encode()).hexdigest()
+
+
+def parse_relay_output(stdout: bytes) -> Dict:
+    return json.loads(gzip.decompress(stdout))
+
+
+def substitute_script_params(script_content: str, params: list) -> str:
+    """Подставляет параметры вида $NAME или ${NAME} в скрипт."""
+    result = script_content
+    for p in params:
+        name = str(p.get('name', '')).strip()
+        value = str(p.get('value', ''))
+        if not name:
+            continue
+        # Экранируем одинарные кавычки для shell
+        safe_value = value.replace("'", "'\"'\"'")
+        # Шаблон: совпадает $NAME и ${NAME}
+        pattern = r'\$(?:' + re.escape(name) + r'\b|\{' + re.escape(name) + r'\})'
+        # Заменяем на значение в одинарных кавычках
+        result = re.sub(pattern, f"'{safe_value}'", result)
+    return result
+
+
+def _ps_start(pid) -> str:
+    """Команда, печатающая время старта процесса (пусто, если процесса нет).
+
+    Пара (PID, время старта) отличает наш процесс от чужого, получившего тот же PID.
+    """
+    return f"$(ps -o lstart= -p {pid} 2>/dev/null)"
+
+
+def routed(func):
+    """Выполняет метод там, где живёт подключение (host, port, username): в процессе-хранителе
+    (sidecar), если он подключён, иначе на воркере-владельце.
+
+    Без хранителя и маршрутизатора (один воркер) метод вызывается напрямую.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        router = self.router
+        sidecar = self.sidecar
+        if router is None and sidecar is None:
+            return await func(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        call_kwargs = dict(bound.arguments)
+        call_kwargs.pop("self")
+        if sidecar is not None:
+            if sidecar.connected:
+                return await sidecar.call(func.__name__, call_kwargs)
+            # Хранитель недоступен — подключаемся сами, чтобы не терять запрос
+            sidecar.fallbacks += 1
+        if router is None or router.is_local(call_kwargs["host"], call_kwargs["port"],
+                                             call_kwargs["username"]):
+            return await func(self, *args, **kwargs)
+        return await router.forward(func.__name__, call_kwargs,
+                                    lambda: func(self, *args, **kwargs))
+
+    return wrapper
 
 
 class SSHManager:
     def __init__(self):
         self.connections: Dict[str, asyncssh.SSHClientConnection] = {}
         self.lock = asyncio.Lock()
+        # Маршрутизатор вызовов между воркерами (cluster.Cluster), если их несколько
+        self.router = None
+        # Процесс-хранитель подключений (sidecar.SidecarClient), если он используется
+        self.sidecar = None
+        # Хеши скриптов, уже загруженных на хост (по ключу подключения)
+        self.script_cache: Dict[str, set] = {}
+        # Готовность подключений, которые держит прогрев (warmup.ConnectionWarmer)
+        self.readiness: Dict[str, Dict] = {}
+        # Ретрансляторы машин площадок: ключ машины -> {"host", "port", "username", "password"}
+        self.relays: Dict[str, Dict] = {}
+        # Потоки событий процессов от агентов на хостах (process_stream.ProcessStream)
+        self.streams: Dict[str, ProcessStream] = {}
+        # Профили транспорта машин (transport.py): ключ машины -> профиль
+        self.transports: Dict[str, Dict] = {}
+        self.limits = SSHLimits(
+            default_sessions=config.SSH_MAX_SESSIONS_PER_HOST,
+            default_rate=config.SSH_RATE_LIMIT,
+            default_burst=config.SSH_RATE_BURST,
+            global_sessions=config.SSH_GLOBAL_MAX_SESSIONS,
+            wait_timeout=config.SSH_LIMIT_WAIT_TIMEOUT
+        )
+        # Автоматы отключения: недоступный хост не ждёт таймаут подключения при каждом вызове
+        self.breakers = CircuitBreakers(
+            failure_threshold=config.BREAKER_FAILURES,
+            open_seconds=config.BREAKER_OPEN_SECONDS,
+            max_open_seconds=config.BREAKER_MAX_OPEN_SECONDS
+        )
+
+    @staticmethod
+    def _key(host: str, port: int, username: str) -> str:
+        return f"{host}:{port}:{username}"
+
+    def configure_machine(self, host: str, port: int, username: str,
+                          max_sessions: int = None, rate_limit: float = None,
+                          rate_burst: int = None, relay: Dict = None, transport: Dict = None):
+        """Задаёт лимиты подключения для машины (None — значения по умолчанию).
+
+        relay — ретранслятор площадки ({"host", "port", "username", "password"}): подключения
+        к машине идут через него (SSH-туннель), а не напрямую с контроллера.
+        transport — профиль транспорта (см. transport.py); при его смене подключение из пула
+        закрывается, следующее открывается уже с новыми настройками.
+        """
+        key = self._key(host, port, username)
+        self.limits.configure(key, max_sessions, rate_limit, rate_burst)
+        if relay:
+            self.relays[key] = relay
+        else:
+            self.relays.pop(key, None)
+        if transport != self.transports.get(key):
+            if transport:
+                self.transports[key] = transport
+            else:
+                self.transports.pop(key, None)
+            conn = self.connections.pop(key, None)
+            if conn is not None:
+                conn.close()
+        if self.sidecar is not None:
+            self.sidecar.configure_machine(key, {
+                "host": host, "port": port, "username": username, "max_sessions": max_sessions,
+                "rate_limit": rate_limit, "rate_burst": rate_burst, "relay": relay,
+                "transport": transport})
+
+    async def breaker_due_keys(self) -> List[str]:
+        """Ключи подключений, которым пора пробное подключение (см. circuit_breaker)."""
+        if self.sidecar is not None and self.sidecar.connected:
+            return await self.sidecar.call("breaker_due_keys", {})
+        return self.breakers.due_keys()
+
+    def channel_slot(self, host: str, port: int, username: str):
+        """Слот лимитов для каналов, открываемых в обход _run (SFTP, долгие процессы)."""
+        return self.limits.channel(self._key(host, port, username))
+
+    async def _run(self, key: str, conn: asyncssh.SSHClientConnection, command: str,
+                   operation: str = "exec", **kwargs):
+        """conn.run с учётом лимитов каналов хоста и контроллера.
+
+        operation — метка для гистограммы времени команд (list, exec, kill, status, probe).
+        """
+        async with self.limits.channel(key):
+            started = time.perf_counter()
+            try:
+                with span("ssh", operation):
+                    return await conn.run(command, **kwargs)
+            finally:
+                SSH_COMMAND_SECONDS.labels(key, operation).observe(time.perf_counter() - started)
+
+    async def _connect(self, key: str, host: str, port: int, username: str, password: str,
+                       force: bool = False):
+        """Новое подключение: автомат отключения хоста, токен скорости, рукопожатие.
+
+        При разомкнутом автомате сразу поднимает CircuitOpenError (force — попытка всё равно).
+        """
+        try:
+            self.breakers.acquire(key, force)
+        except CircuitOpenError:
+            SSH_BREAKER_REJECTIONS.inc()
+            raise
+        try:
+            await self.limits.throttle_connect(key)
+        except BaseException:
+            self.breakers.release(key)
+            raise
+        try:
+            conn = await self._handshake(key, host, port, username, password,
+                                         self.transports.get(key))
+        except asyncio.CancelledError:
+            self.breakers.release(key)
+            raise
+        except Exception as e:
+            SSH_CONNECT_FAILURES.inc()
+            if self.breakers.failure(key, str(e) or type(e).__name__):
+                SSH_BREAKER_TRIPS.inc()
+                logger.warning(f"Circuit breaker opened for {host}:{port} after repeated failures: {e}")
+            raise
+        self.breakers.success(key)
+        return conn
+
+    async def _handshake(self, key: str, host: str, port: int, username: str, password: str,
+                         transport: Dict = None) -> asyncssh.SSHClientConnection:
+        """asyncssh.connect с профилем транспорта машины (через ретранслятор, если он задан)."""
+        started = time.perf_counter()
+        try:
+            with span("ssh_connect", key):
+                tunnel = None
+                relay = self.relays.get(key)
+                if relay is not None:
+                    # Машина площадки: туннель через подключение к её ретранслятору
+                    tunnel = await self.get_connection(relay["host"], relay["port"],
+                                                       relay["username"], relay["password"])
+                    if tunnel is None:
+                        raise ConnectionError(f"Relay {relay['host']}:{relay['port']} is unreachable")
+                return await asyncssh.connect(
+                    host=host,
+                    port=port,
+                    username=username,
+                    password=password,
+                    known_hosts=None,
+                    tunnel=tunnel,
+                    login_timeout=10,
+                    connect_timeout=10,
+                    # Обрыв связи замечается без команд: по keepalive, а не при следующем запросе
+                    keepalive_count_max=3,
+                    **connect_options(transport)
+                )
+        finally:
+            SSH_HANDSHAKE_SECONDS.labels(key).observe(time.perf_counter() - started)
 
     async def get_connection(self, host: str, port: int, username: str, password: str) -> Optional[asyncssh.SSHClientConnection]:
-        key = f"{host}:{port}:{username}"
+        key = self._key(host, port, username)
         async with self.lock:
-            if key in self.connections:
-                conn = self.connections[key]
-                try:
-                    await conn.run("echo test", timeout=2)
-                    return conn
-                except Exception:
-                    del self.connections[key]
+            conn = self.connections.get(key)
+        if conn is not None:
+            # Проверка вне общего замка: ожидание лимитов одного хоста не блокирует остальные
+            try:
+                await self._run(key, conn, "echo test", operation="probe", timeout=2)
+                SSH_POOL_HITS.inc()
+                return conn
+            except Exception:
+                async with self.lock:
+                    if self.connections.get(key) is conn:
+                        del self.connections[key]
+                # Закрываем явно: иначе зависшее подключение остаётся открытым
+                conn.close()
 
+        SSH_POOL_MISSES.inc()
         try:
-            conn = await asyncssh.connect(
-                host=host,
-                port=port,
-                username=username,
-                password=password,
-                known_hosts=None,
-                login_timeout=10,
-                connect_timeout=10
-            )
+            conn = await self._connect(key, host, port, username, password)
             self.connections[key] = conn
             return conn
+        except CircuitOpenError as e:
+            logger.debug(str(e))
+            return None
         except Exception as e:
             logger.error(f"SSH connection error to {host}:{port}: {e}")
             return None
 
+    async def ensure_connection(self, host: str, port: int, username: str,
+                                password: str) -> asyncssh.SSHClientConnection:
+        """Подключение из пула без проверочной команды, а если его нет — новое.
+
+        Для прогрева: живость подключения отслеживают keepalive и wait_closed, ошибки
+        подключения не глушатся, чтобы вызывающий мог отложить повтор.
+        """
+        key = self._key(host, port, username)
+        conn = self.connections.get(key)
+        if conn is not None:
+            return conn
+        conn = await self._connect(key, host, port, username, password)
+        existing = self.connections.get(key)
+        if existing is not None:
+            # Пока шло подключение, пул заполнил get_connection
+            conn.close()
+            return existing
+        self.connections[key] = conn
+        return conn
+
+    def discard_connection(self, host: str, port: int, username: str, conn):
+        """Убирает из пула закрывшееся подключение (если его ещё не заменили)."""
+        key = self._key(host, port, username)
+        if self.connections.get(key) is conn:
+            del self.connections[key]
+
+    def set_readiness(self, host: str, port: int, username: str, state: str, **info):
+        self.readiness[self._key(host, port, username)] = {"state": state, "since": time.time(), **info}
+
+    def clear_readiness(self, host: str, port: int, username: str):
+        self.readiness.pop(self._key(host, port, username), None)
+
+    @routed
+    async def connection_readiness(self, host: str, port: int, username: str) -> Dict:
+        """Состояние подключения: hot | connecting | backoff | cold, а при разомкнутом
+        автомате отключения — open (с retry_in и последней ошибкой)."""
+        key = self._key(host, port, username)
+        breaker = self.breakers.breakers.get(key)
+        if breaker is not None and breaker.state != "closed":
+            return {**breaker.stats(), "state": "open", "breaker": breaker.state}
+        state = self.readiness.get(key)
+        if state is not None:
+            return state
+        return {"state": "hot" if key in self.connections else "cold"}
+
+    @routed
     async def get_processes_from_machine(
         self, host: str, port: int, username: str, password: str, process_filter: str = None
     ) -> List[Dict]:
+        result = await self.poll_machine(host, port, username, password, process_filter)
+        processes = process_rows(result["processes"])
+        for process in processes:
+            process['machine_host'] = host
+        return processes
+
+    @routed
+    async def poll_machine(
+        self, host: str, port: int, username: str, password: str, process_filter: str = None
+    ) -> Dict:
+        """Процессы (по столбцам, см. parse_ps_aux) и метрики хоста одной командой:
+        {"processes": {поле: [...]}, "host": {...}}. Если опросить хост не удалось, списки
+        пустые и есть "error" — такой ответ не означает, что процессы завершились.
+
+        С агентом событий процессов (SSHM_PROCESS_AGENT=1) список берётся из потока агента
+        без команды на хосте; в ответе тогда есть и exited — недавно завершившиеся процессы.
+        Пока агент запускается или недоступен, работает опрос через ps.
+        """
+        key = self._key(host, port, username)
+        stream = self.streams.get(key)
+        if stream is not None and stream.ready:
+            stream.touch()
+            poll = stream.snapshot(PROCESS_FIELDS + (STARTED_FIELD,), process_filter)
+            poll["host"] = parse_host_metrics(stream.host_sections)
+            return poll
+
         conn = await self.get_connection(host, port, username, password)
         if not conn:
-            return []
-
-        if process_filter:
-            command = f"ps aux | grep -i '{process_filter}' | grep -v grep"
-        else:
-            command = "ps aux"
+            return {"processes": parse_ps_aux(""), "host": {}, "error": "Failed to establish connection"}
+        if config.PROCESS_AGENT:
+            self._start_stream(key, conn)
 
         try:
-            result = await conn.run(command, timeout=10)
-            if result.exit_status != 0:
-                return []
+            result = await self._run(self._key(host, port, username), conn,
+                                     poll_command(process_filter), operation="list", timeout=10)
+            # Вывод большого хоста (мегабайты ps) разбирается вне event loop
+            return await offloader.run(parse_poll_output, result.stdout, size=len(result.stdout))
+        except Exception as e:
+            logger.error(f"Error getting processes from {host}: {e}")
+            return {"processes": parse_ps_aux(""), "host": {}, "error": str(e) or type(e).__name__}
 
-            processes = []
-            lines = result.stdout.strip().split('\n')
-            for line in lines:
-                if not line.strip():
-                    continue
-                parts = line.split()
-                if len(parts) >= 11:
+    def _start_stream(self, key: str, conn: asyncssh.SSHClientConnection):
+        stream = self.streams.get(key)
+        if stream is not None and (stream.running or time.monotonic() < stream.retry_at):
+            return
+        stream = ProcessStream(key)
+        stream.task = asyncio.create_task(self._stream_processes(key, conn, stream))
+        self.streams[key] = stream
+
+    async def _stream_processes(self, key: str, conn: asyncssh.SSHClientConnection,
+                                stream: ProcessStream):
+        """Держит канал агента событий процессов, пока список процессов хоста читают."""
+        # Агент присылает кадр не реже раза в host_interval; дольше тишины — канал завис
+        stale = max(3 * config.PROCESS_AGENT_HOST_INTERVAL, 10.0)
+        try:
+            path, digest = await self._upload_agent(key, conn, PROCESS_AGENT_PATH)
+            command = (f"[ -f {path} ] || exit {SCRIPT_MISSING_EXIT}; touch {path}; "
+                       f"exec python3 {path} {config.PROCESS_AGENT_INTERVAL} "
+                       f"{config.PROCESS_AGENT_HOST_INTERVAL}")
+            # Канал агента занимает сессию sshd всё время работы — учитываем его в лимитах
+            async with self.limits.channel(key):
+                async with conn.create_process(command, encoding=None) as process:
                     try:
-                        process_info = {
-                            'user': parts[0],
-                            'pid': int(parts[1]),
-                            'cpu': parts[2],
-                            'mem': parts[3],
-                            'vsz': parts[4],
-                            'rss': parts[5],
-                            'tty': parts[6],
-                            'stat': parts[7],
-                            'start': parts[8],
-                            'time': parts[9],
-                            'command': ' '.join(parts[10:]),
-                            'machine_host': host
-                        }
-                        processes.append(process_info)
-                    except (ValueError, IndexError):
-                        continue
-            return processes
+                        while not stream.idle():
+                            header = await asyncio.wait_for(
+                                process.stdout.readexactly(AGENT_FRAME_HEADER.size), timeout=stale)
+                            (size,) = AGENT_FRAME_HEADER.unpack(header)
+                            body = await process.stdout.readexactly(size)
+                            # Начальный снимок большого хоста — сотни килобайт JSON
+                            stream.apply(await offloader.run(json.loads, body, size=size), size)
+                        logger.info(f"Process agent on {key} stopped: process list is not read")
+                        return
+                    except asyncio.IncompleteReadError:
+                        result = await process.wait(timeout=5)
+            if result.exit_status is None:
+                # Подключение оборвалось — агент перезапустится при следующем опросе
+                stream.error = "connection closed"
+                return
+            if result.exit_status == SCRIPT_MISSING_EXIT:
+                # Кэш на хосте почистили — агент загрузится при следующем запуске
+                self.script_cache.get(key, set()).discard(digest)
+            stderr = (result.stderr or b"").decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"Process agent exited ({result.exit_status}): {stderr[-500:]}")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error getting processes from {host}: {e}")
-            return []
+            stream.error = str(e) or type(e).__name__
+            stream.retry_at = time.monotonic() + config.PROCESS_AGENT_RETRY
+            logger.warning(f"Process agent on {key} failed, polling with ps: {stream.error}")
+        finally:
+            stream.ready = False
+
+    def _stop_streams(self, key: str = None):
+        for stream_key in [key] if key is not None else list(self.streams):
+            stream = self.streams.pop(stream_key, None)
+            if stream is not None and stream.task is not None:
+                stream.task.cancel()
+
+    async def process_agent_stats(self) -> Dict:
+        """Состояние агентов событий процессов (там, где живут подключения)."""
+        if self.sidecar is not None and self.sidecar.connected:
+            return await self.sidecar.call("process_agent_stats", {})
+        return {"enabled": bool(config.PROCESS_AGENT),
+                "hosts": {key: stream.stats() for key, stream in self.streams.items()}}
+
+    @routed
+    async def relay_run(self, host: str, port: int, username: str, password: str,
+                        targets: List[Dict], timeout: float = None) -> Dict[str, Dict]:
+        """Выполняет команды на машинах площадки одним вызовом агента на ретрансляторе.
+
+        host/port/username/password — ретранслятор; targets — [{"host", "port", "username",
+        "password", "command"}]. Ретранслятор подключается к машинам сам (и держит эти
+        подключения), результат возвращается одним сжатым ответом:
+        {ключ машины: {"exit_status", "stdout", "stderr"} | {"error"}}.
+        Машины с разомкнутым автоматом отключения не опрашиваются.
+        """
+        timeout = timeout or config.RELAY_COMMAND_TIMEOUT
+        results: Dict[str, Dict] = {}
+        request = []
+        for target in targets:
+            key = self._key(target["host"], target["port"], target["username"])
+            try:
+                self.breakers.acquire(key)
+            except CircuitOpenError as e:
+                SSH_BREAKER_REJECTIONS.inc()
+                results[key] = {"error": str(e)}
+                continue
+            request.append({**target, "key": key})
+        if not request:
+            return results
 
-    async def test_connection(self, host: str, port: int, username: str, password: str) -> Tuple[bool, str]:
         try:
-            async with asyncssh.connect(
-                host=host,
-                port=port,
-                username=username,
-                password=password,
-                known_hosts=None,
-                login_timeout=10,
-                connect_timeout=10
-            ) as conn:
+            response = await self._relay_request(host, port, username, password, {
+                "targets": request, "timeout": timeout,
+                "concurrency": config.RELAY_CONCURRENCY, "persist": config.RELAY_PERSIST,
+            }, timeout)
+        except Exception as e:
+            for target in request:
+                self.breakers.release(target["key"])
+                results[target["key"]] = {"error": f"Relay {host}: {str(e) or type(e).__name__}"}
+            return results
+
+        for target in request:
+            key = target["key"]
+            result = response["results"].get(key) or {"error": "No result from relay"}
+            results[key] = result
+            # Исход подключения ретранслятора к машине — такой же сигнал для автомата,
+            # как и собственное подключение
+            if "error" in result:
+                if self.breakers.failure(key, result["error"]):
+                    SSH_BREAKER_TRIPS.inc()
+            else:
+                self.breakers.success(key)
+        return results
+
+    async def _upload_agent(self, key: str, conn: asyncssh.SSHClientConnection,
+                            agent_path: str) -> Tuple[str, str]:
+        """Загружает агент в кэш скриптов хоста (если его там ещё нет): (путь на хосте, sha256)."""
+        source, digest = agent_source(agent_path)
+        path = f'{SCRIPT_CACHE_DIR}/{digest}.py'
+        known = self.script_cache.setdefault(key, set())
+        if digest not in known:
+            upload = f"mkdir -p {SCRIPT_CACHE_DIR} && cat > {path}.$$ && mv -f {path}.$$ {path}"
+            result = await self._run(key, conn, upload, input=source, timeout=60)
+            if result.exit_status != 0:
+                raise RuntimeError(f"Cannot upload {os.path.basename(agent_path)}: {result.stderr.strip()}")
+            known.add(digest)
+        return path, digest
+
+    async def _relay_request(self, host: str, port: int, username: str, password: str,
+                             request: Dict, timeout: float) -> Dict:
+        conn = await self.get_connection(host, port, username, password)
+        if not conn:
+            raise ConnectionError("Failed to establish connection")
+        key = self._key(host, port, username)
+        path, digest = await self._upload_agent(key, conn, RELAY_AGENT_PATH)
+        known = self.script_cache[key]
+
+        # Пароли машин идут через stdin, а не в командной строке (её видно в ps)
+        payload = json.dumps(request).encode()
+        result = await self._run(key, conn, f"[ -f {path} ] || exit {SCRIPT_MISSING_EXIT}; "
+                                            f"touch {path}; python3 {path}",
+                                 operation="relay", input=payload, encoding=None,
+                                 timeout=timeout + 30)
+        if result.exit_status == SCRIPT_MISSING_EXIT:
+            # Кэш на ретрансляторе почистили — загрузим агент при следующем вызове
+            known.discard(digest)
+            raise RuntimeError("Relay agent is missing, it will be uploaded again")
+        if result.exit_status != 0:
+            stderr = result.stderr.decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"Relay agent failed ({result.exit_status}): {stderr}")
+        return await offloader.run(parse_relay_output, result.stdout, size=len(result.stdout) * 8)
+
+    @routed
+    async def relay_poll(self, host: str, port: int, username: str, password: str,
+                         targets: List[Dict], process_filter: str = None) -> Dict[str, Dict]:
+        """poll_machine для машин площадки через ретранслятор: {ключ машины: результат опроса}."""
+        command = poll_command(process_filter)
+        results = await self.relay_run.__wrapped__(
+            self, host, port, username, password,
+            [{**target, "command": command} for target in targets])
+        polls = {}
+        for key, result in results.items():
+            if "error" in result:
+                logger.error(f"Error getting processes from {key} via relay {host}: {result['error']}")
+                polls[key] = {"processes": parse_ps_aux(""), "host": {}, "error": result["error"]}
+            else:
+                stdout = result["stdout"]
+                polls[key] = await offloader.run(parse_poll_output, stdout, size=len(stdout))
+        return polls
+
+    @routed
+    async def test_connection(self, host: str, port: int, username: str, password: str,
+                              force: bool = False) -> Tuple[bool, str]:
+        """Проверка подключения отдельным соединением.
+
+        force — явная проверка одной машины: подключаемся и при разомкнутом автомате.
+        """
+        try:
+            key = self._key(host, port, username)
+            async with await self._connect(key, host, port, username, password, force) as conn:
+                started = time.perf_counter()
                 result = await conn.run("echo 'SSH connection successful'", timeout=5)
+                SSH_COMMAND_SECONDS.labels(key, "test").observe(time.perf_counter() - started)
                 if result.exit_status == 0:
                     return True, "Connection successful"
                 else:
                     return False, f"Command failed: {result.stderr.strip()}"
+        except CircuitOpenError as e:
+            return False, str(e)
         except asyncio.TimeoutError:
             return False, "Connection timeout"
         except asyncssh.PermissionDenied:
@@ -115,6 +731,53 @@ class SSHManager:
         except Exception as e:
             return False, f"Connection error: {str(e)}"
 
+    @routed
+    async def calibrate_transport(self, host: str, port: int, username: str, password: str,
+                                  profiles: Dict[str, Dict] = None, sample_bytes: int = None,
+                                  rounds: int = None) -> Dict:
+        """Замер профилей транспорта на хосте (по умолчанию встроенные transport.PROFILES).
+
+        Для каждого профиля — отдельное подключение: время рукопожатия, задержка пустой
+        команды и время передачи sample_bytes байт выборки transport.sample_command (медианы
+        по rounds повторам). Возвращает {"results": [...], "best": имя профиля с наименьшим
+        score или None}. Неудачные профили (хост не поддерживает алгоритм) попадают в
+        results с error; автомат отключения хоста они не трогают.
+        """
+        key = self._key(host, port, username)
+        profiles = profiles if profiles is not None else PROFILES
+        sample_bytes = sample_bytes or config.TRANSPORT_CALIBRATION_BYTES
+        rounds = max(1, rounds or config.TRANSPORT_CALIBRATION_ROUNDS)
+        command = sample_command(sample_bytes)
+        results = []
+        for name, profile in profiles.items():
+            try:
+                await self.limits.throttle_connect(key)
+                started = time.perf_counter()
+                async with await self._handshake(key, host, port, username, password, profile) as conn:
+                    connect_seconds = time.perf_counter() - started
+                    latencies, transfers = [], []
+                    for _ in range(rounds):
+                        started = time.perf_counter()
+                        await self._run(key, conn, "true", operation="calibrate", timeout=10)
+                        latencies.append(time.perf_counter() - started)
+                    for _ in range(rounds):
+                        started = time.perf_counter()
+                        result = await self._run(key, conn, command, operation="calibrate",
+                                                 timeout=120, encoding=None)
+                        transfers.append(time.perf_counter() - started)
+                        if len(result.stdout) < sample_bytes:
+                            raise RuntimeError(f"Sample truncated: {len(result.stdout)} of {sample_bytes} bytes")
+                    results.append(summarize(name, profile, connect_seconds, latencies, transfers,
+                                             sample_bytes, conn))
+            except Exception as e:
+                logger.warning(f"Transport profile {name} failed on {host}:{port}: {e}")
+                results.append({"name": name, "profile": profile, "error": str(e) or type(e).__name__})
+        measured = [r for r in results if "error" not in r]
+        best = min(measured, key=lambda r: r["score"])["name"] if measured else None
+        logger.info(f"Transport calibration for {host}:{port}: best profile {best}")
+        return {"results": results, "best": best, "sample_bytes": sample_bytes, "rounds": rounds}
+
+    @routed
     async def execute_command(self, host: str, port: int, username: str,
                               password: str,
                               command: str) -> Tuple[bool, str, str]:
@@ -123,30 +786,124 @@ class SSHManager:
             if not conn:
                 return False, "", "Failed to establish connection"
 
-            result = await conn.run(command, timeout=30)
+            result = await self._run(self._key(host, port, username), conn, command, timeout=30)
             return result.exit_status == 0, result.stdout, result.stderr
         except asyncio.TimeoutError:
             return False, "", "Command execution timeout"
         except Exception as e:
             return False, "", f"Error: {str(e)}"
 
-    async def execute_script(self, host: str, port: int, username: str, password: str, script_content: str) -> Tuple[bool, str, str]:
+    @routed
+    async def execute_script(self, host: str, port: int, username: str, password: str,
+                             script_content: str, args: List[str] = None,
+                             log_path: str = None, params: List[Dict] = None) -> Tuple[bool, str, str]:
+        """Запускает скрипт в фоне. script_content — шаблон, params ([{"name", "value"}])
+        подставляются в него текстом (substitute_script_params) здесь, при запуске.
+
+        Готовый скрипт хранится на хосте в кэше по sha256: первый запуск с этими
+        значениями передаёт его через stdin, последующие — только путь и аргументы.
+        Вывод пишется в log_path (по умолчанию ~/script_debug.log).
+        """
         conn = await self.get_connection(host, port, username, password)
         if not conn:
             return False, "", "Failed to establish connection"
 
-        import shlex
-        
-        safe_content = shlex.quote(script_content)
-        command = f"nohup /bin/bash -c {safe_content} > ~/script_debug.log 2>&1 &"
+        key = self._key(host, port, username)
+        if params:
+            script_content = substitute_script_params(script_content, params)
+        digest = hashlib.sha256(script_content.encode()).hexdigest()
+        path = f'{SCRIPT_CACHE_DIR}/{digest}.sh'
+        log = RemotePath(log_path or "~/script_debug.log")
+        # setsid делает скрипт лидером своей группы, чтобы остановка задевала и дочерние процессы.
+        # Обёртка печатает PID и время старта (см. parse_launch_output)
+        run = (f"mkdir -p {log.shell_dir}; s=; command -v setsid >/dev/null 2>&1 && s=setsid; "
+               f"nohup $s /bin/bash {path} {' '.join(shlex.quote(str(a)) for a in args or [])} > {log.shell} 2>&1 & "
+               f"p=$!; echo \"$p {_ps_start('$p')}\"")
         try:
-            result = await conn.run(command, timeout=300)
+            known = self.script_cache.setdefault(key, set())
+            if digest in known:
+                # touch обновляет mtime — по нему сборщик мусора считает возраст
+                result = await self._run(key, conn, f"[ -f {path} ] || exit {SCRIPT_MISSING_EXIT}; touch {path}; {run}", timeout=300)
+                if result.exit_status != SCRIPT_MISSING_EXIT:
+                    return result.exit_status == 0, result.stdout, result.stderr
+                known.discard(digest)
+
+            # Запуск отдельной командой: "&" в конце списка "&&" увёл бы в фон и cat
+            upload = f"mkdir -p {SCRIPT_CACHE_DIR} && cat > {path}.$$ && mv -f {path}.$$ {path} || exit 1; {run}"
+            result = await self._run(key, conn, upload, input=script_content, timeout=300)
+            if result.exit_status == 0:
+                known.add(digest)
             return result.exit_status == 0, result.stdout, result.stderr
         except asyncio.TimeoutError:
             return False, "", "Script execution timeout"
         except Exception as e:
             return False, "", f"Error: {str(e)}"
 
+    @routed
+    async def gc_script_cache(self, host: str, port: int, username: str, password: str,
+                              max_age_days: int) -> Tuple[bool, int]:
+        """Удаляет из кэша скриптов хоста файлы, не запускавшиеся max_age_days дней,
+        и логи запусков того же возраста."""
+        conn = await self.get_connection(host, port, username, password)
+        if not conn:
+            return False, 0
+        key = self._key(host, port, username)
+        log_dir = RemotePath(RUN_LOG_DIR + "/x").shell_dir
+        command = (f"for d in {SCRIPT_CACHE_DIR} {log_dir}; do [ -d \"$d\" ] && "
+                   f"find \"$d\" \\( -name '*.sh*' -o -name '*.py*' -o -name '*.log' \\) -mtime +{int(max_age_days)} -print -delete; "
+                   f"done; true")
+        try:
+            result = await self._run(key, conn, command, timeout=60)
+            removed = [line.rsplit('/', 1)[-1] for line in result.stdout.split('\n') if line.strip()]
+            known = self.script_cache.get(key, set())
+            for name in removed:
+                known.discard(name.split('.', 1)[0])
+            return result.exit_status == 0, len(removed)
+        except Exception as e:
+            logger.error(f"Script cache GC failed on {host}: {e}")
+            return False, 0
+
+    @routed
+    async def read_log(self, host: str, port: int, username: str, password: str,
+                       log_path: str, offset: int = 0, length: int = 65536) -> Optional[Dict]:
+        """Читает length байт лога начиная с offset (отрицательный offset — от конца файла).
+
+        Хост сжимает фрагмент gzip, если он доступен. Возвращает None, если файла нет.
+        """
+        conn = await self.get_connection(host, port, username, password)
+        if not conn:
+            raise ConnectionError("Failed to establish connection")
+        path = RemotePath(log_path).shell
+        length = max(int(length), 0)
+        # Первая строка вывода: "<размер> <начало фрагмента> <gz|raw>", дальше сам фрагмент
+        command = (
+            f"f={path}; [ -f \"$f\" ] || exit {LOG_MISSING_EXIT}; "
+            f"size=$(stat -c %s \"$f\" 2>/dev/null || wc -c < \"$f\"); off={int(offset)}; "
+            f"[ $off -lt 0 ] && off=$((size + off)); [ $off -lt 0 ] && off=0; "
+            f"if command -v gzip >/dev/null 2>&1; then echo $size $off gz; "
+            f"tail -c +$((off + 1)) \"$f\" | head -c {length} | gzip -1 -c; "
+            f"else echo $size $off raw; tail -c +$((off + 1)) \"$f\" | head -c {length}; fi"
+        )
+        result = await self._run(self._key(host, port, username), conn, command,
+                                 timeout=30, encoding=None)
+        if result.exit_status == LOG_MISSING_EXIT:
+            return None
+        if result.exit_status != 0:
+            raise RuntimeError(result.stderr.decode(errors="replace").strip() or "Failed to read log")
+        header, _, body = result.stdout.partition(b"\n")
+        size, start, mode = header.decode().split()
+        raw_size = len(body)
+        if mode == "gz":
+            body = gzip.decompress(body) if body else b""
+        return {
+            "size": int(size),
+            "offset": int(start),
+            "next_offset": int(start) + len(body),
+            "data": body.decode(errors="replace"),
+            "transferred_bytes": raw_size,
+        }
+
+    @routed
     async def get_processes(self, host: str, port: int, username: str,
                             password: str) -> List[Dict]:
         try:
@@ -155,9 +912,10 @@ class SSHManager:
                 return []
 
             # Получаем процессы текущего пользователя
-            result = await conn.run(
+            result = await self._run(
+                self._key(host, port, username), conn,
                 "ps aux | grep -E '^'$USER'|^'$(whoami) | grep -v grep",
-                timeout=10)
+                operation="list", timeout=10)
 
             processes = []
             if result.exit_status == 0:
@@ -180,18 +938,88 @@ class SSHManager:
             print(f"Error getting processes from {host}: {e}")
             return []
 
+    @routed
     async def kill_process(self, host: str, port: int, username: str, password: str, pid: int) -> Tuple[bool, str]:
         conn = await self.get_connection(host, port, username, password)
         if not conn:
             return False, "Failed to establish connection"
         try:
-            result = await conn.run(f"kill -9 {pid}", timeout=10)
+            result = await self._run(self._key(host, port, username), conn, f"kill -9 {pid}",
+                                     operation="kill", timeout=10)
             return result.exit_status == 0, result.stderr
         except Exception as e:
             return False, str(e)
 
+    @routed
+    async def get_pids_status(self, host: str, port: int, username: str, password: str,
+                              pids: List[int]) -> List[Dict]:
+        """Состояние нескольких PID за один запрос: [{"pid", "start"}], start=None — процесса нет.
+
+        Если команда не отработала (ошибка оболочки, нет ps, оборванный вывод) —
+        RuntimeError: пустой ответ нельзя принимать за «все процессы завершились».
+        """
+        if not pids:
+            return []
+        conn = await self.get_connection(host, port, username, password)
+        if not conn:
+            raise ConnectionError("Failed to establish connection")
+        pid_list = ' '.join(str(int(pid)) for pid in pids)
+        command = (f"command -v ps >/dev/null 2>&1 || exit 127; "
+                   f"for p in {pid_list}; do echo \"$p {_ps_start('$p')}\"; done")
+        result = await self._run(self._key(host, port, username), conn, command,
+                                 operation="status", timeout=15)
+        if result.exit_status != 0:
+            raise RuntimeError(f"PID status check failed ({result.exit_status}): {(result.stderr or '').strip()}")
+        statuses = []
+        for line in result.stdout.strip().split('\n'):
+            pid, start = parse_launch_output(line)
+            if pid is not None:
+                statuses.append({"pid": pid, "start": start})
+        missing = {int(pid) for pid in pids} - {item["pid"] for item in statuses}
+        if missing:
+            raise RuntimeError(f"PID status check returned no line for {len(missing)} of {len(pids)} PIDs")
+        return statuses
+
+    @routed
+    async def signal_pids(self, host: str, port: int, username: str, password: str,
+                          targets: List[Dict], signal: str = "TERM") -> List[Dict]:
+        """Посылает сигнал нескольким процессам за один запрос.
+
+        targets: [{"pid", "start"}]. Если start задан и не совпадает с текущим временем старта,
+        PID уже занят другим процессом — он не трогается. Сигнал уходит всей группе процесса.
+        Результат: [{"pid", "status"}], status: killed, gone, reused, failed.
+        """
+        if not targets:
+            return []
+        if not re.fullmatch(r"[A-Z0-9]+", str(signal)):
+            raise ValueError(f"Invalid signal: {signal}")
+        conn = await self.get_connection(host, port, username, password)
+        if not conn:
+            raise ConnectionError("Failed to establish connection")
+        checks = []
+        for target in targets:
+            pid = int(target["pid"])
+            expected = shlex.quote(target.get("start") or "")
+            checks.append(
+                f"c=$(echo {_ps_start(pid)}); "
+                f"if [ -z \"$c\" ]; then echo {pid} gone; "
+                f"elif [ -n {expected} ] && [ \"$c\" != {expected} ]; then echo {pid} reused; "
+                f"elif kill -s {signal} -- -{pid} 2>/dev/null || kill -s {signal} {pid}; then echo {pid} killed; "
+                f"else echo {pid} failed; fi"
+            )
+        result = await self._run(self._key(host, port, username), conn, '; '.join(checks),
+                                 operation="kill", timeout=15)
+        statuses = []
+        for line in result.stdout.strip().split('\n'):
+            parts = line.split()
+            if len(parts) == 2 and parts[0].isdigit():
+                statuses.append({"pid": int(parts[0]), "status": parts[1]})
+        return statuses
+
+    @routed
     async def remove_connection(self, host: str, port: int, username: str):
-        key = f"{host}:{port}:{username}"
+        key = self._key(host, port, username)
+        self._stop_streams(key)
         async with self.lock:
             conn = self.connections.pop(key, None)
             if conn:
@@ -203,6 +1031,7 @@ class SSHManager:
                     pass
 
     async def close_all(self):
+        self._stop_streams()
         async with self.lock:
             for conn in self.connections.values():
                 try:
@@ -19,8 +19,14 @@ async function loadMachines() {
     const container = document.getElementById('machines-container');
 
     try {
-        const response = await fetch('/api/machines');
+        const [response, metricsResponse, readinessResponse] = await Promise.all([
+            fetch('/api/machines'),
+            fetch('/api/metrics/hosts'),
+            fetch('/api/machines/readiness')
+        ]);
         const machines = await response.json();
+        const hostMetrics = metricsResponse.ok ? await metricsResponse.json() : {};
+        const readiness = readinessResponse.ok ? await readinessResponse.json() : {};
 
         container.innerHTML = '';
 
@@ -36,6 +42,10 @@ async function loadMachines() {
             const statusClass = machine.is_active ? 'status-online' : 'status-offline';
             const statusText = machine.is_active ? 'Онлайн' : 'Оффлайн';
             const currentBadge = machine.is_current ? '<span class="status-current">Текущая</span>' : '';
+            const readinessBadge = formatReadiness(readiness[machine.id]);
+            const metrics = hostMetrics[machine.id];
+            const metricsLine = metrics ? `
+                    <div><i class="fas fa-chart-line"></i> ${formatHostMetrics(metrics)}</div>` : '';
 
             card.innerHTML = `
                 <div class="machine-header">
@@ -44,13 +54,14 @@ async function loadMachines() {
                     </div>
                     <div>
                         ${currentBadge}
+                        ${readinessBadge}
                         <span class="machine-status ${statusClass}">${statusText}</span>
                     </div>
                 </div>
                 <div class="machine-info">
                     <div><i class="fas fa-network-wired"></i> ${machine.address}:${machine.ssh_port}</div>
                     <div><i class="fas fa-user"></i> ${machine.username}</div>
-                    <div><i class="fas fa-clock"></i> Последняя проверка: ${new Date(machine.last_checked).toLocaleString()}</div>
+                    <div><i class="fas fa-clock"></i> Последняя проверка: ${new Date(machine.last_checked).toLocaleString()}</div>${metricsLine}
                 </div>
                 <div class="machine-actions">
                     <button class="btn btn-sm" onclick="viewMachineProcesses(${machine.id})">
@@ -76,6 +87,44 @@ async function loadMachines() {
     }
 }
 
+// Экранирует текст для вставки в HTML (в том числе в значения атрибутов)
+function escapeHtml(text) {
+    return String(text)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#039;');
+}
+
+// Готовность SSH-подключения: hot — подключение уже открыто, опрос не ждёт рукопожатия;
+// open — автомат отключения разомкнут, подключения к хосту сразу отклоняются
+function formatReadiness(readiness) {
+    if (!readiness) return '';
+    const titles = {
+        hot: 'Подключение открыто',
+        connecting: 'Подключение...',
+        backoff: `Повторное подключение${readiness.error ? ': ' + readiness.error : ''}`,
+        open: `Хост недоступен, следующая проверка через ${Math.ceil(readiness.retry_in || 0)} с` +
+              `${readiness.last_error ? ': ' + readiness.last_error : ''}`
+    };
+    const icons = {
+        hot: 'fa-bolt', connecting: 'fa-spinner fa-spin', backoff: 'fa-hourglass-half',
+        open: 'fa-power-off'
+    };
+    if (!icons[readiness.state]) return '';
+    return `<i class="fas ${icons[readiness.state]} readiness-${readiness.state}" title="${escapeHtml(titles[readiness.state])}"></i>`;
+}
+
+function formatHostMetrics(metrics) {
+    const parts = [];
+    if (metrics.cpu_pct !== undefined) parts.push(`CPU ${metrics.cpu_pct.toFixed(0)}%`);
+    if (metrics.load1 !== undefined) parts.push(`LA ${metrics.load1.toFixed(2)}`);
+    if (metrics.mem_used_pct !== undefined) parts.push(`RAM ${metrics.mem_used_pct.toFixed(0)}%`);
+    if (metrics.disk_used_pct !== undefined) parts.push(`Диск ${metrics.disk_used_pct.toFixed(0)}%`);
+    return parts.join(' · ') || 'Нет данных';
+}
+
 async function testAllMachines() {
     try {
         showToast('Проверка всех машин...', 'info');
@@ -385,6 +434,17 @@ async function addCurrentMachine() {
 // WebSocket соединение для обновлений
 let ws = null;
 
+// Темы обновлений, нужные текущей странице (сервер шлёт только их)
+function wsTopicsForPage() {
+    const path = window.location.pathname;
+    if (path === '/' || path.includes('/machines')) return ['machines'];
+    if (path.includes('/processes')) return ['processes', 'machines'];
+    if (path.includes('/scripts')) return ['scripts', 'parameters', 'machines'];
+    if (path.includes('/profiles')) return ['profiles', 'scripts', 'parameters', 'machines'];
+    if (path.includes('/users')) return ['users'];
+    return ['*'];
+}
+
 function connectWebSocket() {
     if (ws && ws.readyState === WebSocket.OPEN) return;
 
@@ -392,6 +452,7 @@ function connectWebSocket() {
 
     ws.onopen = () => {
         console.log('WebSocket connected');
+        ws.send(JSON.stringify({ type: 'subscribe', topics: wsTopicsForPage() }));
     };
 
     ws.onclose = () => {
@@ -408,7 +469,7 @@ function connectWebSocket() {
         if (data.type === 'update') {
             showToast('Данные обновлены', 'info');
             // Обновляем данные на странице
-            if (window.location.pathname.includes('/machines')) {
+            if (data.entity === 'machines' && window.location.pathname.includes('/machines')) {
                 loadMachines();
             }
             // Если обновились параметры, перезагрузим их (если функция доступна)
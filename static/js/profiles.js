@@ -69,7 +69,8 @@ async function executeProfile(profileId) {
             method: 'POST'
         });
         if (res.ok) {
-            showToast('Профиль запущен', 'success');
+            const data = await res.json();
+            showToast(`Профиль поставлен в очередь (задание #${data.job_id})`, 'success');
         } else {
             const err = await res.json();
             showToast(`Ошибка: ${err.detail}`, 'error');
@@ -168,7 +168,8 @@ async function executeScript() {
         });
 
         if (res.ok) {
-            showToast('Сценарий запущен', 'success');
+            const data = await res.json();
+            showToast(`Сценарий поставлен в очередь (задание #${data.job_id})`, 'success');
             closeRunScriptModal();
         } else {
             const err = await res.json();
@@ -0,0 +1,213 @@
+import abc
+import bisect
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric(abc.ABC):
+    """Метрика с метками. Дочерние значения кэшируются по кортежу меток:
+    на горячем пути — один поиск в словаре, без создания словарей меток.
+
+    Обновления идут из одного потока event loop, поэтому замки не нужны.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Новое дочернее значение для набора меток."""
+
+    def labels(self, *values: str):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """Строки метрики в текстовом формате Prometheus."""
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+                for values, child in self.children.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """Gauge, значение которого вычисляется при каждом снятии метрик."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def _new_child(self):
+        raise TypeError(f"{self.name} has no labels: its value comes from func")
+
+    def render(self) -> List[str]:
+        return [f"{self.name} {float(self.func())}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_func(self, name: str, documentation: str, func: Callable[[], float]) -> GaugeFunc:
+        return self.register(GaugeFunc(name, documentation, func))
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # Ошибка одной метрики не должна ломать весь ответ
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+SSH_POOL_HITS = registry.counter(
+    "sshm_ssh_pool_hits_total", "SSH connections reused from the pool")
+SSH_POOL_MISSES = registry.counter(
+    "sshm_ssh_pool_misses_total", "SSH connections that had to be (re)established")
+SSH_CONNECT_FAILURES = registry.counter(
+    "sshm_ssh_connect_failures_total", "Failed SSH connection attempts")
+SSH_BREAKER_REJECTIONS = registry.counter(
+    "sshm_ssh_breaker_rejections_total", "SSH connection attempts rejected by an open circuit breaker")
+SSH_BREAKER_TRIPS = registry.counter(
+    "sshm_ssh_breaker_trips_total", "Circuit breakers opened after repeated connection failures")
+SSH_HANDSHAKE_SECONDS = registry.histogram(
+    "sshm_ssh_handshake_seconds", "SSH connect and authentication time", ["machine"])
+SSH_COMMAND_SECONDS = registry.histogram(
+    "sshm_ssh_command_seconds", "Remote command time including channel setup",
+    ["machine", "operation"])
+LIVE_FANOUT_SECONDS = registry.histogram(
+    "sshm_live_processes_fanout_seconds", "Time to poll all machines for /api/processes/live")
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "sshm_http_request_seconds", "HTTP request latency by route", ["method", "route"])
+
+
+class HTTPMetricsMiddleware:
+    """ASGI-middleware: время ответа по шаблону маршрута (а не по конкретному URL)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route.path if route is not None else "other"
+            ).observe(time.perf_counter() - started)
@@ -0,0 +1,14 @@
+from job_queue import is_transient_error
+
+
+def test_connection_failures_are_retried():
+    assert is_transient_error("Failed to establish connection")
+    assert is_transient_error("Error: [Errno 111] Connection refused")
+
+
+def test_failures_after_launch_are_not_retried():
+    # Команда могла уже выполниться на хосте — повтор запустил бы скрипт дважды
+    assert not is_transient_error("Script execution timeout")
+    assert not is_transient_error("Error: Connection lost")
+    assert not is_transient_error("Worker host:1 did not answer 'execute_script'")
+    assert not is_transient_error(None)
@@ -0,0 +1,44 @@
+import asyncio
+import types
+
+import pytest
+
+from ssh_manager import SSHManager
+
+
+class FakeConnection:
+    def __init__(self, exit_status: int, stdout: str, stderr: str = ""):
+        self.result = types.SimpleNamespace(exit_status=exit_status, stdout=stdout, stderr=stderr)
+
+    async def run(self, command, **kwargs):
+        return self.result
+
+
+def pids_status(conn: FakeConnection, pids):
+    manager = SSHManager()
+
+    async def get_connection(*args):
+        return conn
+
+    manager.get_connection = get_connection
+    return asyncio.run(manager.get_pids_status("h", 22, "u", "p", pids))
+
+
+def test_running_and_missing_pids():
+    conn = FakeConnection(0, "10 Mon Jan  1 10:00:00 2024\n11 \n")
+    assert pids_status(conn, [10, 11]) == [
+        {"pid": 10, "start": "Mon Jan 1 10:00:00 2024"},
+        {"pid": 11, "start": None},
+    ]
+
+
+@pytest.mark.parametrize("conn", [
+    FakeConnection(1, "", "bash: quota exceeded"),
+    FakeConnection(127, ""),
+    # Канал оборвался: вывода нет, хотя оболочка «успешна»
+    FakeConnection(0, ""),
+    FakeConnection(0, "10 Mon Jan  1 10:00:00 2024\n"),
+])
+def test_failed_check_raises_instead_of_reporting_exits(conn):
+    with pytest.raises(RuntimeError):
+        pids_status(conn, [10, 11])
@@ -0,0 +1,36 @@
+import subprocess
+
+from ssh_manager import substitute_script_params
+
+
+def run_bash(script: str) -> str:
+    return subprocess.run(["bash", "-c", script], capture_output=True, text=True, check=True).stdout
+
+
+def test_params_are_substituted_as_single_words():
+    script = 'for a in $NAME; do echo "[$a]"; done\necho ${NAME}\n'
+    rendered = substitute_script_params(script, [{"name": "NAME", "value": "a b*"}])
+    assert run_bash(rendered) == "[a b*]\na b*\n"
+
+
+def test_quotes_and_command_substitution_stay_literal():
+    rendered = substitute_script_params("echo $V", [{"name": "V", "value": "it's $(id)"}])
+    assert run_bash(rendered) == "it's $(id)\n"
+
+
+def test_reserved_names_do_not_reach_the_environment():
+    # PATH/IFS — такие же параметры, как остальные: меняется только текст скрипта
+    script = "echo $PATH; command -v bash >/dev/null && echo ok"
+    rendered = substitute_script_params(script, [{"name": "PATH", "value": "/nowhere"}])
+    assert run_bash(rendered) == "/nowhere\nok\n"
+
+
+def test_default_assignment_in_script_does_not_override_value():
+    script = "NAME=default\necho $NAME\n"
+    rendered = substitute_script_params(script, [{"name": "NAME", "value": "given"}])
+    assert run_bash(rendered).splitlines()[-1] == "given"
+
+
+def test_longer_names_are_left_alone():
+    rendered = substitute_script_params("echo $NAME $NAMES ${NAME}", [{"name": "NAME", "value": "x"}])
+    assert rendered == "echo 'x' $NAMES 'x'"
@@ -0,0 +1,62 @@
+import asyncio
+
+from ssh_limits import SSHLimits
+
+
+def make_limits(**overrides) -> SSHLimits:
+    options = dict(default_sessions=1, default_rate=1000.0, default_burst=1000,
+                   global_sessions=2, wait_timeout=1.0)
+    options.update(overrides)
+    return SSHLimits(**options)
+
+
+def test_saturated_host_does_not_hold_global_slots():
+    async def scenario():
+        limits = make_limits()
+        busy = limits.channel("slow:22:u")
+        await busy.__aenter__()
+        # Очередь к занятому хосту — больше, чем общих слотов
+        waiters = [asyncio.create_task(limits.channel("slow:22:u").__aenter__()) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        for key in ("fast:22:u", "other:22:u"):
+            async with limits.channel(key):
+                assert limits.global_semaphore._value == 0
+        await busy.__aexit__(None, None, None)
+        for waiter in waiters:
+            slot = await waiter
+            await slot.__aexit__(None, None, None)
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+
+def test_rate_limited_host_does_not_hold_global_slots():
+    async def scenario():
+        limits = make_limits(default_sessions=10, global_sessions=1)
+        limits.configure("slow:22:u", rate=0.5, burst=1)
+        async with limits.channel("slow:22:u"):
+            pass
+        # Следующий токен хоста — через 2 с; ожидание не должно занимать общий слот
+        waiter = asyncio.create_task(limits.channel("slow:22:u").__aenter__())
+        await asyncio.sleep(0.05)
+        async with limits.channel("fast:22:u"):
+            pass
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert limits.global_semaphore._value == 1
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+
+def test_release_returns_all_slots():
+    async def scenario():
+        limits = make_limits(default_sessions=2)
+        async with limits.channel("a:22:u"):
+            assert limits.global_semaphore._value == 1
+            assert limits.get("a:22:u").semaphore._value == 1
+        assert limits.global_semaphore._value == 2
+        assert limits.get("a:22:u").semaphore._value == 2
+
+    asyncio.run(scenario())
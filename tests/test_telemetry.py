@@ -0,0 +1,21 @@
+import pytest
+
+from telemetry import Registry
+
+
+def test_registry_renders_all_metric_types():
+    registry = Registry()
+    registry.counter("requests_total", "Requests", ["route"]).labels("/a").inc()
+    registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)).labels().observe(0.5)
+    registry.gauge_func("connections_open", "Open connections", lambda: 3)
+
+    text = registry.render()
+    assert 'requests_total{route="/a"} 1.0' in text
+    assert 'latency_seconds_bucket{le="1.0"} 1' in text
+    assert "connections_open 3.0" in text
+
+
+def test_gauge_func_has_no_labels():
+    gauge = Registry().gauge_func("connections_open", "Open connections", lambda: 3)
+    with pytest.raises(TypeError):
+        gauge.labels("x")
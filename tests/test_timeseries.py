@@ -0,0 +1,62 @@
+import process_agent
+from ssh_manager import PROCESS_FIELDS, parse_poll_output, poll_command, SECTION_MARKER
+from timeseries import ProcessMetrics
+
+LSTART = "Mon Jan 1 23:50:00 2024"
+
+
+def columns(start, started=LSTART, pid=4242, cpu="1.0"):
+    row = ["app", pid, cpu, "0.5", "1000", "200", "?", "S", start, "0:01", "python worker.py"]
+    result = {field: [value] for field, value in zip(PROCESS_FIELDS, row)}
+    if started is not None:
+        result["started"] = [started]
+    return result
+
+
+def test_series_survives_start_format_change():
+    metrics = ProcessMetrics(series_ttl=3600, max_series=100)
+    # START меняется с HH:MM на MonDD, когда процессу исполняются сутки
+    metrics.record(1, columns("23:50", cpu="1.0"), complete=True, ts=1000.0)
+    metrics.record(1, columns("Jan01", cpu="2.0"), complete=True, ts=1000.0 + 24 * 3600)
+
+    series = metrics.get_series(1, 4242)
+    assert len(series) == 1
+    assert series[0]["start"] == LSTART
+    assert series[0]["fine"]["cpu"] == [1.0, 2.0]
+
+
+def test_reused_pid_starts_new_series():
+    metrics = ProcessMetrics(series_ttl=3600, max_series=100)
+    metrics.record(1, columns("23:50"), complete=True, ts=1000.0)
+    metrics.record(1, columns("10:00", started="Tue Jan 2 10:00:00 2024"), complete=True, ts=2000.0)
+
+    series = metrics.get_series(1, 4242)
+    assert [s["start"] for s in series] == ["Tue Jan 2 10:00:00 2024"]
+    assert len(series[0]["fine"]["cpu"]) == 1
+
+
+def test_start_column_is_fallback_without_lstart():
+    metrics = ProcessMetrics(series_ttl=3600, max_series=100)
+    metrics.record(1, columns("23:50", started=None), ts=1000.0)
+    assert metrics.get_series(1, 4242)[0]["start"] == "23:50"
+
+
+def test_poll_output_has_lstart_column():
+    assert SECTION_MARKER + "starts" in poll_command()
+    output = "\n".join([
+        SECTION_MARKER + "ps",
+        "USER PID %CPU %MEM VSZ RSS TTY STAT START TIME COMMAND",
+        "app 4242 1.0 0.5 1000 200 ? S Jan01 0:01 python worker.py",
+        "app 4243 0.0 0.1 1000 100 ? S 10:00 0:00 sleep 1",
+        SECTION_MARKER + "starts",
+        " 4242 Mon Jan  1 23:50:00 2024",
+    ])
+    processes = parse_poll_output(output)["processes"]
+    assert processes["started"] == [LSTART, None]
+
+
+def test_agent_lstart_matches_ps_format():
+    assert process_agent.lstart_column(0) == process_agent.lstart_column(0.5)
+    weekday, month, day, clock, year = process_agent.lstart_column(0).split(" ")
+    assert len(weekday) == 3 and len(month) == 3 and day.isdigit() and len(year) == 4
+    assert len(clock.split(":")) == 3
@@ -0,0 +1,78 @@
+import asyncio
+import subprocess
+import zlib
+
+import asyncssh
+
+from ssh_manager import SSHManager
+from transport import sample_command
+
+SAMPLE_BYTES = 512 * 1024
+# Медленный канал: байт в секунду от хоста к контроллеру
+LINK_RATE = 1024 * 1024
+
+
+def test_sample_compresses_like_process_list():
+    sample = subprocess.run(["sh", "-c", sample_command(SAMPLE_BYTES)], capture_output=True).stdout
+    assert len(sample) == SAMPLE_BYTES
+    ratio = len(sample) / len(zlib.compress(sample, 6))
+    # Случайные байты дали бы ~1, повторённый ps aux — около сотни
+    assert 2 < ratio < 30
+
+
+class Server(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return False
+
+
+async def run_shell(process: asyncssh.SSHServerProcess):
+    result = await asyncio.create_subprocess_shell(
+        process.command or "true", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    stdout, _ = await result.communicate()
+    process.stdout.write(stdout)
+    process.exit(result.returncode)
+
+
+async def throttled_proxy(target_port: int):
+    """TCP-прокси к SSH-серверу; ответы сервера идут не быстрее LINK_RATE."""
+
+    async def pipe(reader, writer, rate=None):
+        try:
+            while data := await reader.read(16 * 1024):
+                writer.write(data)
+                await writer.drain()
+                if rate:
+                    await asyncio.sleep(len(data) / rate)
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", target_port)
+        await asyncio.gather(pipe(client_reader, server_writer),
+                             pipe(server_reader, client_writer, LINK_RATE),
+                             return_exceptions=True)
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def calibrate_on_slow_link():
+    server = await asyncssh.create_server(
+        Server, "127.0.0.1", 0, server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+        process_factory=run_shell, encoding=None)
+    proxy = await throttled_proxy(server.sockets[0].getsockname()[1])
+    try:
+        profiles = {"plain": {"compression": False}, "zlib": {"compression": True}}
+        return await SSHManager().calibrate_transport(
+            "127.0.0.1", proxy.sockets[0].getsockname()[1], "bench", "",
+            profiles=profiles, sample_bytes=SAMPLE_BYTES, rounds=1)
+    finally:
+        proxy.close()
+        server.close()
+
+
+def test_compression_wins_on_slow_link():
+    calibration = asyncio.run(calibrate_on_slow_link())
+    results = {result["name"]: result for result in calibration["results"]}
+    assert all("error" not in result for result in results.values()), results
+    assert results["zlib"]["compression"] != "none"
+    assert calibration["best"] == "zlib"
@@ -0,0 +1,273 @@
+import collections
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+
+
+class RingBuffer:
+    """Кольцевой буфер фиксированной ёмкости на array: память не растёт со временем."""
+
+    def __init__(self, capacity: int, typecode: str = "f"):
+        self.capacity = max(capacity, 1)
+        self.data = array(typecode, [0] * self.capacity)
+        self.start = 0
+        self.size = 0
+
+    def append(self, value: float):
+        end = (self.start + self.size) % self.capacity
+        self.data[end] = value
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def values(self) -> List[float]:
+        """Значения от старых к новым."""
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.data[self.start:end].tolist()
+        return self.data[self.start:].tolist() + self.data[:end - self.capacity].tolist()
+
+    def last(self) -> Optional[float]:
+        if not self.size:
+            return None
+        return self.data[(self.start + self.size - 1) % self.capacity]
+
+    def __len__(self):
+        return self.size
+
+
+class _Tier:
+    """Одно разрешение ряда: метки времени и значения полей в кольцевых буферах."""
+
+    def __init__(self, fields: Tuple[str, ...], capacity: int):
+        self.times = RingBuffer(capacity, "d")
+        self.fields = {name: RingBuffer(capacity, "f") for name in fields}
+
+    def add(self, ts: float, values: Dict[str, float]):
+        self.times.append(ts)
+        for name, buffer in self.fields.items():
+            buffer.append(values.get(name, 0.0))
+
+    def points(self, since: float = None) -> Dict[str, List[float]]:
+        times = self.times.values()
+        first = 0
+        if since is not None:
+            while first < len(times) and times[first] < since:
+                first += 1
+        result = {"t": [round(t, 3) for t in times[first:]]}
+        for name, buffer in self.fields.items():
+            result[name] = [round(v, 3) for v in buffer.values()[first:]]
+        return result
+
+
+class MetricSeries:
+    """Ряд с двумя разрешениями: последние точки как есть и средние по корзинам coarse_step секунд.
+
+    Память ряда фиксирована: fine_points + coarse_points точек на каждое поле.
+    """
+
+    def __init__(self, fields: Iterable[str], fine_points: int = None,
+                 coarse_points: int = None, coarse_step: float = None):
+        self.field_names = tuple(fields)
+        self.coarse_step = coarse_step or config.METRICS_COARSE_STEP
+        self.fine = _Tier(self.field_names, fine_points or config.METRICS_FINE_POINTS)
+        self.coarse = _Tier(self.field_names, coarse_points or config.METRICS_COARSE_POINTS)
+        self._bucket_start: Optional[float] = None
+        self._bucket_sums = dict.fromkeys(self.field_names, 0.0)
+        self._bucket_count = 0
+        self.updated = 0.0
+
+    def add(self, ts: float, values: Dict[str, float]):
+        self.fine.add(ts, values)
+        self.updated = ts
+        bucket = ts - ts % self.coarse_step
+        if self._bucket_start is not None and bucket != self._bucket_start:
+            self._flush_bucket()
+        self._bucket_start = bucket
+        for name in self.field_names:
+            self._bucket_sums[name] += values.get(name, 0.0)
+        self._bucket_count += 1
+
+    def _flush_bucket(self):
+        if self._bucket_count:
+            self.coarse.add(self._bucket_start, {
+                name: total / self._bucket_count for name, total in self._bucket_sums.items()
+            })
+        self._bucket_sums = dict.fromkeys(self.field_names, 0.0)
+        self._bucket_count = 0
+
+    def average(self, field: str, since: float) -> Optional[float]:
+        """Среднее поля с момента since: точные точки, а где их уже нет — корзины."""
+        fine = self.fine.points(since)
+        values = fine[field]
+        if fine["t"] and self.fine.times.size == self.fine.times.capacity:
+            oldest_fine = fine["t"][0]
+            coarse = self.coarse.points(since)
+            values = [v for t, v in zip(coarse["t"], coarse[field]) if t + self.coarse_step <= oldest_fine] + values
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def to_dict(self, since: float = None) -> Dict:
+        return {
+            "fine": self.fine.points(since),
+            "coarse": self.coarse.points(since),
+            "coarse_step": self.coarse_step,
+        }
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ProcessMetrics:
+    """Ряды %CPU/%MEM/RSS процессов по ключу (machine_id, pid, время старта).
+
+    Время старта — столбец started (lstart, не меняется за жизнь процесса); START из ps aux
+    только если started нет: он через сутки меняет формат, и ряд начался бы заново.
+
+    Заполняется из обычного опроса процессов, без дополнительных SSH-запросов.
+    Ряды вышедших процессов удаляются: при полном опросе машины — сразу,
+    иначе — через series_ttl секунд без обновлений. Общее число рядов ограничено.
+    """
+
+    FIELDS = ("cpu", "mem", "rss")
+
+    def __init__(self, series_ttl: float = None, max_series: int = None):
+        self.series_ttl = series_ttl or config.METRICS_SERIES_TTL
+        self.max_series = max_series or config.METRICS_MAX_SERIES
+        self.series: "collections.OrderedDict[Tuple[int, int, str], MetricSeries]" = collections.OrderedDict()
+        self.info: Dict[Tuple[int, int, str], Dict] = {}
+
+    def record(self, machine_id: int, columns: Dict[str, list], complete: bool = False,
+               ts: float = None):
+        """columns — процессы машины по столбцам (ssh_manager.parse_ps_aux).
+        complete=True — это полный список процессов машины (опрос без фильтра)."""
+        ts = ts or time.time()
+        seen = set()
+        started = columns.get("started") or [None] * len(columns["pid"])
+        rows = zip(columns["pid"], started, columns["start"], columns["cpu"], columns["mem"],
+                   columns["rss"], columns["user"], columns["command"])
+        for pid, lstart, start, cpu, mem, rss, user, command in rows:
+            key = (machine_id, pid, lstart or start)
+            seen.add(key)
+            series = self.series.get(key)
+            if series is None:
+                series = MetricSeries(self.FIELDS)
+                self.series[key] = series
+                self.info[key] = {"user": user, "command": command}
+            else:
+                self.series.move_to_end(key)
+            series.add(ts, {"cpu": _to_float(cpu), "mem": _to_float(mem), "rss": _to_float(rss)})
+        if complete:
+            for key in [k for k in self.series if k[0] == machine_id and k not in seen]:
+                self._drop(key)
+        self.evict(ts)
+
+    def _drop(self, key):
+        self.series.pop(key, None)
+        self.info.pop(key, None)
+
+    def evict(self, now: float = None):
+        now = now or time.time()
+        # Самые давно обновлённые ряды — в начале OrderedDict
+        while self.series:
+            key, series = next(iter(self.series.items()))
+            if len(self.series) > self.max_series or series.updated < now - self.series_ttl:
+                self._drop(key)
+            else:
+                break
+
+    def _describe(self, key) -> Dict:
+        machine_id, pid, start = key
+        return {"machine_id": machine_id, "pid": pid, "start": start, **self.info.get(key, {})}
+
+    def get_series(self, machine_id: int = None, pid: int = None, since: float = None) -> List[Dict]:
+        result = []
+        for key, series in self.series.items():
+            if machine_id is not None and key[0] != machine_id:
+                continue
+            if pid is not None and key[1] != pid:
+                continue
+            result.append({**self._describe(key), **series.to_dict(since)})
+        return result
+
+    def top(self, n: int = 10, window: float = 600, field: str = "cpu",
+            machine_id: int = None) -> List[Dict]:
+        """n процессов с наибольшим средним значением поля за последние window секунд."""
+        if field not in self.FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        since = time.time() - window
+        ranked = []
+        for key, series in self.series.items():
+            if machine_id is not None and key[0] != machine_id:
+                continue
+            average = series.average(field, since)
+            if average is not None:
+                ranked.append((average, key))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [{**self._describe(key), "average": round(average, 3), "field": field}
+                for average, key in ranked[:n]]
+
+    def stats(self) -> Dict:
+        return {"series": len(self.series), "max_series": self.max_series}
+
+
+process_metrics = ProcessMetrics()
+
+
+class HostMetrics:
+    """Метрики машин (загрузка, CPU, память, диск) из того же опроса, что и список процессов.
+
+    На каждую машину — последний снимок и ряд фиксированного размера.
+    """
+
+    FIELDS = ("cpu_pct", "load1", "mem_used_pct", "swap_used_pct", "disk_used_pct")
+
+    def __init__(self):
+        self.series: Dict[int, MetricSeries] = {}
+        self.latest: Dict[int, Dict] = {}
+        self._cpu_counters: Dict[int, List[int]] = {}
+
+    def record(self, machine_id: int, sample: Dict, ts: float = None):
+        if not sample:
+            return
+        ts = ts or time.time()
+        sample = dict(sample)
+        counters = sample.pop("cpu_counters", None)
+        previous = self._cpu_counters.get(machine_id)
+        if counters:
+            self._cpu_counters[machine_id] = counters
+            if previous and counters[0] > previous[0]:
+                total = counters[0] - previous[0]
+                idle = counters[1] - previous[1]
+                sample["cpu_pct"] = round(100.0 * (1 - idle / total), 2)
+        sample["updated"] = ts
+        self.latest[machine_id] = sample
+        series = self.series.get(machine_id)
+        if series is None:
+            series = self.series[machine_id] = MetricSeries(self.FIELDS)
+        series.add(ts, {name: sample.get(name, 0.0) for name in self.FIELDS})
+
+    def forget(self, machine_id: int):
+        self.series.pop(machine_id, None)
+        self.latest.pop(machine_id, None)
+        self._cpu_counters.pop(machine_id, None)
+
+    def get_latest(self) -> Dict[int, Dict]:
+        return self.latest
+
+    def get_series(self, machine_id: int, since: float = None) -> Optional[Dict]:
+        series = self.series.get(machine_id)
+        if series is None:
+            return None
+        return {"machine_id": machine_id, "latest": self.latest.get(machine_id), **series.to_dict(since)}
+
+
+host_metrics = HostMetrics()
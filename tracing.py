@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+
+import config
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json, только медленнее
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Трассировка одного запроса или задания: суммарное время по фазам (db, ssh, json, ...).
+
+    Дочерние задачи asyncio наследуют контекст и пишут в ту же трассировку,
+    поэтому сумма по фазам может превышать общее время (фазы шли параллельно).
+    """
+
+    __slots__ = ("trace_id", "name", "started", "phases")
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        # фаза -> [суммарное время, число спанов, самый долгий спан, его имя]
+        self.phases: Dict[str, list] = {}
+
+    def add(self, phase: str, name: str, seconds: float):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, 1, seconds, name]
+            return
+        entry[0] += seconds
+        entry[1] += 1
+        if seconds > entry[2]:
+            entry[2], entry[3] = seconds, name
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self) -> str:
+        parts = []
+        for phase, (total, count, longest, longest_name) in sorted(
+                self.phases.items(), key=lambda item: item[1][0], reverse=True):
+            parts.append(f"{phase}={total:.3f}s/{count} (max {longest:.3f}s {longest_name})")
+        return ", ".join(parts) or "no spans"
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{phase};dur={total * 1000:.1f}"
+                         for phase, (total, *_rest) in self.phases.items())
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def start_trace(name: str) -> contextvars.Token:
+    return _current.set(Trace(name))
+
+
+def end_trace(token: contextvars.Token, threshold: float) -> Optional[Trace]:
+    """Завершает трассировку и пишет в лог разбивку, если она дольше threshold секунд."""
+    trace = _current.get()
+    _current.reset(token)
+    if trace is not None and threshold > 0 and trace.elapsed >= threshold:
+        logger.warning(f"Slow {trace.name} [{trace.trace_id}] {trace.elapsed:.3f}s: {trace.breakdown()}")
+    return trace
+
+
+class span:
+    """Спан фазы текущей трассировки: with span("ssh", "list"): ...
+
+    Без активной трассировки почти ничего не стоит.
+    """
+
+    __slots__ = ("phase", "name", "trace", "started")
+
+    def __init__(self, phase: str, name: str = ""):
+        self.phase = phase
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            self.trace.add(self.phase, self.name, time.perf_counter() - self.started)
+        return False
+
+
+def instrument_engine(engine):
+    """Время SQL-запросов попадает в фазу db текущей трассировки."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("trace_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current.get()
+        stack = conn.info.get("trace_started")
+        if trace is not None and stack:
+            trace.add("db", statement.split(None, 1)[0], time.perf_counter() - stack.pop())
+
+
+class TracedJSONResponse(JSONResponse):
+    """JSONResponse, у которого сериализация попадает в фазу json."""
+
+    def render(self, content) -> bytes:
+        with span("json", "render"):
+            return super().render(content)
+
+
+def render_json(content) -> bytes:
+    """Компактный JSON: orjson, если установлен, иначе стандартный json."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class TracingMiddleware:
+    """ASGI-middleware: трассировка на каждый HTTP-запрос, заголовок Server-Timing
+    и запись в лог медленных запросов."""
+
+    def __init__(self, app, threshold: float = None):
+        self.app = app
+        self.threshold = config.TRACE_SLOW_REQUEST if threshold is None else threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = start_trace(f"{scope['method']} {scope['path']}")
+        trace = _current.get()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and trace.phases:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            end_trace(token, self.threshold)
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик потока event loop: раз в interval секунд снимает стек
+    из отдельного потока. Результат — свёрнутые стеки (формат flamegraph.pl / speedscope).
+    """
+
+    def __init__(self):
+        self.running = False
+        self._lock = threading.Lock()
+
+    def _sample(self, thread_id: int, seconds: float, interval: float) -> Dict[str, int]:
+        stacks: Dict[str, int] = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                stacks[";".join(reversed(names))] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def profile(self, seconds: float, interval: float) -> str:
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Profiler is already running")
+            self.running = True
+        try:
+            thread_id = threading.get_ident()
+            stacks = await asyncio.get_running_loop().run_in_executor(
+                None, self._sample, thread_id, seconds, interval)
+            return "".join(f"{stack} {count}\n" for stack, count in
+                           sorted(stacks.items(), key=lambda item: item[1], reverse=True))
+        finally:
+            self.running = False
+
+
+profiler = SamplingProfiler()
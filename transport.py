@@ -0,0 +1,163 @@
+"""Профили транспорта SSH машин: шифры, MAC, сжатие, окно канала, размер пакета, keepalive.
+
+Профиль — словарь (хранится в machines.transport как JSON); отсутствующие поля берутся
+из настроек asyncssh по умолчанию. Учтите: по умолчанию asyncssh предлагает сжатие
+zlib@openssh.com первым, и с OpenSSH оно включается — для LAN это лишняя работа CPU,
+для медленных каналов — выигрыш на больших списках процессов.
+
+Подобрать профиль для хоста можно замером (SSHManager.calibrate_transport,
+POST /api/machines/{id}/transport/calibrate): встроенные профили PROFILES сравниваются
+по времени передачи выборки, похожей на настоящие опросы: строки ps aux хоста, повторённые
+до нужного объёма с новыми PID, ресурсами и TIME в каждой копии. Просто повторять ps aux
+нельзя — такая выборка сжимается в сотню раз, и замер всегда выбирал бы сжатие; случайные
+байты не сжимаются вовсе, и сжатие не выигрывало бы никогда.
+"""
+import statistics
+from typing import Dict, List, Optional
+
+import asyncssh
+
+import config
+
+# Окно канала и пакет: по умолчанию в asyncssh 2 МиБ и 32 КиБ
+MIN_WINDOW = 64 * 1024
+MAX_WINDOW = 256 * 1024 * 1024
+MIN_PKTSIZE = 4 * 1024
+# Больше OpenSSH не принимает (PACKET_MAX_SIZE)
+MAX_PKTSIZE = 256 * 1024
+
+COMPRESSION_ALGS = ["zlib@openssh.com", "zlib", "none"]
+
+PROFILES: Dict[str, Dict] = {
+    # Настройки asyncssh как есть
+    "default": {},
+    # Локальная сеть: AEAD-шифр с аппаратным AES, без сжатия
+    "lan": {
+        "ciphers": ["aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "chacha20-poly1305@openssh.com"],
+        "compression": False,
+        "window": 8 * 1024 * 1024,
+        "max_pktsize": 64 * 1024,
+    },
+    # Локальная сеть, хосты без AES-NI: chacha20 дешевле программного AES
+    "lan-chacha": {
+        "ciphers": ["chacha20-poly1305@openssh.com", "aes128-gcm@openssh.com"],
+        "compression": False,
+        "window": 8 * 1024 * 1024,
+        "max_pktsize": 64 * 1024,
+    },
+    # Медленный или дальний канал: сжатие и большое окно (задержка не съедает пропускную
+    # способность), keepalive чаще — обрыв NAT-сессии замечается раньше
+    "wan": {
+        "ciphers": ["aes128-gcm@openssh.com", "chacha20-poly1305@openssh.com"],
+        "compression": True,
+        "window": 16 * 1024 * 1024,
+        "max_pktsize": 64 * 1024,
+        "keepalive_interval": 15,
+    },
+}
+
+
+def normalize_profile(profile: Optional[Dict]) -> Optional[Dict]:
+    """Проверяет профиль из запроса и приводит его к хранимому виду (None — по умолчанию).
+
+    Неизвестные поля и алгоритмы, которых нет в asyncssh, — ValueError.
+    """
+    if not profile:
+        return None
+    if not isinstance(profile, dict):
+        raise ValueError("Transport profile must be an object")
+    unknown = set(profile) - {"name", "ciphers", "macs", "compression", "window",
+                              "max_pktsize", "keepalive_interval"}
+    if unknown:
+        raise ValueError(f"Unknown transport settings: {', '.join(sorted(unknown))}")
+
+    result: Dict = {}
+    if profile.get("name"):
+        result["name"] = str(profile["name"])
+    for field, supported in (("ciphers", asyncssh.encryption.get_encryption_algs()),
+                             ("macs", asyncssh.mac.get_mac_algs())):
+        algs = profile.get(field)
+        if algs is None:
+            continue
+        if isinstance(algs, str):
+            algs = [alg.strip() for alg in algs.split(",") if alg.strip()]
+        names = {alg.decode() for alg in supported}
+        bad = [alg for alg in algs if alg not in names]
+        if bad or not algs:
+            raise ValueError(f"Unsupported {field}: {', '.join(bad) or 'empty list'}")
+        result[field] = list(algs)
+    if profile.get("compression") is not None:
+        result["compression"] = bool(profile["compression"])
+    for field, low, high in (("window", MIN_WINDOW, MAX_WINDOW),
+                             ("max_pktsize", MIN_PKTSIZE, MAX_PKTSIZE)):
+        if profile.get(field) is None:
+            continue
+        value = int(profile[field])
+        if not low <= value <= high:
+            raise ValueError(f"{field} must be between {low} and {high}")
+        result[field] = value
+    if profile.get("keepalive_interval") is not None:
+        value = float(profile["keepalive_interval"])
+        if value < 0:
+            raise ValueError("keepalive_interval must not be negative")
+        result["keepalive_interval"] = value
+    return result or None
+
+
+def connect_options(profile: Optional[Dict]) -> Dict:
+    """Аргументы asyncssh.connect для профиля."""
+    profile = profile or {}
+    options = {"keepalive_interval": profile.get("keepalive_interval", config.SSH_KEEPALIVE_INTERVAL)}
+    if profile.get("ciphers"):
+        options["encryption_algs"] = profile["ciphers"]
+    if profile.get("macs"):
+        options["mac_algs"] = profile["macs"]
+    if "compression" in profile:
+        options["compression_algs"] = COMPRESSION_ALGS if profile["compression"] else ["none"]
+    if profile.get("window"):
+        options["window"] = profile["window"]
+    if profile.get("max_pktsize"):
+        options["max_pktsize"] = profile["max_pktsize"]
+    return options
+
+
+# Строки ps aux хоста по кругу до n байт; числовые столбцы в каждой строке новые,
+# как у разных процессов и разных опросов, USER/TTY/STAT/START и команда — настоящие
+SAMPLE_AWK = (
+    "NR > 1 { lines[++count] = $0 } "
+    "END { srand(); while (count && written < n) for (i = 1; i <= count && written < n; i++) { "
+    "split(lines[i], f); command = lines[i]; "
+    "for (k = 1; k <= 10; k++) sub(/^[ \\t]*[^ \\t]+[ \\t]+/, \"\", command); "
+    "line = sprintf(\"%-8s %7d %4.1f %4.1f %6d %5d %-8s %-4s %5s %3d:%02d %s\", f[1], "
+    "rand() * 4000000, rand() * 10, rand() * 5, rand() * 4000000, rand() * 400000, "
+    "f[7], f[8], f[9], rand() * 600, rand() * 60, command); "
+    "written += length(line) + 1; print line } }"
+)
+
+
+def sample_command(sample_bytes: int) -> str:
+    """Команда замера: sample_bytes байт строк ps aux хоста (см. SAMPLE_AWK).
+
+    Сжимается выборка примерно как настоящий опрос, поэтому на медленном канале
+    выигрывает профиль со сжатием, а в LAN — без него.
+    """
+    return f"ps aux 2>/dev/null | awk -v n={int(sample_bytes)} '{SAMPLE_AWK}' | head -c {int(sample_bytes)}"
+
+
+def summarize(name: str, profile: Dict, connect_seconds: float, latencies: List[float],
+              transfers: List[float], sample_bytes: int, connection) -> Dict:
+    """Итог замера профиля; score — медианное время передачи выборки (меньше — лучше)."""
+    latency = statistics.median(latencies)
+    transfer = statistics.median(transfers)
+    return {
+        "name": name,
+        "profile": profile,
+        # Выборка идёт от хоста к контроллеру — важны алгоритмы этого направления
+        "cipher": connection.get_extra_info("recv_cipher"),
+        "compression": connection.get_extra_info("recv_compression"),
+        "connect_seconds": round(connect_seconds, 4),
+        "latency_ms": round(latency * 1000, 2),
+        "transfer_seconds": round(transfer, 4),
+        "throughput_mbps": round(sample_bytes * 8 / max(transfer - latency, 1e-6) / 1e6, 1),
+        "score": round(transfer, 4),
+    }
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, Optional
+
+import config
+import crud
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionWarmer:
+    """Прогрев SSH-подключений: после старта подключается ко всем активным машинам
+    (не больше concurrency одновременно, со случайной задержкой старта) и держит
+    подключения открытыми, восстанавливая оборванные с экспоненциальной задержкой.
+
+    На каждую машину — своя задача-хранитель; список машин перечитывается раз в
+    refresh_interval секунд. С несколькими воркерами каждый прогревает только свои машины.
+    """
+
+    # Подключение, прожившее меньше этого (сек), считается неудачным: не даём
+    # хосту, который сразу рвёт соединение, крутить переподключения без паузы
+    STABLE_SECONDS = 30.0
+
+    def __init__(self, concurrency: int = None, jitter: float = None,
+                 backoff_base: float = None, backoff_max: float = None,
+                 refresh_interval: float = None):
+        self.concurrency = concurrency or config.WARMUP_CONCURRENCY
+        self.jitter = config.WARMUP_JITTER if jitter is None else jitter
+        self.backoff_base = backoff_base or config.RECONNECT_BACKOFF_BASE
+        self.backoff_max = backoff_max or config.RECONNECT_BACKOFF_MAX
+        self.refresh_interval = refresh_interval or config.WARMUP_REFRESH_INTERVAL
+        self.ssh_manager = None
+        self.keepers: Dict[int, asyncio.Task] = {}
+        self._targets: Dict[int, tuple] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, ssh_manager):
+        self.ssh_manager = ssh_manager
+        if config.WARMUP_ENABLED:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for machine_id in list(self.keepers):
+            self._stop_keeper(machine_id)
+
+    async def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Connection warm-up refresh failed: {e}", exc_info=True)
+            await asyncio.sleep(self.refresh_interval)
+
+    def _is_local(self, machine) -> bool:
+        router = self.ssh_manager.router
+        return router is None or router.is_local(machine.address, machine.ssh_port, machine.username)
+
+    def refresh(self):
+        """Запускает хранителей для новых активных машин и останавливает лишних."""
+        db = database.SessionLocal()
+        try:
+            targets = {m.id: (m.address, m.ssh_port, m.username, m.password)
+                       for m in crud.get_machines(db, limit=None)
+                       if m.is_active and self._is_local(m)}
+        finally:
+            db.close()
+
+        for machine_id in list(self.keepers):
+            if self._targets.get(machine_id) != targets.get(machine_id):
+                # Машину удалили, отключили или поменяли параметры подключения
+                self._stop_keeper(machine_id)
+        started = 0
+        for machine_id, target in targets.items():
+            if machine_id not in self.keepers:
+                self._targets[machine_id] = target
+                self.keepers[machine_id] = asyncio.create_task(self._keep(*target))
+                started += 1
+        if started:
+            logger.info(f"Connection warm-up: {started} new machines, {len(self.keepers)} total")
+
+    def _stop_keeper(self, machine_id: int):
+        task = self.keepers.pop(machine_id, None)
+        target = self._targets.pop(machine_id, None)
+        if task:
+            task.cancel()
+        if target:
+            self.ssh_manager.clear_readiness(*target[:3])
+
+    def backoff(self, failures: int) -> float:
+        """Экспоненциальная задержка с джиттером: [d/2, d], d = base * 2^(failures-1) <= max."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _keep(self, host: str, port: int, username: str, password: str):
+        ssh = self.ssh_manager
+        ssh.set_readiness(host, port, username, "cold")
+        # Разносим подключения во времени, чтобы не ударить по всем хостам разом
+        await asyncio.sleep(random.uniform(0, self.jitter))
+        failures = 0
+        while True:
+            ssh.set_readiness(host, port, username, "connecting", attempts=failures)
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    conn = await ssh.ensure_connection(host, port, username, password)
+                    ssh.set_readiness(host, port, username, "hot",
+                                      connect_seconds=round(time.perf_counter() - started, 3))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = self.backoff(failures)
+                ssh.set_readiness(host, port, username, "backoff", attempts=failures,
+                                  error=str(e) or type(e).__name__, retry_at=time.time() + delay)
+                logger.info(f"Warm-up connection to {host}:{port} failed ({failures}), retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            connected = time.monotonic()
+            await conn.wait_closed()
+            ssh.discard_connection(host, port, username, conn)
+            if time.monotonic() - connected >= self.STABLE_SECONDS:
+                failures = 0
+            else:
+                failures += 1
+                delay = self.backoff(failures)
+                ssh.set_readiness(host, port, username, "backoff", attempts=failures,
+                                  error="connection closed", retry_at=time.time() + delay)
+                await asyncio.sleep(delay)
+
+    async def stats(self) -> Dict:
+        states: Dict[str, int] = {}
+        for target in self._targets.values():
+            state = (await self.ssh_manager.connection_readiness(*target[:3]))["state"]
+            states[state] = states.get(state, 0) + 1
+        return {"enabled": bool(config.WARMUP_ENABLED), "machines": len(self.keepers), "states": states}
+
+
+warmer = ConnectionWarmer()
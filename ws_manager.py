@@ -0,0 +1,230 @@
+import asyncio
+import collections
+import json
+import logging
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+import config
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("coalesce", "drop_oldest", "disconnect")
+MAX_TOPICS_PER_MESSAGE = 50
+
+
+def topic_matches(subscription: str, topic: str) -> bool:
+    """Подписка на "processes" покрывает "processes" и все "processes:*"."""
+    if subscription == "*" or subscription == topic:
+        return True
+    return topic.startswith(subscription + ":")
+
+
+class ClientConnection:
+    """Клиент WebSocket с ограниченной исходящей очередью и своей задачей отправки."""
+
+    def __init__(self, websocket: WebSocket, max_queue: int, overflow_policy: str):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.queue: Deque[str] = collections.deque()
+        self.dropped = 0
+        self.sent = 0
+        self.closed = False
+        # None — клиент не подписывался и получает все обновления
+        self.topics: Optional[Set[str]] = None
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def wants(self, topic: str) -> bool:
+        if self.topics is None:
+            return True
+        return any(topic_matches(sub, topic) for sub in self.topics)
+
+    def start(self, on_failure):
+        self._writer = asyncio.create_task(self._write_loop(on_failure))
+
+    def enqueue(self, message: str) -> bool:
+        """Кладёт сообщение в очередь. Возвращает False, если клиента нужно отключить."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_queue:
+            if self.overflow_policy == "disconnect":
+                return False
+            if self.overflow_policy == "coalesce" and message in self.queue:
+                # Такое же сообщение уже ждёт отправки — новое ничего не добавит
+                self.dropped += 1
+                return True
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(message)
+        self._wakeup.set()
+        return True
+
+    async def _write_loop(self, on_failure):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue:
+                    message = self.queue.popleft()
+                    await asyncio.wait_for(self.websocket.send_text(message),
+                                           timeout=config.WS_SEND_TIMEOUT)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"WebSocket send error: {e}")
+            on_failure(self)
+
+    async def close(self):
+        self.closed = True
+        self.queue.clear()
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    def __init__(self, max_queue: int = None, overflow_policy: str = None):
+        self.max_queue = max_queue or config.WS_QUEUE_SIZE
+        policy = overflow_policy or config.WS_OVERFLOW_POLICY
+        if policy not in OVERFLOW_POLICIES:
+            logger.warning(f"Unknown WebSocket overflow policy '{policy}', using 'coalesce'")
+            policy = "coalesce"
+        self.overflow_policy = policy
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.disconnected_slow = 0
+        self.coalesce_window = config.WS_COALESCE_WINDOW
+        self._pending_topics: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.notifications_received = 0
+        self.notifications_sent = 0
+        # Публикация в межпроцессную шину (подключается кластером при нескольких воркерах)
+        self.bus_publish = None
+        # Кто ещё должен узнать об изменении темы (например, кэш ответов)
+        self.listeners: List[Callable[[str], None]] = []
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients.keys())
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = ClientConnection(websocket, self.max_queue, self.overflow_policy)
+        self.clients[websocket] = client
+        client.start(self._drop_client)
+        logger.info(
+            f"WebSocket connected. Total connections: {len(self.clients)}")
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client:
+            client.closed = True
+            client.queue.clear()
+            if client._writer:
+                client._writer.cancel()
+        logger.info(
+            f"WebSocket disconnected. Total connections: {len(self.clients)}")
+
+    def _drop_client(self, client: ClientConnection):
+        """Отключает клиента, который не успевает читать или отвалился."""
+        if self.clients.pop(client.websocket, None) is None:
+            return
+        self.disconnected_slow += 1
+        asyncio.create_task(client.close())
+        logger.info(
+            f"WebSocket client dropped. Total connections: {len(self.clients)}")
+
+    def send_nowait(self, websocket: WebSocket, message: str):
+        client = self.clients.get(websocket)
+        if client and not client.enqueue(message):
+            self._drop_client(client)
+
+    def _publish(self, kind: str, value: str):
+        if self.bus_publish is not None:
+            asyncio.create_task(self.bus_publish(kind, value))
+
+    def broadcast_nowait(self, message: str, local_only: bool = False):
+        """Неблокирующая рассылка: только кладёт сообщение в очереди клиентов."""
+        if not local_only:
+            self._publish("broadcast", message)
+        for client in list(self.clients.values()):
+            if not client.enqueue(message):
+                self._drop_client(client)
+
+    async def broadcast(self, message: str):
+        self.broadcast_nowait(message)
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        client = self.clients.get(websocket)
+        if not client:
+            return []
+        if client.topics is None:
+            client.topics = set()
+        client.topics.update(str(t) for t in topics if t)
+        return sorted(client.topics)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        client = self.clients.get(websocket)
+        if not client:
+            return []
+        if client.topics is None:
+            client.topics = set()
+        client.topics.difference_update(topics)
+        return sorted(client.topics)
+
+    def notify(self, topic: str, local_only: bool = False):
+        """Сообщает об изменении темы. Уведомления склеиваются в окне coalesce_window."""
+        if not local_only:
+            self._publish("notify", topic)
+        self.notifications_received += 1
+        for listener in self.listeners:
+            listener(topic)
+        self._pending_topics.add(topic)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.coalesce_window, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending_topics = self._pending_topics, set()
+        if not pending:
+            return
+        for client in list(self.clients.values()):
+            # Одно сообщение на сущность, со списком затронутых тем
+            by_entity: Dict[str, List[str]] = {}
+            for topic in pending:
+                if client.wants(topic):
+                    by_entity.setdefault(topic.split(":", 1)[0], []).append(topic)
+            for entity, topics in by_entity.items():
+                if len(topics) > MAX_TOPICS_PER_MESSAGE:
+                    # Слишком много частных тем — клиенту проще обновить всю сущность
+                    topics = [entity]
+                message = json.dumps({"type": "update", "entity": entity,
+                                      "topics": sorted(topics)})
+                self.notifications_sent += 1
+                if not client.enqueue(message):
+                    self._drop_client(client)
+                    break
+
+    def stats(self) -> Dict:
+        depths = [len(c.queue) for c in self.clients.values()]
+        return {
+            "clients": len(self.clients),
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths) if depths else 0,
+            "dropped_messages": sum(c.dropped for c in self.clients.values()),
+            "disconnected_slow": self.disconnected_slow,
+            "notifications_received": self.notifications_received,
+            "notifications_sent": self.notifications_sent,
+        }
+
+
+manager = ConnectionManager()